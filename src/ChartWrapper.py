@@ -1,25 +1,91 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import Dict
+from queue import Queue
+from typing import Dict, List, Optional, Sequence
 
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
 from lightweight_charts import Chart
 from lightweight_charts.abstract import Line
-from pandas import HDFStore
 
-from config import Config
-from backtest.backtest_vectorbt import ma_150_crossed, cci_cross_zero2, moving_avg_breakout
+from src.config import Config
+from src.price_store import PriceStore, open_price_store
+from src.indicator_cache import IndicatorCache, IndicatorLookup
+from src.backtest.backtest_vectorbt import STRATEGIES, price_arrays
+from src.backtest.streaming_strategies import (STREAMING_STRATEGIES, CommodityChannelIndex, RollingMean,
+                                               StreamingState)
+
+
+def signal_markers(index: pd.Index, entry_signal: np.ndarray, exit_signal: np.ndarray) -> List[dict]:
+    """
+    Returns the markers of entry (green) and exit (red) signals as one time-sorted list for a single marker_list call.
+    """
+    entry_bars = np.flatnonzero(entry_signal)
+    exit_bars = np.flatnonzero(exit_signal)
+    bars = np.concatenate([entry_bars, exit_bars])
+    colors = np.repeat(np.array(['green', 'red']), [len(entry_bars), len(exit_bars)])
+    order = np.argsort(bars, kind='stable')
+    return [{'time': bar_time, 'position': 'below', 'color': color, 'shape': 'circle', 'text': ''}
+            for bar_time, color in zip(index[bars[order]], colors[order].tolist())]
+
 
 class ChartWrapper:
-    def __init__(self, store: HDFStore):
+    """
+    Chart of one symbol at a time. Only a recent window of bars is loaded on a symbol switch; older windows are
+    loaded when scrolling back to the start of the loaded bars. Windows of the likely next symbols (the given
+    symbols list and recent searches) are read ahead on a background thread. New bars are pushed incrementally
+    (update_bar), which also drives the bar-replay mode (replay).
+
+    Parameters:
+        store (PriceStore): Price store to chart.
+        window (DateOffset): Span of the window loaded at a time.
+        prefetch_symbols (Sequence[str]): Symbols likely to be opened next, in order (e.g. the tickers list).
+        prefetch_count (int): Number of symbols read ahead after each switch.
+        cached_windows (int): Number of loaded windows kept in memory.
+        strategy (str): Strategy in backtest_vectorbt.STRATEGIES whose signals are drawn as markers.
+    """
+
+    # older bars are loaded when fewer bars than this are left before the visible range
+    scroll_back_margin = 50
+
+    def __init__(self, store: PriceStore, window: pd.DateOffset = pd.DateOffset(years=2),
+                 prefetch_symbols: Sequence[str] = (), prefetch_count: int = 5, cached_windows: int = 32,
+                 strategy: str = 'moving_avg_breakout'):
         self.chart = Chart(inner_width=1, inner_height=0.7)
         self.store = store
-        self.existing_symbols = {key[1:] for key in store.keys()}
+        self.existing_symbols = store.symbols()
+        # indicators are served from the store's indicator cache, so switching back to a symbol doesn't recompute them
+        self.indicator_cache = IndicatorCache(store)
         self.current_indicators: Dict[str, Line] = {}
 
+        self.window = window
+        self.symbol: Optional[str] = None
+        self.df: Optional[pd.DataFrame] = None
+        self.history_loaded = False
+        self.strategy = strategy
+        self._streams: Optional[Dict[str, StreamingState]] = None
+        self._replay_thread: Optional[threading.Thread] = None
+        self._replay_stop = threading.Event()
+
+        # loaded windows by symbol; the store and this cache are shared with the prefetch thread under the lock
+        self._windows: 'OrderedDict[str, pd.DataFrame]' = OrderedDict()
+        self.cached_windows = cached_windows
+        self._store_lock = threading.Lock()
+        self.prefetch_symbols = [symbol for symbol in prefetch_symbols if symbol in self.existing_symbols]
+        self.prefetch_count = prefetch_count
+        self.recent_symbols = deque(maxlen=prefetch_count)
+        self._prefetch_queue: Queue = Queue()
+        threading.Thread(target=self._prefetch_worker, daemon=True).start()
+
         self.chart.legend(True)
         self.chart.events.search += self.on_search
+        self.chart.events.range_change += self.on_range_change
         self.chart.topbar.textbox('symbol', 'AAPL')
+        self.chart.topbar.button('replay', 'Replay', func=self.on_replay_button)
 
         self.subchart = self.chart.create_subchart(width=1, height=0.3, sync=True)
 
@@ -29,92 +95,270 @@ class ChartWrapper:
     def set_data(self, symbol: str) -> bool:
         if symbol not in self.existing_symbols:
             return False
+        self.stop_replay()
 
-        df: pd.DataFrame = store.get(symbol)
+        with self._store_lock:
+            df = self._windows.get(symbol)
+            if df is None:
+                df = self._read_window(symbol)
+            self._remember_window(symbol, df)
+        self.symbol = symbol
+        self.history_loaded = False
 
         self.chart.watermark(symbol)
+        self._show(df)
 
-        df.columns = df.columns.str.lower()
-        self.chart.set(df)
-
-        self._draw_indicators(df)
-        self._draw_signals(df)
+        if symbol in self.recent_symbols:
+            self.recent_symbols.remove(symbol)
+        self.recent_symbols.appendleft(symbol)
+        self._schedule_prefetch(symbol)
 
         return True
 
-    def _draw_indicators(self, df: pd.DataFrame):
-        self._draw_smas(df)
-        self._draw_cci(df)
-
-    def _draw_signals(self, df: pd.DataFrame):
-        # Generate signals using both strategies
-        # ma_enter, ma_exit = ma_150_crossed(df)
-        cci_enter, cci_exit = moving_avg_breakout(df)
-
-        # Create markers for enter signals
-        enter_markers = [
-            {
-                'time': time, 'position': 'below', 'color': 'green', 'shape': 'circle', 'text': ''
-            }
-            for time in df.index[cci_enter]
-        ]
-
-        # Create markers for exit signals
-        exit_markers = [
-            {
-                'time': time, 'position': 'below', 'color': 'red', 'shape': 'circle', 'text': ''
-            }
-            for time in df.index[cci_exit]
-        ]
-
-        # Add markers to the chart
-        self.chart.marker_list(exit_markers)
-        self.chart.marker_list(enter_markers)
-
-    def _draw_smas(self, df: pd.DataFrame):
-        sma = df.ta.sma(length=20).to_frame()
-        sma = sma.rename(columns={"Date": "time", "SMA_20": "value"})
-        sma = sma.dropna()
+    def _show(self, df: pd.DataFrame):
+        self.df = df
+        self._streams = None
+        self.chart.set(df)
 
-        # add sma line
-        sma_line = self.current_indicators.setdefault('sma_20', self.chart.create_line())
-        sma_line.set(sma)
+        indicators = self.indicator_cache.for_symbol(self.symbol, df)
+        self._draw_indicators(df, indicators)
+        self._draw_signals(df, indicators)
+
+    def _window_start(self, end: pd.Timestamp) -> pd.Timestamp:
+        # windows start on a month boundary, so the same window (and its cached indicators) is reused for a month
+        return (end - self.window).normalize().replace(day=1)
 
-    def _draw_cci(self, df: pd.DataFrame):
-        cci = df.ta.cci(length=14).to_frame()
-        cci = cci.rename(columns={"Date": "time", cci.columns[-1]: "value"})
+    def _read_window(self, symbol: str) -> pd.DataFrame:
+        # the store lock must be held
+        entry = self.store.catalog.get(symbol) if self.store.catalog else None
+        last_bar = pd.Timestamp(entry.last_bar) if entry else self.store.last_bar(symbol)
+        df = self.store.read(symbol, start=self._window_start(last_bar))
+        df.columns = df.columns.str.lower()
+        return df
+
+    def _remember_window(self, symbol: str, df: pd.DataFrame):
+        # the store lock must be held
+        self._windows[symbol] = df
+        self._windows.move_to_end(symbol)
+        while len(self._windows) > self.cached_windows:
+            self._windows.popitem(last=False)
+
+    def _schedule_prefetch(self, symbol: str):
+        candidates = list(self.recent_symbols)
+        if symbol in self.prefetch_symbols:
+            position = self.prefetch_symbols.index(symbol)
+            candidates += self.prefetch_symbols[position + 1:position + 1 + self.prefetch_count]
+        else:
+            candidates += self.prefetch_symbols[:self.prefetch_count]
+        for candidate in candidates:
+            if candidate != symbol:
+                self._prefetch_queue.put(candidate)
+
+    def _prefetch_worker(self):
+        while True:
+            symbol = self._prefetch_queue.get()
+            if symbol is None:
+                return
+            try:
+                with self._store_lock:
+                    if symbol not in self._windows:
+                        self._remember_window(symbol, self._read_window(symbol))
+                        self._windows.move_to_end(symbol, last=False)  # prefetched windows are evicted first
+            except Exception as e:
+                logging.warning(f"Prefetching {symbol} failed: {e}")
+
+    def on_range_change(self, chart: Chart, bars_before: float, bars_after: float):
+        if self.df is None or self.history_loaded or self.replaying or bars_before > self.scroll_back_margin:
+            return
+        first_bar = self.df.index[0]
+        entry = self.store.catalog.get(self.symbol) if self.store.catalog else None
+        with self._store_lock:
+            older = self.store.read(self.symbol, start=self._window_start(first_bar),
+                                    end=first_bar - pd.Timedelta(1, 'ns'))
+        older.columns = older.columns.str.lower()
+        if len(older) == 0 or (entry and older.index[0] <= pd.Timestamp(entry.first_bar)):
+            self.history_loaded = True
+        if len(older) == 0:
+            return
 
-        # get/create cci lines
-        cci_line = self.current_indicators.setdefault('cci_line', self.subchart.create_line())
+        # keep the bars in view where they are once the older ones are prepended
+        visible_from = self.df.index[min(max(int(bars_before), 0), len(self.df) - 1)]
+        visible_to = self.df.index[max(len(self.df) - 1 - max(int(bars_after), 0), 0)]
+        df = pd.concat([older, self.df])
+        with self._store_lock:
+            self._remember_window(self.symbol, df)
+        self._show(df)
+        self.chart.set_visible_range(visible_from, visible_to)
+
+    def _draw_indicators(self, df: pd.DataFrame, indicators: IndicatorLookup):
+        self._draw_smas(df, indicators)
+        self._draw_cci(df, indicators)
+
+    def _draw_signals(self, df: pd.DataFrame, indicators: IndicatorLookup):
+        # strategies take price arrays and never add columns to the chart's frame
+        entry_signal, exit_signal = STRATEGIES[self.strategy](**price_arrays(df), indicators=indicators)
+
+        # all markers are sent in one batch, replacing the previous symbol's
+        self.chart.clear_markers()
+        self.chart.marker_list(signal_markers(df.index, entry_signal, exit_signal))
+
+    def _line(self, name: str, chart, **line_kwargs) -> Line:
+        # lines are created once and reused across symbols
+        line = self.current_indicators.get(name)
+        if line is None:
+            line = self.current_indicators[name] = chart.create_line(**line_kwargs)
+        return line
+
+    def _draw_smas(self, df: pd.DataFrame, indicators: IndicatorLookup):
+        sma = pd.DataFrame({'value': indicators('sma', window=20)}, index=df.index)
+        sma = sma.dropna()
 
-        cci_upper_line = self.current_indicators.setdefault('cci_upper_line', self.subchart.create_line(color='red'))
-        cci_upper_df = cci.copy()
-        cci_upper_df[cci_upper_df.columns[-1]] = 100
-        cci_upper_line.set(cci_upper_df)
+        # add sma line
+        self._line('sma_20', self.chart).set(sma)
+
+    def _draw_cci(self, df: pd.DataFrame, indicators: IndicatorLookup):
+        cci = pd.DataFrame({'value': indicators('cci', window=14)}, index=df.index)
+
+        if 'cci_line' not in self.current_indicators:
+            cci_line = self._line('cci_line', self.subchart)
+            # constant reference levels are price lines of the cci series, not series of their own
+            cci_line.horizontal_line(100, color='red')
+            cci_line.horizontal_line(0, color='white', width=1)
+            cci_line.horizontal_line(-100, color='green')
+        self.current_indicators['cci_line'].set(cci)
+
+    def update_bar(self, bar: pd.Series):
+        """
+        Pushes a new completed bar (labels: open, high, low, close, volume; name: bar time) to the chart.
+        Only the new points of the candles, indicators and markers are sent, the indicators being updated
+        by streaming indicators instead of recomputed over the loaded bars.
+        """
+        bar_time = pd.Timestamp(bar.name)
+        if self.df is None or bar_time <= self.df.index[-1]:
+            return
+        bar = bar.rename(str.lower)
+        new_bar = bar.reindex(self.df.columns).to_frame(bar_time).T.astype(self.df.dtypes)
+        new_bar.index.name = self.df.index.name
+        self._push_bar(bar_time, bar)
+        self.df = pd.concat([self.df, new_bar])
+        # the cached window gets the bar too, so switching back shows it and rebuilds the streams over it
+        with self._store_lock:
+            self._remember_window(self.symbol, self.df)
+
+    def _push_bar(self, bar_time: pd.Timestamp, bar: pd.Series):
+        # sends one bar after self.df (lower-case labels) and its indicator points and signal markers
+        if self._streams is None:
+            self._streams = self._init_streams(self.df)
+        high, low, close = float(bar['high']), float(bar['low']), float(bar['close'])
+        self.chart.update(pd.concat([pd.Series({'time': bar_time}), bar]))
+
+        sma = self._streams['sma'].update(close)
+        cci = self._streams['cci'].update(high, low, close)
+        for name, value in (('sma_20', sma), ('cci_line', cci)):
+            if not math.isnan(value):
+                self.current_indicators[name].update(pd.Series({'time': bar_time, 'value': value}))
+        entry_signal, exit_signal = self._streams['signals'].update(high, low, close)
+        if entry_signal or exit_signal:
+            # the library re-sends the whole marker list on every marker, so only signal bars pay it
+            self.chart.marker(time=bar_time, position='below', shape='circle', color='green' if entry_signal else 'red')
+
+    def replay(self, start=None, speed: float = 10.0, symbol: Optional[str] = None) -> bool:
+        """
+        Replays the symbol's bars from `start` on a background thread, `speed` bars per second.
+        The chart first shows the window before `start`; each following bar is then pushed with update-style
+        calls and the strategy and indicators are evaluated incrementally (see update_bar), so the candle and
+        indicator updates of a tick cost the same however far into the history the replay is. A bar with a signal
+        also re-sends every marker drawn so far (lightweight_charts sets markers as one list), which grows with
+        the replayed signals.
+
+        Parameters:
+            start: First replayed bar (defaults to the start of the currently loaded window).
+            speed (float): Bars per second.
+            symbol (str): Symbol to replay (defaults to the current one).
+
+        Returns:
+            bool: False if the symbol isn't in the store, or no start is given before any symbol is loaded.
+        """
+        self.stop_replay()
+        symbol = symbol or self.symbol
+        if symbol not in self.existing_symbols or (start is None and self.df is None):
+            return False
+        start = pd.Timestamp(start) if start is not None else self.df.index[0]
+        with self._store_lock:
+            df = self.store.read(symbol, start=self._window_start(start))
+        df.columns = df.columns.str.lower()
+        cursor = max(int(df.index.searchsorted(start)), 1)
 
-        cci_middle_line = self.current_indicators.setdefault('cci_middle_line', self.subchart.create_line(color='white', width=1))
-        cci_middle_df = cci.copy()
-        cci_middle_df[cci_middle_df.columns[-1]] = 0
-        cci_middle_line.set(cci_middle_df)
+        self.symbol = symbol
+        self.history_loaded = False
+        self.chart.watermark(symbol)
+        self.chart.topbar['symbol'].set(symbol)
+        self._show(df.iloc[:cursor])
 
-        cci_lower_line = self.current_indicators.setdefault('cci_lower_line', self.subchart.create_line(color='green'))
-        cci_lower_df = cci.copy()
-        cci_lower_df[cci_lower_df.columns[-1]] = -100
-        cci_lower_line.set(cci_lower_df)
+        self._replay_stop = threading.Event()
+        self._replay_thread = threading.Thread(target=self._replay_worker,
+                                               args=(df, cursor, speed, self._replay_stop), daemon=True)
+        self._replay_thread.start()
+        return True
 
-        cci_line.set(cci)
+    def _replay_worker(self, df: pd.DataFrame, cursor: int, speed: float, stop: threading.Event):
+        values = df.to_numpy()
+        next_tick = time.perf_counter()
+        for i in range(cursor, len(df)):
+            if stop.is_set():
+                return
+            self._push_bar(df.index[i], pd.Series(values[i], index=df.columns))
+            # the loaded frame is a slice of the replayed one, never rebuilt
+            self.df = df.iloc[:i + 1]
+            next_tick += 1.0 / speed
+            stop.wait(max(0.0, next_tick - time.perf_counter()))
+
+    @property
+    def replaying(self) -> bool:
+        return self._replay_thread is not None and self._replay_thread.is_alive()
+
+    def stop_replay(self):
+        if self._replay_thread is None:
+            return
+        self._replay_stop.set()
+        if self._replay_thread is not threading.current_thread():
+            self._replay_thread.join()
+        self._replay_thread = None
+
+    def on_replay_button(self, chart: Chart):
+        if self.replaying:
+            self.stop_replay()
+        else:
+            self.replay()
+
+    def _init_streams(self, df: pd.DataFrame) -> Dict[str, StreamingState]:
+        # streaming state of the drawn indicators and signals, replayed over the loaded bars
+        prices = price_arrays(df)
+        streams = {'sma': RollingMean(20), 'cci': CommodityChannelIndex(14),
+                   'signals': STREAMING_STRATEGIES[self.strategy]()}
+        for high, low, close in zip(prices['high'].tolist(), prices['low'].tolist(), prices['close'].tolist()):
+            streams['sma'].update(close)
+            streams['cci'].update(high, low, close)
+        streams['signals'].run(**prices)
+        return streams
 
     def show(self):
         self.chart.show(block=True)
 
     def on_search(self, chart: Chart, searched_string: str):
-        found = self.set_data(searched_string)
+        # resolve the search from the symbol catalog (case-insensitive, exact match first)
+        matches = self.store.catalog.search(searched_string, limit=1) if self.store.catalog else []
+        symbol = matches[0] if matches else searched_string
+        found = self.set_data(symbol)
         if not found:
             return
-        chart.topbar['symbol'].set(searched_string)
+        chart.topbar['symbol'].set(symbol)
 
     def close(self):
-        self.store.close()
+        self.stop_replay()
+        self._prefetch_queue.put(None)
+        with self._store_lock:
+            self.store.close()
 
 if __name__ == '__main__':
 
@@ -122,8 +366,8 @@ if __name__ == '__main__':
     # df = pd.read_csv('ohlcv.csv')
     tickers = Config.get_tickers_list()
     h5_file_path = Path(Config.eod_price_data_stooq_path)
-    with pd.HDFStore(h5_file_path.resolve(), 'r+') as store:
-        chart_wrapper = ChartWrapper(store)
+    with open_price_store(str(h5_file_path.resolve()), 'r') as store:
+        chart_wrapper = ChartWrapper(store, prefetch_symbols=tickers)
         chart_wrapper.show()
 
         # chart.legend(True)
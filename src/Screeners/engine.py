@@ -0,0 +1,284 @@
+import argparse
+import ast
+import logging
+import re
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from src.backtest.backtest_vectorbt import STRATEGIES
+from src.config import Config
+from src.indicators import INDICATORS
+from src.panel import Panel, refresh_panel
+from src.price_store import open_price_store
+
+# a (bars x symbols) array, or a scalar broadcast against them
+Values = Union[np.ndarray, float]
+
+# shorthand names of windowed indicators: MA150 == sma(150), CCI20 == cci(20)
+_SHORTHAND = re.compile(r'^(sma|ma|atr|cci)(\d+)$', re.IGNORECASE)
+
+_COMPARISONS = {
+    ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+    ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide, ast.Pow: np.power}
+
+
+def _lag(values: np.ndarray, periods: int = 1) -> np.ndarray:
+    lagged = np.full(values.shape, np.nan)
+    if periods < len(values):
+        lagged[periods:] = values[:len(values) - periods]
+    return lagged
+
+
+def _rolling(values: np.ndarray, window: int, reduce: Callable) -> np.ndarray:
+    out = np.full(values.shape, np.nan)
+    if window <= len(values):
+        windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+        out[window - 1:] = reduce(windows, axis=-1)
+    return out
+
+
+def _rolling_any(mask: np.ndarray, window: int) -> np.ndarray:
+    counts = np.cumsum(mask, axis=0)
+    counts_before = np.zeros_like(counts)
+    counts_before[window:] = counts[:-window]
+    return counts - counts_before > 0
+
+
+class Screener:
+    """
+    Evaluates screening expressions over the last `lookback` bars of a panel for all symbols at once: fields,
+    indicators and strategy signals are (bars x symbols) arrays and conditions are element-wise, so a screen of
+    the whole universe is a few numpy passes instead of a loop over symbols.
+
+    Expressions are Python-like and parsed with `ast` (nothing is eval'ed). They combine the panel fields
+    (open, high, low, close, volume, dollar_volume), numbers, arithmetic, comparisons, and/or/not and the
+    functions of the screener, e.g.
+        close > MA150 and crossed_above(cci(14), 0) and avg_dollar_volume(20) > 20e6
+        entry('cci_cross_zero2', within=3) and close > 1.1 * lowest(low, 50)
+    Functions:
+        sma/atr/cci(window, ...): indicators.INDICATORS; MA150, ATR14, CCI20 are shorthands.
+        avg_dollar_volume(window=20), returns(window=1), highest(values, window), lowest(values, window),
+        shift(values, periods=1), crossed_above(a, b), crossed_below(a, b).
+        entry/exit(strategy, within=1, **params): a signal of backtest_vectorbt.STRATEGIES in the last
+            `within` bars.
+    Sub-expressions are computed once per screener, so screens sharing indicators reuse them.
+
+    Indicators see only the lookback: averages of longer windows are NaN, and history-dependent ones (ATR,
+    strategy position state) start at the first bar of the lookback, so keep it a few times the longest window.
+    A symbol with no bar at the screening date fails every condition.
+    """
+
+    def __init__(self, panel: Panel, lookback: int = 400, symbols: Optional[Sequence[str]] = None,
+                 at: Optional[pd.Timestamp] = None):
+        """
+        Parameters:
+            panel (Panel): Panel of the universe (see panel.open_panel).
+            lookback (int): Number of bars the expressions are evaluated over, up to the screening date.
+            symbols (Sequence[str]): Symbols to screen (defaults to the whole panel).
+            at (Timestamp): Screening date, the last panel date at or before it (defaults to the last date).
+        """
+        self.panel = panel
+        end = len(panel.dates) if at is None else int(panel.dates.searchsorted(pd.Timestamp(at), side='right'))
+        if end == 0:
+            raise ValueError("The panel has no bars at the screening date")
+        self.rows = slice(max(0, end - lookback), end)
+        self.date = panel.dates[end - 1]
+        self.symbols = list(panel.symbols if symbols is None else symbols)
+        self._columns = None if symbols is None else panel.columns(self.symbols)
+        self._results: Dict[str, Values] = {}
+        self._functions: Dict[str, Callable[..., Values]] = {
+            'avg_dollar_volume': self.avg_dollar_volume,
+            'returns': self.returns,
+            'highest': lambda values, window: _rolling(values, window, np.max),
+            'lowest': lambda values, window: _rolling(values, window, np.min),
+            'shift': lambda values, periods=1: _lag(np.asarray(values, dtype=np.float64), periods),
+            'crossed_above': self.crossed_above,
+            'crossed_below': lambda a, b: self.crossed_above(b, a),
+            'entry': lambda strategy, within=1, **params: self.signal(strategy, 0, within, **params),
+            'exit': lambda strategy, within=1, **params: self.signal(strategy, 1, within, **params),
+        }
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        Returns a panel field over the lookback as a (bars x symbols) float array.
+        """
+        key = f'field:{name}'
+        if key not in self._results:
+            if name == 'dollar_volume':
+                values = self.field('close') * self.field('volume')
+            else:
+                values = self.panel.field(name)[self.rows]
+                values = np.array(values if self._columns is None else values[:, self._columns], dtype=np.float64)
+            self._results[key] = values
+        return self._results[key]
+
+    def indicator(self, name: str, *args, **params) -> np.ndarray:
+        """
+        Returns a registered indicator (see indicators.INDICATORS) of every symbol; a positional argument is the window.
+        """
+        if args:
+            params['window'] = args[0]
+        key = f'indicator:{name}:{sorted(params.items())}'
+        if key not in self._results:
+            indicator = INDICATORS[name]
+            prices = {input_name: self.field(input_name) for input_name in indicator.inputs}
+            self._results[key] = indicator.compute(prices, **params)
+        return self._results[key]
+
+    def avg_dollar_volume(self, window: int = 20) -> np.ndarray:
+        key = f'avg_dollar_volume:{window}'
+        if key not in self._results:
+            self._results[key] = INDICATORS['sma'].fn(self.field('dollar_volume'), window=window)
+        return self._results[key]
+
+    def returns(self, window: int = 1) -> np.ndarray:
+        close = self.field('close')
+        return close / _lag(close, window) - 1
+
+    def crossed_above(self, a: Values, b: Values) -> np.ndarray:
+        """
+        True on the bars `a` crosses above `b` (either can be a number).
+        """
+        shape = (self.rows.stop - self.rows.start, len(self.symbols))
+        a, b = (np.broadcast_to(np.asarray(v, dtype=np.float64), shape) for v in (a, b))
+        return (a > b) & (_lag(a) <= _lag(b))
+
+    def signal(self, strategy: str, side: int, within: int = 1, **params) -> np.ndarray:
+        """
+        True where the strategy fired an entry (side 0) or exit (side 1) signal in the last `within` bars.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        key = f'strategy:{strategy}:{sorted(params.items())}'
+        if key not in self._results:
+            self._results[key] = STRATEGIES[strategy](self.field('high'), self.field('low'), self.field('close'),
+                                                      **params)
+        return _rolling_any(self._results[key][side], within)
+
+    def evaluate(self, expression: str) -> Values:
+        """
+        Returns the (bars x symbols) values of an expression (a scalar for constant expressions).
+        """
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid screen expression {expression!r}: {e.msg}") from None
+        return self._eval(tree.body)
+
+    def _eval(self, node: ast.AST) -> Values:
+        key = ast.dump(node)
+        if key not in self._results:
+            self._results[key] = self._eval_node(node)
+        return self._results[key]
+
+    def _eval_node(self, node: ast.AST) -> Values:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self._name(node.id)
+        if isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            values = [np.asarray(self._eval(value), dtype=np.bool_) for value in node.values]
+            result = values[0]
+            for value in values[1:]:
+                result = combine(result, value)
+            return result
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return np.logical_not(np.asarray(self._eval(node.operand), dtype=np.bool_))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self._eval(node.operand)
+            return np.negative(operand) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return _OPERATORS[type(node.op)](self._eval(node.left), self._eval(node.right))
+        if isinstance(node, ast.Compare) and all(type(op) in _COMPARISONS for op in node.ops):
+            # chained comparisons (a < b < c) are the conjunction of each pair; NaN compares False
+            result, left = True, self._eval(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._eval(comparator)
+                result = np.logical_and(result, _COMPARISONS[type(op)](left, right))
+                left = right
+            return result
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            args = [self._eval(arg) for arg in node.args]
+            kwargs = {keyword.arg: self._eval(keyword.value) for keyword in node.keywords if keyword.arg}
+            if node.func.id in INDICATORS:
+                return self.indicator(node.func.id, *args, **kwargs)
+            if node.func.id in self._functions:
+                return self._functions[node.func.id](*args, **kwargs)
+            raise ValueError(f"Unknown screen function: {node.func.id}")
+        raise ValueError(f"Unsupported screen expression: {ast.unparse(node)}")
+
+    def _name(self, name: str) -> Values:
+        if name in self.panel.fields or name == 'dollar_volume':
+            return self.field(name)
+        shorthand = _SHORTHAND.match(name)
+        if shorthand:
+            indicator = shorthand.group(1).lower()
+            return self.indicator('sma' if indicator == 'ma' else indicator, int(shorthand.group(2)))
+        raise ValueError(f"Unknown screen name: {name}")
+
+    def _last(self, expression: str) -> np.ndarray:
+        values = np.asarray(self.evaluate(expression))
+        if values.ndim == 2:
+            return values[-1]
+        return np.broadcast_to(values, (len(self.symbols),))
+
+    def screen(self, expression: str, rank_by: str = 'avg_dollar_volume(20)', ascending: bool = False,
+               limit: Optional[int] = None) -> pd.Series:
+        """
+        Returns the symbols passing the expression at the screening date, ranked.
+
+        Parameters:
+            expression (str): Screen condition (see the class docstring).
+            rank_by (str): Expression the passing symbols are ranked by (NaN ranks last).
+            ascending (bool): Rank the lowest values first.
+            limit (int): Maximum number of symbols returned.
+
+        Returns:
+            Series: `rank_by` values indexed by the passing symbols, in rank order.
+        """
+        passed = np.asarray(self._last(expression), dtype=np.bool_)
+        score = self._last(rank_by).astype(np.float64)
+        ranked = pd.Series(score[passed], index=pd.Index(np.asarray(self.symbols)[passed], name='symbol'),
+                           name=rank_by).sort_values(ascending=ascending, na_position='last', kind='stable')
+        return ranked if limit is None else ranked.iloc[:limit]
+
+
+def screen(panel: Panel, expression: str, rank_by: str = 'avg_dollar_volume(20)', ascending: bool = False,
+           limit: Optional[int] = None, lookback: int = 400, symbols: Optional[Sequence[str]] = None,
+           at: Optional[pd.Timestamp] = None) -> pd.Series:
+    """
+    Screens the panel once, see Screener and Screener.screen.
+    """
+    return Screener(panel, lookback=lookback, symbols=symbols, at=at).screen(expression, rank_by=rank_by,
+                                                                             ascending=ascending, limit=limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen the universe of a price store")
+    parser.add_argument('expression', help="e.g. \"close > MA150 and crossed_above(cci(14), 0)\"")
+    parser.add_argument('--store', default=Config.eod_price_data_stooq_path)
+    parser.add_argument('--rank-by', default='avg_dollar_volume(20)')
+    parser.add_argument('--ascending', action='store_true')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--lookback', type=int, default=400)
+    parser.add_argument('--at', type=pd.Timestamp, help="screening date (default: the last bar)")
+    args = parser.parse_args()
+
+    with open_price_store(str(Path(args.store).resolve()), mode='r') as store:
+        panel = refresh_panel(store)
+    screener = Screener(panel, lookback=args.lookback, at=args.at)
+    ranked = screener.screen(args.expression, rank_by=args.rank_by, ascending=args.ascending, limit=args.limit)
+    print(f"{len(ranked)} symbols passing on {screener.date}")
+    print(ranked.to_string())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,14 +1,105 @@
+import json
 import os
 import re
-import subprocess
+from datetime import datetime
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from zipfile import ZipFile
 from os import path
 
+import numpy as np
 import pandas as pd
-from pandas import HDFStore
 from tqdm import tqdm
 
 from src.config import Config
+from src.price_store import PriceStore, open_price_store
+
+
+STOOQ_COLUMNS = ['TICKER', 'PER', 'DATE', 'TIME', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL', 'OPENINT']
+PRICE_COLUMNS = ['OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL']
+TICKER_REGEX = re.compile(r"^[a-zA-Z]{1,5}(\.[a-zA-Z]{1,2})?$")
+
+
+def _ticker_from_filename(filename: str) -> Optional[str]:
+    """
+    Returns the lower-case ticker of a Stooq text file (e.g. 'aapl.us.txt' -> 'aapl'),
+    or None if the file is not a valid ticker file.
+    """
+    if not filename.endswith('.txt'):
+        return None
+    ticker = path.basename(filename).split('.')[0]
+    if not TICKER_REGEX.match(ticker):
+        return None
+    return ticker
+
+
+def _normalize_tickers(tickers: Optional[Iterable[str]]) -> Optional[Set[str]]:
+    if tickers is None:
+        return None
+    return {ticker.lower() for ticker in tickers}
+
+
+def list_stock_files(directory_path: str, tickers: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Walks the directory once and returns the (ticker, file path) pairs to parse.
+    The tickers filter is applied on the file names, so unselected files are never opened.
+
+    Parameters:
+        directory_path (str): Path to the directory containing stock data files.
+        tickers (list): List of stock tickers to keep, or None to keep all of them.
+
+    Returns:
+        list: (upper-case ticker, file path) pairs.
+    """
+    tickers = _normalize_tickers(tickers)
+    stock_files = []
+    for root, _, files in os.walk(directory_path):
+        for file in files:
+            ticker = _ticker_from_filename(file)
+            if ticker is None:
+                continue
+            if tickers is not None and ticker not in tickers:
+                continue
+            stock_files.append((ticker.upper(), os.path.join(root, file)))
+    return stock_files
+
+
+def _stooq_datetime_index(dates: np.ndarray, times: np.ndarray) -> pd.DatetimeIndex:
+    """
+    Builds a DatetimeIndex from Stooq's integer DATE (YYYYMMDD) and TIME (HHMMSS) columns
+    using datetime64 arithmetic, without formatting or parsing any strings.
+    """
+    dates = dates.astype(np.int64)
+    times = times.astype(np.int64)
+    months = (dates // 10000 - 1970) * 12 + (dates // 100 % 100 - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (dates % 100 - 1)
+    seconds = (times // 10000) * 3600 + (times // 100 % 100) * 60 + times % 100
+    return pd.DatetimeIndex(days.astype('datetime64[ns]') + seconds.astype('timedelta64[s]'), name='DATE')
+
+
+def read_stock_file(file) -> pd.DataFrame:
+    """
+    Reads a single Stooq text file (path or file object) into an OHLCV dataframe indexed by date.
+    """
+    df = pd.read_csv(
+        file,
+        names=STOOQ_COLUMNS,
+        usecols=['DATE', 'TIME'] + PRICE_COLUMNS,
+        # fixed dtypes so later appends always match the stored table
+        dtype={'DATE': np.int64, 'TIME': np.int64, **{column: np.float64 for column in PRICE_COLUMNS}},
+        header=None, skiprows=1
+    )
+    index = _stooq_datetime_index(df['DATE'].to_numpy(), df['TIME'].to_numpy())
+    return df[PRICE_COLUMNS].set_index(index)
+
+
+def _parse_stock_file(job: Tuple[str, str]) -> Tuple[str, Optional[pd.DataFrame], Optional[str]]:
+    # process pool worker: returns (ticker, dataframe, error message)
+    ticker, file_path = job
+    try:
+        return ticker, read_stock_file(file_path), None
+    except Exception as e:
+        return ticker, None, f"Error processing file {file_path}: {e}"
 
 
 # based on stock data downloaded from "https://stooq.com/db/h/".
@@ -19,93 +110,260 @@ def parse_stock_data(directory_path, tickers=None):
 
     Parameters:
         directory_path (str): Path to the directory containing stock data files.
-        tickers (list): List of stock tickers to parse.
+        tickers (list): List of stock tickers to parse, or None to parse all of them.
 
     Returns:
         dict: A dictionary where keys are tickers and values are Pandas dataframes of stock data.
     """
-    ticker_regex = re.compile(r"^[a-zA-Z]{1,5}(\.[a-zA-Z]{1,2})?$")
-    if tickers is None:
-        tickers = []
-    else:
-        tickers =  [ticker.lower() for ticker in tickers]
     stock_data = {}
+    for ticker, file_path in tqdm(list_stock_files(directory_path, tickers), desc="Parsing stock data"):
+        ticker, df, error = _parse_stock_file((ticker, file_path))
+        if error is not None:
+            print(error)
+            continue
+        stock_data[ticker] = df
 
+    return stock_data
 
-    total_files = sum(len(files) for _, _, files in os.walk(directory_path))
-    with tqdm(total=total_files, desc="Parsing stock data") as pbar:
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                pbar.update(1)
-                if not file.endswith('.txt'): continue
 
-                # Extract ticker from the file name (assuming file name contains ticker)
-                ticker = file.split('.')[0]
+def _write_parsed_results(results: Iterable[Tuple[str, Optional[pd.DataFrame], Optional[str]]],
+                          store: PriceStore, total: int) -> int:
+    written = 0
+    for ticker, df, error in tqdm(results, total=total, desc="Parsing stock data"):
+        if error is not None:
+            print(error)
+            continue
+        store.append(ticker, df)
+        written += 1
+    return written
 
-                if not ticker_regex.match(ticker): continue
 
-                # Process file only if the ticker is in the provided tickers list
-                # if ticker in tickers:
-                file_path = os.path.join(root, file)
+def parse_stock_data_parallel(directory_path: str, store: PriceStore, tickers: Optional[Iterable[str]] = None,
+                              workers: Optional[int] = None, chunksize: int = 16) -> int:
+    """
+    Parses stock data files on a process pool and streams each parsed dataframe into the price store
+    as soon as it is ready, so only the frames in flight are kept in memory.
 
-                try:
-                    # Read the data into a Pandas DataFrame
-                    df = pd.read_csv(
-                        file_path,
-                        names=['TICKER', 'PER', 'DATE', 'TIME', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL', 'OPENINT'],
-                        dtype={'DATE': str, 'TIME': str},
-                        header=None, skiprows=1
-                    )
+    Parameters:
+        directory_path (str): Path to the directory containing stock data files.
+        store (PriceStore): Open store the parsed dataframes are written into.
+        tickers (list): List of stock tickers to parse, or None to parse all of them.
+        workers (int): Number of worker processes (defaults to the number of cores).
+        chunksize (int): Number of files handed to a worker at a time.
 
-                    df['DATE'] = pd.to_datetime(df['DATE'].astype(str) + df['TIME'].astype(str), format='%Y%m%d%H%M%S')
-                    df = df[['DATE', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL']]
-                    df.set_index('DATE', inplace=True)
+    Returns:
+        int: The number of symbols written into the store.
+    """
+    stock_files = list_stock_files(directory_path, tickers)
+    with Pool(processes=workers or os.cpu_count()) as pool:
+        results = pool.imap_unordered(_parse_stock_file, stock_files, chunksize=chunksize)
+        return _write_parsed_results(results, store, len(stock_files))
 
-                    # Store the dataframe in the dictionary
-                    stock_data[ticker.upper()] = df
-                except Exception as e:
-                    print(f"Error processing file {file_path}: {e}")
 
-    return stock_data
+def list_zip_members(zip_file_path: str, tickers: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Returns the (ticker, member name) pairs to parse, selected from the zip's central directory
+    without reading or extracting any member.
 
+    Parameters:
+        zip_file_path (str): Path to the Stooq zip archive (e.g. d_us_txt.zip).
+        tickers (list): List of stock tickers to keep, or None to keep all of them.
+
+    Returns:
+        list: (upper-case ticker, member name) pairs.
+    """
+    tickers = _normalize_tickers(tickers)
+    members = []
+    with ZipFile(zip_file_path) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            ticker = _ticker_from_filename(info.filename)
+            if ticker is None:
+                continue
+            if tickers is not None and ticker not in tickers:
+                continue
+            members.append((ticker.upper(), info.filename))
+    return members
 
-def print_hdfs_tickers(hdfs_file_path: str):
-    with pd.HDFStore(Config.eod_price_data_stooq_path, mode='r') as store:
-        print(f"Symbols and row counts in {hdfs_file_path}:")
-        for key in store.keys():
-            # Retrieve the number of rows for each symbol
-            nrows = store.get_storer(key).nrows
-            print(f"{key}: {nrows} rows")
 
-def extract_zip_file(zip_filepath: str, extract_path: str) -> (bool, str):
-    zip_file_path = path.join(Config.data_dir, zip_filepath)
+# zip archive opened once per worker process by _init_zip_worker
+_worker_zip_file: Optional[ZipFile] = None
 
-    if not os.path.exists(zip_file_path):
-        return (False, "")
 
-    dest_folder = path.join(Config.data_dir, extract_path)
-    if os.path.exists(dest_folder):
-        return (True, dest_folder)
+def _init_zip_worker(zip_file_path: str):
+    global _worker_zip_file
+    _worker_zip_file = ZipFile(zip_file_path)
 
+
+def _parse_zip_member(job: Tuple[str, str]) -> Tuple[str, Optional[pd.DataFrame], Optional[str]]:
+    # process pool worker: decompresses a single member in memory
+    ticker, member_name = job
     try:
-        subprocess.run(["unzip", zip_file_path, "-d", dest_folder])
+        with _worker_zip_file.open(member_name) as member:
+            return ticker, read_stock_file(member), None
     except Exception as e:
-        return (False, e)
+        return ticker, None, f"Error processing member {member_name}: {e}"
+
+
+def parse_stock_zip_parallel(zip_file_path: str, store: PriceStore, tickers: Optional[Iterable[str]] = None,
+                             workers: Optional[int] = None, chunksize: int = 16) -> int:
+    """
+    Parses the text members of a Stooq zip archive on a process pool, reading them directly from the
+    archive, and streams each parsed dataframe into the price store. Nothing is extracted to disk.
+
+    Parameters:
+        zip_file_path (str): Path to the Stooq zip archive (e.g. d_us_txt.zip).
+        store (PriceStore): Open store the parsed dataframes are written into.
+        tickers (list): List of stock tickers to parse, or None to parse all of them.
+        workers (int): Number of worker processes (defaults to the number of cores).
+        chunksize (int): Number of members handed to a worker at a time.
+
+    Returns:
+        int: The number of symbols written into the store.
+    """
+    members = list_zip_members(zip_file_path, tickers)
+    with Pool(processes=workers or os.cpu_count(), initializer=_init_zip_worker, initargs=(zip_file_path,)) as pool:
+        results = pool.imap_unordered(_parse_zip_member, members, chunksize=chunksize)
+        return _write_parsed_results(results, store, len(members))
+
+
+def load_manifest(manifest_path: str) -> Dict[str, dict]:
+    """
+    Loads the ingest manifest: for every source file, its size, mtime and the last ingested timestamp.
+    """
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest: Dict[str, dict], manifest_path: str):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def _source_stats(source_path: str, names: Iterable[str]) -> Dict[str, Tuple[int, float]]:
+    # (size, mtime) of every source; read from the central directory for zip archives
+    if source_path.endswith('.zip'):
+        with ZipFile(source_path) as zip_file:
+            return {info.filename: (info.file_size, datetime(*info.date_time).timestamp())
+                    for info in zip_file.infolist()}
+    stats = {}
+    for name in names:
+        stat = os.stat(name)
+        stats[name] = (stat.st_size, stat.st_mtime)
+    return stats
 
-    return (True, dest_folder)
 
-def main():
+def _parse_source_since(job: Tuple[str, str, Optional[str]]) -> Tuple[str, str, Optional[pd.DataFrame], Optional[str]]:
+    # process pool worker: parses a file or zip member and keeps only the rows newer than `since`
+    ticker, name, since = job
+    parse = _parse_zip_member if _worker_zip_file is not None else _parse_stock_file
+    ticker, df, error = parse((ticker, name))
+    if df is not None and since is not None:
+        df = df[df.index > pd.Timestamp(since)]
+    return ticker, name, df, error
+
+
+def ingest_incremental(source_path: str, store: PriceStore, manifest_path: str, tickers: Optional[Iterable[str]] = None,
+                       workers: Optional[int] = None, chunksize: int = 16) -> int:
+    """
+    Incrementally ingests a Stooq directory or zip archive into the price store.
+    Sources whose size and mtime match the manifest are skipped; changed sources are parsed and only
+    the rows newer than the last ingested timestamp are appended to the symbol's table.
+
+    Parameters:
+        source_path (str): Path to the d_us directory or to the Stooq zip archive.
+        store (PriceStore): Store opened in append mode.
+        manifest_path (str): Path of the JSON manifest kept next to the store.
+        tickers (list): List of stock tickers to ingest, or None to ingest all of them.
+        workers (int): Number of worker processes (defaults to the number of cores).
+        chunksize (int): Number of sources handed to a worker at a time.
+
+    Returns:
+        int: The number of rows appended to the store.
+    """
+    is_zip = source_path.endswith('.zip')
+    sources = list_zip_members(source_path, tickers) if is_zip else list_stock_files(source_path, tickers)
+    stats = _source_stats(source_path, [name for _, name in sources])
+    manifest = load_manifest(manifest_path)
+    existing_symbols = store.symbols()
+
+    jobs = []
+    for ticker, name in sources:
+        size, mtime = stats[name]
+        entry = manifest.get(name)
+        if entry is not None and ticker in existing_symbols:
+            if entry['size'] == size and entry['mtime'] == mtime:
+                continue
+            jobs.append((ticker, name, entry.get('last_timestamp')))
+        else:
+            jobs.append((ticker, name, None))
+
+    initializer, initargs = (_init_zip_worker, (source_path,)) if is_zip else (None, ())
+    appended_rows = 0
+    try:
+        with Pool(processes=workers or os.cpu_count(), initializer=initializer, initargs=initargs) as pool:
+            results = pool.imap_unordered(_parse_source_since, jobs, chunksize=chunksize)
+            for ticker, name, df, error in tqdm(results, total=len(jobs), desc="Ingesting changed stock data"):
+                if error is not None:
+                    print(error)
+                    continue
+                entry = manifest.get(name, {})
+                if len(df) > 0:
+                    store.append(ticker, df)
+                    appended_rows += len(df)
+                    entry['last_timestamp'] = df.index[-1].isoformat()
+                size, mtime = stats[name]
+                entry.update(symbol=ticker, size=size, mtime=mtime)
+                manifest[name] = entry
+    finally:
+        save_manifest(manifest, manifest_path)
+
+    return appended_rows
+
+
+def print_hdfs_tickers(hdfs_file_path: str):
+    # answered from the store's symbol catalog, no table is opened
+    with open_price_store(hdfs_file_path, mode='r') as store:
+        print(f"Symbols and row counts in {hdfs_file_path}:")
+        catalog = store.catalog or store.rebuild_catalog()
+        for symbol in sorted(catalog.symbols()):
+            print(f"/{symbol}: {catalog.get(symbol).rows} rows")
+
+def main(parallel: bool = True, incremental: bool = True):
+    zip_file_path = path.join(Config.data_dir, 'd_us_txt.zip')
     directory_path = path.join(Config.data_dir,'d_us')
-    # (succeed, directory_path) = extract_zip_file('d_us_txt.zip', 'd_us')
-    # if not succeed:
-    #     directory_path = "data/"  # Replace with the path to your directory
     # selected_tickers = ['AAPL', 'GOOGL', 'MSFT']  # Replace with your desired tickers
 
-    stock_dataframes = parse_stock_data(directory_path, None)
+    if incremental:
+        source_path = zip_file_path if os.path.exists(zip_file_path) else directory_path
+        # without a manifest the store content is unknown, so it is rebuilt from scratch
+        mode = 'a' if os.path.exists(Config.eod_price_data_stooq_manifest_path) else 'w'
+        with open_price_store(Config.eod_price_data_stooq_path, mode=mode) as store:
+            ingest_incremental(source_path, store, Config.eod_price_data_stooq_manifest_path)
+        return
+
+    # a full rebuild invalidates the incremental manifest
+    if os.path.exists(Config.eod_price_data_stooq_manifest_path):
+        os.remove(Config.eod_price_data_stooq_manifest_path)
+
+    with open_price_store(Config.eod_price_data_stooq_path, mode='w') as store:
+        if os.path.exists(zip_file_path):
+            parse_stock_zip_parallel(zip_file_path, store, tickers=None)
+            return
+
+        if parallel:
+            parse_stock_data_parallel(directory_path, store, tickers=None)
+            return
 
-    with pd.HDFStore(Config.eod_price_data_stooq_path, mode='w') as store:
+        stock_dataframes = parse_stock_data(directory_path, None)
         for symbol, data in tqdm(stock_dataframes.items(), desc="saving parsed data into HDF5 store"):
-            store.put(symbol, data, format='table', append=True, data_columns=True)
+            store.append(symbol, data)
 
     # print_hdfs_tickers(Config.eod_price_data_stooq_path)
 
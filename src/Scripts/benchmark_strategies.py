@@ -0,0 +1,65 @@
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import pandas as pd
+
+from src.backtest.backtest_vectorbt import moving_avg_breakout, price_arrays
+from src.backtest.reference import legacy_moving_avg_breakout, synthetic_bars
+
+
+# benchmark of the array-native strategy contract against the previous frame-mutating implementation
+
+
+def measure(fn: Callable[[], object], repeats: int = 10) -> Tuple[float, float]:
+    """
+    Returns (best wall time in ms, peak traced memory in MB) of a call.
+    """
+    fn()  # warm-up (numba compilation, caches)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings) * 1000, peak / 2 ** 20
+
+
+def frame_growth(df: pd.DataFrame, fn: Callable[[pd.DataFrame], object], calls: int = 10) -> float:
+    """
+    Returns how much the caller's frame grew (MB of `memory_usage(deep=True)`) over `calls` calls on it.
+    """
+    before = df.memory_usage(deep=True).sum()
+    for _ in range(calls):
+        fn(df)
+    return (df.memory_usage(deep=True).sum() - before) / 2 ** 20
+
+
+def main():
+    datasets = {
+        '15y daily': synthetic_bars(15 * 252),
+        '2y 5m': synthetic_bars(2 * 252 * 78, freq='5min'),
+    }
+    rows = []
+    for name, df in datasets.items():
+        chart_frame = df.copy()
+        legacy_ms, legacy_mb = measure(lambda: legacy_moving_avg_breakout(chart_frame))
+        array_ms, array_mb = measure(lambda: moving_avg_breakout(**price_arrays(df)))
+        # the scratch columns stay in the caller's frame (e.g. the chart's) after every legacy call
+        legacy_growth = frame_growth(df.copy(), legacy_moving_avg_breakout)
+        array_growth = frame_growth(df.copy(), lambda frame: moving_avg_breakout(**price_arrays(frame)))
+        rows.append({'dataset': name, 'bars': len(df),
+                     'legacy ms': legacy_ms, 'array ms': array_ms,
+                     'legacy peak MB': legacy_mb, 'array peak MB': array_mb,
+                     'frame MB': df.memory_usage(deep=True).sum() / 2 ** 20,
+                     'legacy frame growth MB': legacy_growth, 'array frame growth MB': array_growth,
+                     'legacy added columns': chart_frame.shape[1] - df.shape[1],
+                     'array added columns': 0})
+    print(pd.DataFrame(rows).set_index('dataset').round(2).to_string())
+
+
+if __name__ == '__main__':
+    main()
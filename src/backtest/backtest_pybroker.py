@@ -1,9 +1,24 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
-
-
+import numpy as np
+import pandas as pd
 import pybroker
 from pybroker.data import DataSource
 
+from src.catalog import find_column
+from src.config import Config
+from src.price_store import PriceStore, open_price_store
+
+# columns of the frames returned to pybroker
+PYBROKER_COLUMNS = ('symbol', 'date', 'open', 'high', 'low', 'close', 'volume')
+
+# pybroker timeframes (as formatted by DataSource.query) -> intraday store timeframes
+TIMEFRAMES: Dict[str, str] = {'5min': '5m', '15min': '15m', '1hour': '1h', '1day': '1d'}
+
+
 class CSVDataSource(DataSource):
 
     def __init__(self):
@@ -15,4 +30,115 @@ class CSVDataSource(DataSource):
         df = pd.read_csv('data/prices.csv')
         df = df[df['symbol'].isin(symbols)]
         df['date'] = pd.to_datetime(df['date'])
-        return df[(df['date'] >= start_date) & (df['date'] <= end_date)]
\ No newline at end of file
+        return df[(df['date'] >= start_date) & (df['date'] <= end_date)]
+
+
+@dataclass
+class CachedRange:
+    start: pd.Timestamp
+    end: pd.Timestamp
+    bars: pd.DataFrame  # PYBROKER_COLUMNS rows of the symbol in [start, end], sorted by date
+
+
+class PriceStoreDataSource(DataSource):
+    """
+    pybroker data source over a price store (the Stooq HDF5 store by default, any store open_price_store opens).
+
+    Every symbol is read with its date range pushed down into the store query, and the bars read are kept in an
+    in-process LRU of (symbol, timeframe) ranges: queries inside a cached range are served from memory, a query
+    reaching outside it reads the range covering both once. Repeated backtests and walk-forward runs over the same
+    universe and dates therefore read the store once.
+
+    With an intraday store (see intraday_store.IntradayStore) the query timeframe selects the stored timeframe;
+    other stores hold a single timeframe and ignore it. Intraday bar times are returned in their local time,
+    without time zone, like the query dates.
+    """
+
+    def __init__(self, store_path: str = Config.eod_price_data_stooq_path, max_entries: int = 2048):
+        """
+        Parameters:
+            store_path (str): Path of the price store, opened read-only on the first query.
+            max_entries (int): Number of (symbol, timeframe) ranges kept in memory.
+        """
+        super().__init__()
+        self.store_path = store_path
+        self.max_entries = max_entries
+        self._store: Optional[PriceStore] = None
+        self._entries: 'OrderedDict[Tuple[str, str], CachedRange]' = OrderedDict()
+
+    def _timeframe_store(self, timeframe: str) -> PriceStore:
+        if self._store is None:
+            self._store = open_price_store(self.store_path, mode='r')
+        if not timeframe or not hasattr(self._store, 'timeframe'):
+            return self._store
+        if timeframe not in TIMEFRAMES:
+            raise ValueError(f"Unsupported timeframe: {timeframe}")
+        return self._store.timeframe(TIMEFRAMES[timeframe])
+
+    @staticmethod
+    def _read(store: PriceStore, symbol: str, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        # the time zone of the symbol's bars (from the catalog), so naive query dates are compared in local time
+        entry = store.catalog.get(symbol) if store.catalog is not None else None
+        tz = pd.Timestamp(entry.first_bar).tz if entry is not None else None
+        if tz is not None:
+            start, end = start.tz_localize(tz), end.tz_localize(tz)
+        try:
+            df = store.read(symbol, start=start, end=end)
+        except KeyError:
+            # cached empty, so unknown symbols aren't looked up again
+            return pd.DataFrame(columns=list(PYBROKER_COLUMNS))
+        dates = df.index.tz_localize(None) if getattr(df.index, 'tz', None) is not None else df.index
+        bars = {'symbol': np.full(len(df), symbol, dtype=object), 'date': dates.to_numpy()}
+        for name in PYBROKER_COLUMNS[2:]:
+            column = find_column(df, name)
+            bars[name] = df[column].to_numpy(dtype=np.float64) if column else np.full(len(df), np.nan)
+        return pd.DataFrame(bars)
+
+    def _symbol_bars(self, symbol: str, timeframe: str, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        key = (symbol, timeframe)
+        entry = self._entries.get(key)
+        if entry is None or start < entry.start or end > entry.end:
+            if entry is not None:
+                start_read, end_read = min(start, entry.start), max(end, entry.end)
+            else:
+                start_read, end_read = start, end
+            bars = self._read(self._timeframe_store(timeframe), symbol, start_read, end_read)
+            entry = CachedRange(start_read, end_read, bars)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        dates = entry.bars['date'].to_numpy(dtype='datetime64[ns]')
+        first = np.searchsorted(dates, start.to_datetime64(), side='left')
+        last = np.searchsorted(dates, end.to_datetime64(), side='right')
+        return entry.bars.iloc[first:last]
+
+    def _fetch_data(self, symbols: frozenset, start_date: datetime, end_date: datetime, timeframe: Optional[str],
+                    adjust: Optional[Any]) -> pd.DataFrame:
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        frames = []
+        for symbol in sorted(symbols):
+            bars = self._symbol_bars(symbol, timeframe or '', start, end)
+            if len(bars):
+                frames.append(bars)
+        if not frames:
+            return pd.DataFrame(columns=list(PYBROKER_COLUMNS))
+        return pd.concat(frames, ignore_index=True)
+
+    def clear(self):
+        """
+        Drops the cached ranges (e.g. after the store was updated).
+        """
+        self._entries.clear()
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,161 +1,282 @@
+from itertools import product
 from pathlib import Path
-from typing import Tuple, Any
+from typing import Tuple, Callable, Dict, Optional, Sequence, Union
 
 import numpy as np
 import pandas as pd
 import vectorbt as vbt
+from numba import njit
 
 from src.config import Config
-
-
-def ma_150_crossed(df: pd.DataFrame)-> Tuple[Any, Any]:
-    ma = vbt.MA.run(df['close'], 150)
-    enter_signal = ma.ma_crossed_above(df['close'])
-
-    atr = vbt.ATR.run(low=df['low'], close=df['close'], high=df['high'], window=14)
-    # Track the highest price since entry for trailing stop calculation
-    # Initialize trailing stop price to NaN (no stop initially)
-    trailing_stop = pd.Series(np.nan, index=df.index)
-    # Calculate trailing stop using ATR (set 2x ATR as the trailing stop distance)
-    stop_multiple = 3  # Trailing stop as a multiple of ATR
-    for i in range(1, len(df)):
-        if enter_signal.iloc[i]:
-            trailing_stop.iloc[i] = df['low'].iloc[i] - stop_multiple * atr.atr.iloc[i]
-        else:
-            # Carry forward the last stop
-            trailing_stop.iloc[i] = max(trailing_stop.iloc[i - 1],
-                                        df['low'].iloc[i] - stop_multiple * atr.atr.iloc[i])
+from src.indicator_cache import IndicatorCache
+from src.indicators import IndicatorLookup, compute_indicator, price_arrays
+from src.price_store import open_price_store
+
+
+@njit(cache=True)
+def atr_trailing_stop_nb(low: np.ndarray, atr: np.ndarray, enter: np.ndarray, stop_multiple: np.ndarray) -> np.ndarray:
+    """
+    Trailing stop kernel over (bars x columns) arrays, one stop multiple per column.
+    The stop is reset to `low - stop_multiple * atr` on every entry bar and only ratchets up afterwards.
+    """
+    n_bars, n_cols = low.shape
+    trailing_stop = np.full((n_bars, n_cols), np.nan)
+    for col in range(n_cols):
+        for i in range(1, n_bars):
+            stop = low[i, col] - stop_multiple[col] * atr[i, col]
+            # same as max(previous stop, stop): a NaN previous stop is carried forward
+            if enter[i, col] or stop > trailing_stop[i - 1, col]:
+                trailing_stop[i, col] = stop
+            else:
+                trailing_stop[i, col] = trailing_stop[i - 1, col]
+    return trailing_stop
+
+
+def atr_trailing_stop(high, low, close, enter,
+                      stop_multiple: Union[float, Sequence[float]] = 3,
+                      atr_window: Union[int, Sequence[int]] = 14, atr: np.ndarray = None) -> np.ndarray:
+    """
+    ATR trailing stop usable from any strategy function.
+
+    Parameters:
+        high, low, close: 1-D price arrays (or Series), or (bars x symbols) arrays with scalar parameters.
+        enter: Entry signals, 1-D or (bars x parameter sets), or (bars x symbols) like the prices.
+        stop_multiple: Trailing stop distance as a multiple of ATR, a scalar or a sequence.
+        atr_window: ATR window, a scalar or a sequence.
+        atr: Optional precomputed ATR, one column per distinct window in ascending order (e.g. from the indicator cache).
+
+    Returns:
+        ndarray: The stop per bar; 1-D for scalar parameters, otherwise (bars x parameter sets) with one column
+        per combination in `itertools.product(stop_multiple, atr_window)` order.
+    """
+    scalar_params = np.isscalar(stop_multiple) and np.isscalar(atr_window)
+    if np.ndim(low) == 2 and scalar_params:
+        # one column per symbol (screener, panel)
+        low = np.ascontiguousarray(low, dtype=np.float64)
+        if atr is None:
+            atr = vbt.ATR.run(high=np.asarray(high, dtype=np.float64), low=low,
+                              close=np.asarray(close, dtype=np.float64), window=atr_window).atr.to_numpy()
+        atr = np.ascontiguousarray(np.asarray(atr, dtype=np.float64).reshape(low.shape))
+        enter = np.ascontiguousarray(np.broadcast_to(np.asarray(enter, dtype=np.bool_), low.shape))
+        return atr_trailing_stop_nb(low, atr, enter, np.full(low.shape[1], float(stop_multiple)))
+
+    stop_multiples = np.atleast_1d(np.asarray(stop_multiple, dtype=np.float64))
+    atr_windows = np.atleast_1d(np.asarray(atr_window, dtype=np.int64))
+    combinations = list(product(stop_multiples, atr_windows))
+
+    # each distinct ATR window is computed once
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    unique_windows = [int(window) for window in np.unique(atr_windows)]
+    if atr is None:
+        atr = vbt.ATR.run(high=high, low=low, close=close, window=unique_windows).atr.to_numpy()
+    atrs = np.asarray(atr, dtype=np.float64)
+    atrs = atrs.reshape(len(close), len(unique_windows))
+    atr_columns = atrs[:, [unique_windows.index(int(window)) for _, window in combinations]]
+
+    enter = np.asarray(enter, dtype=np.bool_)
+    if enter.ndim == 1:
+        enter = enter[:, None]
+    enter = np.ascontiguousarray(np.broadcast_to(enter, (len(close), len(combinations))))
+    low_columns = np.ascontiguousarray(np.broadcast_to(low[:, None], (len(close), len(combinations))))
+    multiples = np.array([multiple for multiple, _ in combinations], dtype=np.float64)
+
+    trailing_stop = atr_trailing_stop_nb(low_columns, np.ascontiguousarray(atr_columns), enter, multiples)
+    return trailing_stop[:, 0] if scalar_params and enter.shape[1] == 1 else trailing_stop
+
+
+def ma_150_crossed(high: np.ndarray, low: np.ndarray, close: np.ndarray, ma_window: int = 150,
+                   stop_multiple: float = 3, atr_window: int = 14,
+                   indicators: Optional[IndicatorLookup] = None) -> Tuple[np.ndarray, np.ndarray]:
+    prices = dict(high=high, low=low, close=np.asarray(close, dtype=np.float64))
+    close = prices['close']
+    ma = compute_indicator('sma', prices, indicators, window=ma_window)
+    if close.ndim == 1:
+        enter_signal = vbt.generic.nb.crossed_above_1d_nb(ma, close)
+    else:
+        enter_signal = vbt.generic.nb.crossed_above_nb(ma, close)
+
+    # Trailing stop as a multiple of ATR, ratcheting up from each entry
+    atr = compute_indicator('atr', prices, indicators, window=atr_window)
+    trailing_stop = atr_trailing_stop(high, low, close, enter_signal,
+                                      stop_multiple=stop_multiple, atr_window=atr_window, atr=atr)
 
     # Create exit signal: Price touches or goes below the trailing stop
-    exit_signal = df['close'] <= trailing_stop  # Price hits trailing stop
+    exit_signal = close <= trailing_stop  # Price hits trailing stop
 
     return enter_signal, exit_signal
 
-def cci_cross_zero2(df: pd.DataFrame) -> Tuple[Any, Any]:
-    cci = vbt.pandas_ta('cci').run(low=df['low'], close=df['close'], high=df['high'], window=14)
-    cci_values = cci.cci
-
-    # Initialize entry and exit signals
-    entry_signal = np.zeros_like(cci_values, dtype=bool)
-    exit_signal = np.zeros_like(cci_values, dtype=bool)
-
-    # Create masks for CCI conditions
-    below_neg100 = cci_values < -100
-    above_pos100 = cci_values > 100
-    above_zero = cci_values >= 0
-    below_zero = cci_values <= 0
-
-    # Track the state of the CCI
-    in_below_neg100 = False
-    in_above_pos100 = False
-
-    in_position = False
-    
-    i = 1
-    while i < len(cci_values)-1:
-        # Entry condition
-        if below_neg100[i - 1]:
-            while (i < len(cci_values)) and (cci_values[i] > cci_values[i - 1]):
-                if above_zero[i]:
-                    entry_signal[i] = True
-                    exit_signal[i+1] = True
-                    break
-                else:
-                    i+=1
-        i+=1
-
-        # Exit condition
-        # if not in_above_pos100 and above_pos100[i - 1]:
-        #     in_above_pos100 = True
-        # if in_above_pos100 and below_zero[i]:
-        #     exit_signal[i] = True
-        #     in_above_pos100 = False
-
-    # Convert signals back to pandas Series
-    entry_signal_series = pd.Series(entry_signal, index=cci_values.index)
-    exit_signal_series = pd.Series(exit_signal, index=cci_values.index)
-
-    return entry_signal_series, exit_signal_series
-
-def cci_cross_zero(df: pd.DataFrame) -> Tuple[Any, Any]:
-    window_size = 5  # Number of days to track upward movement
-
-    # Entry: Check if CCI was below -100 at the start of the window and is now >= 0
-    def custom_cci_entry(cci_series, window):
-        below_neg_100 = cci_series.shift(window) < -100  # Was below -100 'window' days ago
-        rising_trend = (cci_series.diff().rolling(window).sum()) > 0  # Gradually increasing
-        crossing_zero = cci_series >= 0  # Has reached or exceeded 0
-        return below_neg_100 & rising_trend & crossing_zero
-
-    # Exit: Check if CCI was above 100 at the start of the window and is now <= 0
-    def custom_cci_exit(cci_series, window):
-        above_100 = cci_series.shift(window) > 100  # Was above 100 'window' days ago
-        falling_trend = (cci_series.diff().rolling(window).sum()) < 0  # Gradually decreasing
-        crossing_zero = cci_series <= 0  # Has reached or dropped below 0
-        return above_100 & falling_trend & crossing_zero
-
-    cci = vbt.pandas_ta('cci').run(low=df['low'], close=df['close'], high=df['high'], window=14)
-    entry_signal = custom_cci_entry(cci.cci, window_size)
-    exit_signal = custom_cci_exit(cci.cci, window_size)
-    return entry_signal, exit_signal
 
-def moving_avg_breakout(df: pd.DataFrame, atr_mult: float = 1.5) -> Tuple[Any, Any]:
-    ma_period = 20
-    lookback = 10  # Days to confirm a downtrend
+def cci_cross_zero2_signals(cci: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized "was below -100, rising run, crosses zero" rule on 1-D or (bars x columns) CCI arrays.
+
+    An entry fires on the first bar of a strictly rising CCI run that reaches zero, when the run started
+    below -100; the exit fires on the following bar.
+
+    Returns:
+        (entry, exit) boolean arrays shaped like `cci`.
+    """
+    cci = np.asarray(cci, dtype=np.float64)
+    is_1d = cci.ndim == 1
+    if is_1d:
+        cci = cci[:, None]
+    n_bars = cci.shape[0]
 
-    atr = vbt.ATR.run(low=df['low'], close=df['close'], high=df['high'], window=14)
-    atr = atr.atr
+    prev_cci = np.empty_like(cci)
+    prev_cci[0] = np.nan
+    prev_cci[1:] = cci[:-1]
+    rising = cci > prev_cci
 
-    ma = vbt.MA.run(df['close'], window=ma_period)
-    df['MA'] = ma.ma # df['close'].rolling(ma_period).mean()
+    # index of the bar each rising run started from (the run's lowest value)
+    bars = np.broadcast_to(np.arange(n_bars)[:, None], cci.shape)
+    run_start = np.maximum.accumulate(np.where(rising, 0, bars), axis=0)
+    run_start_cci = np.take_along_axis(cci, run_start, axis=0)
 
-    # Relative drop from lookback days ago
-    # past_price = df['close'].shift(lookback)
-    # drop_amt = past_price - df['close']
-    # atr_thresh = atr * atr_mult
-    # steep_enough = drop_amt > atr_thresh
+    entry_signal = (rising & (cci >= 0) & (prev_cci < 0) & (run_start_cci < -100)
+                    & (run_start <= n_bars - 3))  # runs starting on the last two bars were never scanned
+    exit_signal = np.zeros_like(entry_signal)
+    exit_signal[1:] = entry_signal[:-1]
+
+    if is_1d:
+        return entry_signal[:, 0], exit_signal[:, 0]
+    return entry_signal, exit_signal
 
-    # Condition 1: Downtrend - Close below MA for last `lookback` bars
-    df['Below_MA'] = df['close'] < df['MA']
-    df['Was_Downtrend'] = df['Below_MA'].rolling(lookback).sum() == lookback
-    df['Was_Downtrend'] = df['Was_Downtrend'] #& steep_enough
 
-    # Condition 2: Breakout - Close crosses above MA
-    df['Breakout'] = (df['close'] > df['MA']) & (df['close'].shift(1) <= df['MA'].shift(1))
+def cci_cross_zero2(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = 14,
+                    indicators: Optional[IndicatorLookup] = None) -> Tuple[np.ndarray, np.ndarray]:
+    prices = dict(high=high, low=low, close=close)
+    return cci_cross_zero2_signals(compute_indicator('cci', prices, indicators, window=window))
 
-    # Condition 3: Confirm breakout only if it follows a downtrend
-    df['Confirmed_Breakout'] = df['Breakout'] & df['Was_Downtrend'].shift(1)
 
-    # Forward-fill entry to mark a "holding" state
-    holding = df['Confirmed_Breakout'].cumsum()
-    holding[df['close'] < df['MA']] = np.nan  # Exit when below MA
-    holding = holding.ffill().notna() & df['Confirmed_Breakout'].cumsum().gt(0)  # Filter active trades
+def cci_cross_zero(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = 14,
+                   window_size: int = 5, indicators: Optional[IndicatorLookup] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Entry: CCI was below -100 `window_size` bars ago, rose over the window and is now >= 0.
+    Exit: CCI was above 100 `window_size` bars ago, fell over the window and is now <= 0.
+    """
+    cci_values = compute_indicator('cci', dict(high=high, low=low, close=close), indicators, window=window)
+    past_cci = _shift(cci_values, window_size)
+    # sum of the CCI changes over the window (NaN until the window is complete)
+    window_change = np.full(cci_values.shape, np.nan)
+    window_change[window_size:] = cci_values[window_size:] - cci_values[:-window_size]
 
+    entry_signal = (past_cci < -100) & (window_change > 0) & (cci_values >= 0)
+    exit_signal = (past_cci > 100) & (window_change < 0) & (cci_values <= 0)
+    return entry_signal, exit_signal
 
-    df['Cross_down'] = holding & df['Below_MA'] & (df['close'].shift(1) >= df['MA'].shift(1))
 
-    entry_signal = df['Confirmed_Breakout']
-    exit_signal = df['Cross_down']
-    exit_signal = exit_signal.astype(bool).fillna(False)
-    
+def _rolling_all(mask: np.ndarray, window: np.ndarray) -> np.ndarray:
+    # True where the last `window` bars of the column are all True; one window per column
+    counts = np.cumsum(mask, axis=0)
+    bars = np.arange(mask.shape[0])[:, None]
+    start = bars - window[None, :]
+    counts_before = np.where(start >= 0, np.take_along_axis(counts, np.maximum(start, 0), axis=0), 0)
+    return (counts - counts_before == window[None, :]) & (bars >= window[None, :] - 1)
+
+
+def _shift(a: np.ndarray, periods: int = 1, fill_value=np.nan) -> np.ndarray:
+    shifted = np.empty_like(a)
+    shifted[:periods] = fill_value
+    shifted[periods:] = a[:-periods]
+    return shifted
+
+
+def moving_avg_breakout_signals(close: np.ndarray, ma: np.ndarray, lookback, atr: np.ndarray = None,
+                                atr_mult=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Moving average breakout rule on (bars x columns) arrays, one column per parameter combination.
+
+    Entry: close crosses above the MA right after `lookback` bars closing below it.
+    Exit: close crosses below the MA once a position was entered.
+    When `atr_mult` is given, the downtrend must also have dropped more than `atr_mult * atr`
+    over the lookback (NaN disables the filter for that column).
+
+    Parameters:
+        close: 1-D close prices or (bars x columns).
+        ma: Moving average, (bars x columns).
+        lookback: Downtrend length, a scalar or one value per column.
+        atr: ATR, 1-D or (bars x columns); only needed with `atr_mult`.
+        atr_mult: Optional scalar or one value per column.
+
+    Returns:
+        (entry, exit) boolean (bars x columns) arrays.
+    """
+    ma = np.asarray(ma, dtype=np.float64)
+    if ma.ndim == 1:
+        ma = ma[:, None]
+    close = np.asarray(close, dtype=np.float64)
+    if close.ndim == 1:
+        close = close[:, None]
+    close = np.broadcast_to(close, ma.shape)
+    lookback = np.broadcast_to(np.asarray(lookback, dtype=np.int64), ma.shape[1:])
+
+    prev_close = _shift(close)
+    prev_ma = _shift(ma)
+    below_ma = close < ma
+    was_downtrend = _rolling_all(below_ma, lookback)
+    if atr_mult is not None:
+        atr_mult = np.broadcast_to(np.asarray(atr_mult, dtype=np.float64), ma.shape[1:])
+        atr = np.asarray(atr, dtype=np.float64)
+        if atr.ndim == 1:
+            atr = atr[:, None]
+        bars = np.arange(ma.shape[0])[:, None]
+        past_close = np.take_along_axis(close, np.maximum(bars - lookback[None, :], 0), axis=0)
+        past_close = np.where(bars >= lookback[None, :], past_close, np.nan)
+        steep_enough = (past_close - close) > atr * atr_mult[None, :]
+        was_downtrend &= steep_enough | np.isnan(atr_mult)[None, :]
+
+    breakout = (close > ma) & (prev_close <= prev_ma)
+    entry_signal = breakout & _shift(was_downtrend, fill_value=False)
+    # a position is held from the first confirmed breakout, exits are crosses back below the MA
+    exit_signal = (np.cumsum(entry_signal, axis=0) > 0) & below_ma & (prev_close >= prev_ma)
     return entry_signal, exit_signal
 
 
+def moving_avg_breakout(high: np.ndarray, low: np.ndarray, close: np.ndarray, ma_period: int = 20,
+                        lookback: int = 10, atr_mult: float = None,
+                        atr_window: int = 14,
+                        indicators: Optional[IndicatorLookup] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Close crossing above its MA after `lookback` bars below it; exits on the cross back below.
+    `atr_mult` optionally requires the downtrend to have dropped more than `atr_mult` ATRs (off by default).
+    """
+    prices = dict(high=high, low=low, close=np.asarray(close, dtype=np.float64))
+    close = prices['close']
+    ma = compute_indicator('sma', prices, indicators, window=ma_period)
+    atr = None
+    if atr_mult is not None:
+        atr = compute_indicator('atr', prices, indicators, window=atr_window)
+
+    entry_signal, exit_signal = moving_avg_breakout_signals(close, ma, lookback, atr=atr, atr_mult=atr_mult)
+    if close.ndim == 2:
+        return entry_signal, exit_signal
+    return entry_signal[:, 0], exit_signal[:, 0]
+
+
+# strategies selectable by name (universe runner, CLI, screener); all take high/low/close arrays, 1-D or
+# (bars x symbols) with one column per symbol, and return (entry, exit) boolean arrays without touching their inputs.
+# `indicators` (IndicatorCache.for_symbol) serves their indicators from the cache instead of recomputing them
+STRATEGIES: Dict[str, Callable[..., Tuple[np.ndarray, np.ndarray]]] = {
+    'moving_avg_breakout': moving_avg_breakout,
+    'ma_150_crossed': ma_150_crossed,
+    'cci_cross_zero': cci_cross_zero,
+    'cci_cross_zero2': cci_cross_zero2,
+}
+
 
 def main():
     h5_file_path = Path(Config.eod_price_data_stooq_path)
     ticker = 'NVDA'
-    with pd.HDFStore(h5_file_path.resolve(), 'r+') as store:
-        df = store.get(ticker)
+    with open_price_store(str(h5_file_path.resolve()), 'r') as store:
+        df = store.read(ticker, start=pd.Timestamp.now() - pd.DateOffset(years=15))
         df.columns = map(str.lower, df.columns)
-        
-        df = df[df.index >= pd.Timestamp.now() - pd.DateOffset(years=15)]
+        indicators = IndicatorCache(store).for_symbol(ticker, df)
 
         # pf = vbt.Portfolio.from_signals(price, entries, exits, init_cash=100)
         # print(pf.total_profit())
-        entry_signal, exit_signal = moving_avg_breakout(df)
-        # entry_signal, exit_signal = cci_cross_zero2(df)
-        # entry_signal, exit_signal = ma_150_crossed(df)
+        entry_signal, exit_signal = moving_avg_breakout(**price_arrays(df), indicators=indicators)
+        # entry_signal, exit_signal = cci_cross_zero2(**price_arrays(df), indicators=indicators)
+        # entry_signal, exit_signal = ma_150_crossed(**price_arrays(df), indicators=indicators)
         
         portfolio = vbt.Portfolio.from_signals(df['close'], entries=entry_signal, exits=exit_signal, freq='1d')
         print(portfolio.stats())
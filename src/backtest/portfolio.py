@@ -0,0 +1,297 @@
+import argparse
+import gc
+import logging
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from numba import njit
+from tqdm import tqdm
+
+from src.backtest.backtest_vectorbt import STRATEGIES
+from src.config import Config
+from src.panel import Panel, refresh_panel
+from src.price_store import open_price_store
+
+# columns of the order records filled by simulate_chunk_nb
+ORDER_FIELDS = ('bar', 'column', 'size', 'price', 'fees')
+
+
+@njit(cache=True)
+def _record_order(orders: np.ndarray, row: int, bar: int, col: int, size: float, price: float, fees: float):
+    orders[row, 0] = bar
+    orders[row, 1] = col
+    orders[row, 2] = size
+    orders[row, 3] = price
+    orders[row, 4] = fees
+
+
+@njit(cache=True)
+def simulate_chunk_nb(close: np.ndarray, priority: np.ndarray, entries: np.ndarray, exits: np.ndarray,
+                      last_bars: np.ndarray, first_bar: int, cash: np.ndarray, shares: np.ndarray,
+                      last_price: np.ndarray,
+                      max_positions: int, position_size: float, max_position_value: float, fees: float,
+                      orders: np.ndarray, equity: np.ndarray, cash_out: np.ndarray, positions: np.ndarray) -> int:
+    """
+    Shared-cash simulation kernel over one time chunk of (bars x symbols) arrays.
+
+    On every bar, at the close: positions with an exit signal are sold in full, then symbols with an entry signal
+    (and no exit on the same bar) are bought in descending `priority` while fewer than `max_positions` are open.
+    A new position is worth `position_size` of the equity, capped at `max_position_value` and at the cash left.
+    A symbol without a close on a bar can't trade there and is valued at its last close. A symbol that stops
+    trading (`last_bars`, its last bar, -1 while it still trades) is liquidated at the close of its last bar,
+    which frees its slot, and isn't bought on that bar.
+
+    `cash` (1 element), `shares` and `last_price` are the state carried from the previous chunk and are updated
+    in place; `orders` is filled from row 0 and the number of orders written is returned.
+    """
+    n_bars, n_cols = close.shape
+    open_positions = 0
+    for col in range(n_cols):
+        if shares[col] > 0:
+            open_positions += 1
+    n_orders = 0
+    candidates = np.empty(n_cols, dtype=np.int64)
+    candidate_priority = np.empty(n_cols, dtype=np.float64)
+    for i in range(n_bars):
+        for col in range(n_cols):
+            if not np.isnan(close[i, col]):
+                last_price[col] = close[i, col]
+        value = cash[0]
+        for col in range(n_cols):
+            if shares[col] > 0:
+                value += shares[col] * last_price[col]
+
+        for col in range(n_cols):
+            delisted = last_bars[col] == first_bar + i
+            if (exits[i, col] or delisted) and shares[col] > 0 and not np.isnan(close[i, col]):
+                proceeds = shares[col] * close[i, col]
+                order_fees = proceeds * fees
+                cash[0] += proceeds - order_fees
+                _record_order(orders, n_orders, first_bar + i, col, -shares[col], close[i, col], order_fees)
+                n_orders += 1
+                shares[col] = 0.0
+                open_positions -= 1
+
+        n_candidates = 0
+        if open_positions < max_positions:
+            for col in range(n_cols):
+                if (entries[i, col] and not exits[i, col] and shares[col] == 0 and not np.isnan(close[i, col])
+                        and last_bars[col] != first_bar + i):
+                    candidates[n_candidates] = col
+                    candidate_priority[n_candidates] = -priority[i, col] if not np.isnan(priority[i, col]) else 0.0
+                    n_candidates += 1
+        if n_candidates > 0:
+            order = np.argsort(candidate_priority[:n_candidates], kind='mergesort')
+            for k in range(n_candidates):
+                if open_positions >= max_positions:
+                    break
+                col = candidates[order[k]]
+                target = min(value * position_size, max_position_value, cash[0])
+                if target <= 0:
+                    break
+                size = target / (close[i, col] * (1 + fees))
+                order_fees = size * close[i, col] * fees
+                cash[0] -= size * close[i, col] + order_fees
+                _record_order(orders, n_orders, first_bar + i, col, size, close[i, col], order_fees)
+                n_orders += 1
+                shares[col] = size
+                open_positions += 1
+
+        value = cash[0]
+        for col in range(n_cols):
+            if shares[col] > 0:
+                value += shares[col] * last_price[col]
+        equity[i] = value
+        cash_out[i] = cash[0]
+        positions[i] = open_positions
+    return n_orders
+
+
+@dataclass
+class PortfolioResult:
+    equity: pd.Series  # value of the cash and the open positions after every bar
+    cash: pd.Series
+    positions: pd.Series  # number of open positions after every bar
+    orders: pd.DataFrame  # date, symbol, size (negative for sells), price, fees
+    init_cash: float
+    freq: str = '1d'
+
+    def returns(self) -> pd.Series:
+        return self.equity / self.equity.shift(1, fill_value=self.init_cash) - 1
+
+    def stats(self) -> pd.Series:
+        """
+        Returns the main statistics of the equity curve.
+        """
+        returns = self.returns().vbt.returns(freq=self.freq)
+        return pd.Series({
+            'start_value': self.init_cash,
+            'end_value': self.equity.iloc[-1] if len(self.equity) else self.init_cash,
+            'total_return': returns.total(),
+            'max_drawdown': returns.max_drawdown(),
+            'sharpe_ratio': returns.sharpe_ratio(),
+            'total_orders': len(self.orders),
+            'max_positions': self.positions.max() if len(self.positions) else 0,
+        })
+
+
+def compute_signals(panel: Panel, strategy: str, columns: np.ndarray, signals_dir: str, block_size: int = 256,
+                    **strategy_kwargs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Runs a strategy over the panel's whole history, `block_size` symbols at a time, into (dates x symbols)
+    boolean memory-mapped entry and exit files in `signals_dir`. Memory stays bounded by (dates x block_size).
+
+    Returns:
+        (entries, exits, last_bars): The signals, and the row of each symbol's last close when it stopped
+        trading before the panel's last date (-1 otherwise).
+    """
+    shape = (len(panel.dates), len(columns))
+    last_bars = np.full(len(columns), -1, dtype=np.int64)
+    entries = np.memmap(Path(signals_dir) / 'entries.bin', dtype=np.bool_, mode='w+', shape=shape)
+    exits = np.memmap(Path(signals_dir) / 'exits.bin', dtype=np.bool_, mode='w+', shape=shape)
+    for block_start in tqdm(range(0, len(columns), block_size), desc=f"Computing {strategy} signals"):
+        block = columns[block_start:block_start + block_size]
+        prices = {name: np.ascontiguousarray(panel.field(name)[:, block], dtype=np.float64)
+                  for name in ('high', 'low', 'close')}
+        entry_signal, exit_signal = STRATEGIES[strategy](**prices, **strategy_kwargs)
+        entries[:, block_start:block_start + len(block)] = entry_signal
+        exits[:, block_start:block_start + len(block)] = exit_signal
+        has_close = ~np.isnan(prices['close'])
+        block_last_bars = len(panel.dates) - 1 - np.argmax(has_close[::-1], axis=0)
+        stopped = has_close.any(axis=0) & (block_last_bars < len(panel.dates) - 1)
+        last_bars[block_start:block_start + len(block)] = np.where(stopped, block_last_bars, -1)
+        # vectorbt's indicator objects are freed by the cycle collector only, collect them before the next block
+        gc.collect()
+    entries.flush()
+    exits.flush()
+    return entries, exits, last_bars
+
+
+def _row(dates: pd.DatetimeIndex, time, side: str) -> int:
+    # naive dates are local times of a tz-aware (intraday) panel
+    time = pd.Timestamp(time)
+    if dates.tz is not None and time.tz is None:
+        time = time.tz_localize(dates.tz)
+    return int(dates.searchsorted(time, side=side))
+
+
+def simulate_portfolio(panel: Panel, strategy: str, symbols: Optional[Sequence[str]] = None,
+                       init_cash: float = 100_000, max_positions: int = 20, position_size: Optional[float] = None,
+                       max_position_value: float = np.inf, fees: float = 0.0, start=None, end=None,
+                       chunk_bars: int = 252, block_size: int = 256, freq: str = '1d', work_dir: Optional[str] = None,
+                       **strategy_kwargs) -> PortfolioResult:
+    """
+    Backtests a strategy from backtest_vectorbt over many symbols with one shared cash pool, unlike
+    runner.run_universe where every symbol trades its own capital.
+
+    The strategy's signals are computed first over the panel's whole history in blocks of symbols and kept in
+    memory-mapped files. The bars are then simulated in time chunks of `chunk_bars` dates: each chunk maps its
+    rows of the panel and the signals, and the cash, shares and last prices are carried to the next chunk, so
+    memory stays bounded by (chunk_bars x symbols) whatever the length of the history
+    (a 5,000-symbol chunk of a year is about 20 MB).
+
+    Positions in a symbol that stops trading before the panel's last date are sold at its last close.
+
+    Parameters:
+        panel (Panel): Panel of the universe (see panel.open_panel); needs high, low, close (and volume).
+        strategy (str): Name of a strategy in backtest_vectorbt.STRATEGIES.
+        symbols (Sequence[str]): Symbols traded (defaults to the whole panel).
+        init_cash (float): Starting cash.
+        max_positions (int): Maximum number of positions open at once.
+        position_size (float): Share of the equity put in every new position (defaults to 1 / max_positions).
+        max_position_value (float): Maximum value of a new position.
+        fees (float): Fees as a fraction of every order's value.
+        start, end: Optional first and last date simulated; the signals still see the history before `start`.
+        chunk_bars (int): Number of dates simulated at a time.
+        block_size (int): Number of symbols the signals are computed for at a time.
+        freq (str): Bar frequency, to annualize the statistics.
+        work_dir (str): Directory of the temporary signal files (defaults to the system temp directory).
+        **strategy_kwargs: Strategy parameters.
+
+    Returns:
+        PortfolioResult: Equity, cash and open positions per date, and the orders.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    symbols = list(panel.symbols if symbols is None else symbols)
+    columns = panel.columns(symbols)
+    position_size = 1 / max_positions if position_size is None else position_size
+    first_row = 0 if start is None else _row(panel.dates, start, side='left')
+    end_row = len(panel.dates) if end is None else _row(panel.dates, end, side='right')
+    close_field = panel.field('close')
+    volume_field = panel.field('volume') if 'volume' in panel.fields else None
+
+    cash = np.array([float(init_cash)])
+    shares = np.zeros(len(columns))
+    last_price = np.full(len(columns), np.nan)
+    n_rows = max(end_row - first_row, 0)
+    equity, cash_out = np.empty(n_rows), np.empty(n_rows)
+    positions = np.empty(n_rows, dtype=np.int64)
+    order_chunks = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as signals_dir:
+        entries, exits, last_bars = compute_signals(panel, strategy, columns, signals_dir, block_size,
+                                                    **strategy_kwargs)
+        for chunk_start in tqdm(range(first_row, end_row, chunk_bars), desc="Simulating portfolio"):
+            rows = slice(chunk_start, min(chunk_start + chunk_bars, end_row))
+            close = np.ascontiguousarray(close_field[rows][:, columns], dtype=np.float64)
+            # candidates are bought in order of dollar volume
+            priority = close * volume_field[rows][:, columns] if volume_field is not None else np.zeros_like(close)
+            chunk_entries = np.ascontiguousarray(entries[rows])
+            chunk_exits = np.ascontiguousarray(exits[rows])
+            # every sell closes a position open at the start of the chunk or bought in it
+            buys = int(chunk_entries.sum())
+            orders = np.empty((2 * buys + int(np.count_nonzero(shares)), len(ORDER_FIELDS)))
+            out = slice(rows.start - first_row, rows.stop - first_row)
+            n_orders = simulate_chunk_nb(close, np.ascontiguousarray(priority, dtype=np.float64), chunk_entries,
+                                         chunk_exits, last_bars, rows.start, cash, shares, last_price,
+                                         max_positions, position_size, max_position_value, fees, orders,
+                                         equity[out], cash_out[out], positions[out])
+            order_chunks.append(orders[:n_orders].copy())
+        del entries, exits
+
+    dates = panel.dates[first_row:end_row]
+    orders = np.concatenate(order_chunks) if order_chunks else np.empty((0, len(ORDER_FIELDS)))
+    orders_df = pd.DataFrame({
+        'date': panel.dates[orders[:, 0].astype(np.int64)],
+        'symbol': np.asarray(symbols, dtype=object)[orders[:, 1].astype(np.int64)],
+        'size': orders[:, 2], 'price': orders[:, 3], 'fees': orders[:, 4],
+    })
+    return PortfolioResult(pd.Series(equity, index=dates, name='equity'), pd.Series(cash_out, index=dates, name='cash'),
+                           pd.Series(positions, index=dates, name='positions'), orders_df, float(init_cash), freq)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest a strategy over a universe with one shared cash pool")
+    parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    parser.add_argument('--store', default=Config.eod_price_data_stooq_path)
+    parser.add_argument('--symbols', nargs='*', help="symbols traded (default: the whole panel)")
+    parser.add_argument('--init-cash', type=float, default=100_000)
+    parser.add_argument('--max-positions', type=int, default=20)
+    parser.add_argument('--position-size', type=float, default=None, help="share of the equity per position")
+    parser.add_argument('--max-position-value', type=float, default=np.inf)
+    parser.add_argument('--fees', type=float, default=0.0)
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--chunk-bars', type=int, default=252)
+    args = parser.parse_args()
+
+    with open_price_store(str(Path(args.store).resolve()), mode='r') as store:
+        panel = refresh_panel(store)
+    symbols = [symbol for symbol in args.symbols if symbol in panel.symbols] if args.symbols else None
+    result = simulate_portfolio(panel, args.strategy, symbols=symbols, init_cash=args.init_cash,
+                                max_positions=args.max_positions, position_size=args.position_size,
+                                max_position_value=args.max_position_value, fees=args.fees, start=args.start,
+                                end=args.end, chunk_bars=args.chunk_bars)
+    print(result.stats())
+    print(result.orders.tail(20))
+    result.equity.vbt.plot().show()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,53 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+# reference implementations and synthetic bars the optimised strategies are tested and benchmarked against
+
+
+def legacy_moving_avg_breakout(df: pd.DataFrame, ma_period: int = 20,
+                               lookback: int = 10) -> Tuple[pd.Series, pd.Series]:
+    """
+    moving_avg_breakout before it took price arrays, as it was written: it computes an (unused) ATR and writes
+    its scratch columns (MA, Below_MA, Was_Downtrend, Breakout, Confirmed_Breakout, Cross_down) into the
+    frame it is given (lower-case high/low/close columns). Pass a copy to keep the frame untouched.
+    """
+    atr = vbt.ATR.run(low=df['low'], close=df['close'], high=df['high'], window=14)
+    atr = atr.atr
+
+    df['MA'] = vbt.MA.run(df['close'], window=ma_period).ma
+    df['Below_MA'] = df['close'] < df['MA']
+    df['Was_Downtrend'] = df['Below_MA'].rolling(lookback).sum() == lookback
+    df['Breakout'] = (df['close'] > df['MA']) & (df['close'].shift(1) <= df['MA'].shift(1))
+    df['Confirmed_Breakout'] = df['Breakout'] & df['Was_Downtrend'].shift(1)
+    holding = df['Confirmed_Breakout'].cumsum()
+    holding[df['close'] < df['MA']] = np.nan
+    holding = holding.ffill().notna() & df['Confirmed_Breakout'].cumsum().gt(0)
+    df['Cross_down'] = holding & df['Below_MA'] & (df['close'].shift(1) >= df['MA'].shift(1))
+    return df['Confirmed_Breakout'], df['Cross_down'].astype(bool).fillna(False)
+
+
+def synthetic_bars(n_bars: int, seed: int = 0, freq: str = 'B', column_case: str = 'lower') -> pd.DataFrame:
+    """
+    Returns random-walk OHLCV bars from 2010-01-01 on, reproducible from `seed`.
+
+    Parameters:
+        n_bars (int): Number of bars.
+        seed (int): Seed of the random generator.
+        freq (str): Bar frequency of the index.
+        column_case (str): 'lower' (open, high, ...) like the chart and the strategies, or 'title' (Open, High, ...)
+            like the price stores.
+    """
+    if column_case not in ('lower', 'title'):
+        raise ValueError(f"Unknown column case: {column_case}")
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+    spread = close * rng.uniform(0, 0.02, n_bars)
+    df = pd.DataFrame({'open': close, 'high': close + spread, 'low': close - spread, 'close': close,
+                       'volume': rng.integers(10_000, 1_000_000, n_bars).astype(float)},
+                      index=pd.date_range('2010-01-01', periods=n_bars, freq=freq))
+    if column_case == 'title':
+        df.columns = df.columns.str.title()
+    return df
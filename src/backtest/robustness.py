@@ -0,0 +1,172 @@
+import argparse
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from src.backtest.backtest_vectorbt import STRATEGIES, price_arrays
+from src.config import Config
+from src.price_store import open_price_store
+
+# (rng, paths) -> (paths x steps) returns of `paths` resampled paths
+PathSampler = Callable[[np.random.Generator, int], np.ndarray]
+
+
+@dataclass
+class RobustnessResult:
+    final_equity: Optional[np.ndarray]  # per path, starting from `init_cash` (None when the same on every path)
+    max_drawdown: np.ndarray  # per path, as a negative fraction like Portfolio.max_drawdown
+    sharpe_ratio: Optional[np.ndarray]  # per path, annualized (None when the same on every path)
+
+    def summary(self, quantiles: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95)) -> pd.DataFrame:
+        """
+        Returns the mean and quantiles of every distribution (rows: statistics, columns: metrics).
+        """
+        metrics = pd.DataFrame({name: values for name, values in (('final_equity', self.final_equity),
+                                                                  ('max_drawdown', self.max_drawdown),
+                                                                  ('sharpe_ratio', self.sharpe_ratio))
+                                if values is not None})
+        return pd.concat([metrics.mean().to_frame('mean').T, metrics.quantile(list(quantiles))])
+
+
+def trade_returns(portfolio: vbt.Portfolio) -> np.ndarray:
+    """
+    Returns the returns of a single-column portfolio's closed trades in the order they were exited.
+    """
+    if portfolio.wrapper.ndim != 1:
+        raise ValueError("Expected a single-column portfolio, select one column first")
+    records = portfolio.trades.closed.records_arr
+    return records['return'][np.argsort(records['exit_idx'], kind='stable')].astype(np.float64)
+
+
+def shuffle_sampler(returns: np.ndarray) -> PathSampler:
+    """
+    Paths of the same trades in random orders. Only the drawdown depends on the order: every path has the
+    final equity (the product of the trades) and the Sharpe ratio (their mean and std) of the original one.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    return lambda rng, paths: rng.permuted(np.broadcast_to(returns, (paths, len(returns))), axis=1)
+
+
+def skip_sampler(returns: np.ndarray, skip_probability: float = 0.1) -> PathSampler:
+    """
+    Paths of the trades in their order, each trade skipped (a zero return) with `skip_probability`.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    return lambda rng, paths: np.where(rng.random((paths, len(returns))) < skip_probability, 0.0, returns)
+
+
+def block_bootstrap_sampler(returns: np.ndarray, block_size: int = 20) -> PathSampler:
+    """
+    Moving block bootstrap of bar returns: every path concatenates blocks of `block_size` consecutive returns
+    starting at random bars, which keeps the autocorrelation (volatility clusters, trends) within a block.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    block_size = max(1, min(block_size, len(returns)))
+    blocks = math.ceil(len(returns) / block_size)
+    offsets = np.arange(block_size)
+
+    def sample(rng: np.random.Generator, paths: int) -> np.ndarray:
+        starts = rng.integers(0, len(returns) - block_size + 1, size=(paths, blocks))
+        indices = (starts[:, :, None] + offsets).reshape(paths, blocks * block_size)[:, :len(returns)]
+        return returns[indices]
+    return sample
+
+
+def simulate(sampler: PathSampler, n_paths: int = 10000, periods_per_year: float = 252, init_cash: float = 1.0,
+             seed: Optional[int] = None, chunk_size: int = 500) -> RobustnessResult:
+    """
+    Draws `n_paths` paths of returns from a sampler and measures every path's final equity, max drawdown and
+    Sharpe ratio. Paths are drawn and measured as (paths x steps) arrays, `chunk_size` paths at a time,
+    so memory stays bounded by (chunk_size x steps) and the chunks stay in the CPU caches.
+
+    Parameters:
+        sampler: One of the *_sampler functions.
+        n_paths (int): Number of paths.
+        periods_per_year (float): Steps (bars or trades) per year, to annualize the Sharpe ratio.
+        init_cash (float): Equity at the start of every path.
+        seed (int): Seed of the random generator, for reproducible distributions.
+        chunk_size (int): Number of paths drawn at once.
+    """
+    rng = np.random.default_rng(seed)
+    final_equity = np.empty(n_paths)
+    max_drawdown = np.empty(n_paths)
+    sharpe_ratio = np.empty(n_paths)
+    for start in range(0, n_paths, chunk_size):
+        paths = slice(start, min(start + chunk_size, n_paths))
+        returns = sampler(rng, paths.stop - paths.start)
+        if returns.shape[1] == 0:
+            final_equity[paths], max_drawdown[paths], sharpe_ratio[paths] = init_cash, 0.0, np.nan
+            continue
+        equity = np.cumprod(1 + returns, axis=1)
+        final_equity[paths] = init_cash * equity[:, -1]
+        peak = np.maximum.accumulate(equity, axis=1)
+        np.maximum(peak, 1.0, out=peak)  # the starting equity is the first peak
+        np.divide(equity, peak, out=peak)
+        max_drawdown[paths] = np.min(peak, axis=1) - 1
+        std = returns.std(axis=1, ddof=1) if returns.shape[1] > 1 else np.full(returns.shape[0], np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe_ratio[paths] = returns.mean(axis=1) / std * np.sqrt(periods_per_year)
+    return RobustnessResult(final_equity, max_drawdown, sharpe_ratio)
+
+
+def monte_carlo(portfolio: vbt.Portfolio, n_paths: int = 10000, block_size: int = 20, skip_probability: float = 0.1,
+                seed: Optional[int] = None) -> Dict[str, RobustnessResult]:
+    """
+    Robustness of a single-column portfolio's result beyond its one historical path: distributions of final
+    equity, max drawdown and Sharpe ratio over `n_paths` resampled paths of each kind.
+
+    - 'shuffle': its closed trades in random orders, max drawdown only (the other metrics don't change with
+      the order, see shuffle_sampler).
+    - 'skip': its closed trades with each one skipped with `skip_probability`.
+    - 'bootstrap': block bootstrap of its bar returns (see block_bootstrap_sampler).
+
+    Trade paths compound the trade returns, i.e. assume the whole equity is in every trade, as from_signals does
+    by default; their Sharpe ratio is annualized with the portfolio's number of trades per year. They only see
+    the equity between trades, so their max drawdown leaves out the drawdown within trades and is milder than
+    Portfolio.max_drawdown, even for the trades in their historical order. Bar-return paths (bootstrap) include it.
+    """
+    init_cash = float(np.asarray(portfolio.init_cash).item())
+    ann_factor = portfolio.returns_acc.ann_factor
+    bar_returns = np.nan_to_num(portfolio.returns().to_numpy(dtype=np.float64))
+    trades = trade_returns(portfolio)
+    trades_per_year = ann_factor * len(trades) / max(len(bar_returns), 1)
+    shuffle = simulate(shuffle_sampler(trades), n_paths, trades_per_year, init_cash, seed)
+    return {
+        'shuffle': RobustnessResult(None, shuffle.max_drawdown, None),
+        'skip': simulate(skip_sampler(trades, skip_probability), n_paths, trades_per_year, init_cash, seed),
+        'bootstrap': simulate(block_bootstrap_sampler(bar_returns, block_size), n_paths, ann_factor, init_cash, seed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo robustness of a strategy backtest on one symbol")
+    parser.add_argument('symbol')
+    parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    parser.add_argument('--store', default=Config.eod_price_data_stooq_path)
+    parser.add_argument('--years', type=int, default=15)
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--block-size', type=int, default=20)
+    parser.add_argument('--skip-probability', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    with open_price_store(str(Path(args.store).resolve()), 'r') as store:
+        df = store.read(args.symbol, start=pd.Timestamp.now() - pd.DateOffset(years=args.years))
+    prices = price_arrays(df)
+    entry_signal, exit_signal = STRATEGIES[args.strategy](**prices)
+    portfolio = vbt.Portfolio.from_signals(pd.Series(prices['close'], index=df.index), entries=entry_signal,
+                                           exits=exit_signal, freq='1d')
+    print(portfolio.stats())
+    for name, result in monte_carlo(portfolio, args.paths, args.block_size, args.skip_probability,
+                                    args.seed).items():
+        print(f"\n{name}:")
+        print(result.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import logging
+import os
+from multiprocessing import Pool
+from os import path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import vectorbt as vbt
+from tqdm import tqdm
+
+from src.backtest.backtest_vectorbt import STRATEGIES, price_arrays
+from src.config import Config
+from src.indicator_cache import IndicatorCache
+from src.indicators import IndicatorLookup
+from src.price_store import PriceStore, open_price_store
+
+# price store and indicator cache opened once per worker process by init_worker
+_worker_store: Optional[PriceStore] = None
+_worker_indicators: Optional[IndicatorCache] = None
+
+
+def init_worker(store_path: str):
+    """
+    Process pool initializer: opens the price store and its indicator cache once per worker process
+    (see worker_store and worker_indicators).
+    """
+    global _worker_store, _worker_indicators
+    _worker_store = open_price_store(store_path, mode='r')
+    _worker_indicators = IndicatorCache(_worker_store)
+
+
+def worker_store() -> PriceStore:
+    """
+    Returns the price store opened by init_worker in this worker process.
+    """
+    if _worker_store is None:
+        raise RuntimeError("init_worker wasn't called in this process")
+    return _worker_store
+
+
+def worker_indicators() -> IndicatorCache:
+    """
+    Returns the indicator cache opened by init_worker in this worker process.
+    """
+    if _worker_indicators is None:
+        raise RuntimeError("init_worker wasn't called in this process")
+    return _worker_indicators
+
+
+def backtest_symbol(df: pd.DataFrame, strategy: str, freq: str = '1d', indicators: Optional[IndicatorLookup] = None,
+                    **strategy_kwargs) -> pd.Series:
+    """
+    Runs one strategy from backtest_vectorbt on a single symbol's bars and returns the portfolio stats.
+    `indicators` (IndicatorCache.for_symbol of the same bars) serves the strategy's indicators from the cache.
+    """
+    prices = price_arrays(df)
+    entry_signal, exit_signal = STRATEGIES[strategy](**prices, indicators=indicators, **strategy_kwargs)
+    close = pd.Series(prices['close'], index=df.index)
+    portfolio = vbt.Portfolio.from_signals(close, entries=entry_signal, exits=exit_signal, freq=freq)
+    return portfolio.stats()
+
+
+def _backtest_job(job: Tuple[str, str, Optional[str], str, dict]) -> Tuple[str, Optional[pd.Series], Optional[str]]:
+    # process pool worker: each worker reads its own symbol slice from the store
+    symbol, strategy, start, freq, strategy_kwargs = job
+    try:
+        df = worker_store().read(symbol, start=start)
+        if len(df) == 0:
+            return symbol, None, f"{symbol}: no bars"
+        indicators = worker_indicators().for_symbol(symbol, df)
+        return symbol, backtest_symbol(df, strategy, freq, indicators=indicators, **strategy_kwargs), None
+    except Exception as e:
+        return symbol, None, f"{symbol}: {e}"
+
+
+def select_symbols(store_path: str, symbols: Optional[Iterable[str]] = None, min_rows: int = 0,
+                   min_avg_dollar_volume: float = None, min_last_close: float = None) -> List[str]:
+    """
+    Returns the symbols to backtest: the given list, or the store's catalog filtered by the given conditions.
+    """
+    with open_price_store(store_path, mode='r') as store:
+        if symbols is not None:
+            existing_symbols = store.symbols()
+            return [symbol for symbol in symbols if symbol in existing_symbols]
+        catalog = store.catalog or store.rebuild_catalog()
+        return catalog.filter(min_rows=min_rows, min_avg_dollar_volume=min_avg_dollar_volume,
+                              min_last_close=min_last_close)
+
+
+def run_universe(strategy: str, symbols: List[str], store_path: str, output_path: str, start=None,
+                 freq: str = '1d', workers: Optional[int] = None, chunk_size: int = 200,
+                 **strategy_kwargs) -> pd.DataFrame:
+    """
+    Backtests a strategy over many symbols on a process pool and collects `Portfolio.stats()` of every
+    symbol into one results table. Symbols are streamed through the pool and the results are flushed to
+    `output_path` (CSV) every `chunk_size` symbols and only read back at the end, so memory stays bounded by
+    the bars in flight rather than growing with the universe.
+
+    Parameters:
+        strategy (str): Name of a strategy in backtest_vectorbt.STRATEGIES.
+        symbols (list): Symbols to backtest.
+        store_path (str): Path of the price store.
+        output_path (str): CSV file the results table is written to.
+        start: Optional first bar to backtest from.
+        freq (str): Bar frequency passed to vectorbt.
+        workers (int): Number of worker processes (defaults to the number of cores).
+        chunk_size (int): Number of symbol results kept in memory before being flushed to disk.
+
+    Returns:
+        DataFrame: Stats per symbol (symbols x stats), as read back from `output_path`.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    start = str(pd.Timestamp(start)) if start is not None else None
+    jobs = [(symbol, strategy, start, freq, strategy_kwargs) for symbol in symbols]
+
+    if path.exists(output_path):
+        os.remove(output_path)
+    pending: Dict[str, pd.Series] = {}
+
+    def flush():
+        if not pending:
+            return
+        chunk = pd.DataFrame.from_dict(pending, orient='index')
+        chunk.index.name = 'symbol'
+        chunk.to_csv(output_path, mode='a', header=not path.exists(output_path))
+        pending.clear()
+
+    with Pool(processes=workers or os.cpu_count(), initializer=init_worker, initargs=(store_path,)) as pool:
+        for symbol, stats, error in tqdm(pool.imap_unordered(_backtest_job, jobs), total=len(jobs),
+                                         desc=f"Backtesting {strategy}"):
+            if error is not None:
+                logging.warning(error)
+                continue
+            pending[symbol] = stats
+            if len(pending) >= chunk_size:
+                flush()
+    flush()
+
+    if not path.exists(output_path):
+        return pd.DataFrame(index=pd.Index([], name='symbol'))
+    return pd.read_csv(output_path, index_col='symbol')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest a strategy over a universe of symbols")
+    parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    parser.add_argument('--store', default=Config.eod_price_data_stooq_path, help="price store path")
+    parser.add_argument('--symbols', nargs='*', help="symbols to backtest (default: catalog filter)")
+    parser.add_argument('--min-rows', type=int, default=0)
+    parser.add_argument('--min-dollar-volume', type=float, default=None)
+    parser.add_argument('--min-close', type=float, default=None)
+    parser.add_argument('--start', default=None, help="first bar date, e.g. 2010-01-01")
+    parser.add_argument('--freq', default='1d')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--output', default=None, help="results CSV path")
+    args = parser.parse_args()
+
+    symbols = select_symbols(args.store, args.symbols, min_rows=args.min_rows,
+                             min_avg_dollar_volume=args.min_dollar_volume, min_last_close=args.min_close)
+    output_path = args.output or path.join(Config.data_dir, f'backtest_{args.strategy}.csv')
+    logging.info(f"Backtesting {args.strategy} on {len(symbols)} symbols")
+    results = run_universe(args.strategy, symbols, args.store, output_path, start=args.start, freq=args.freq,
+                           workers=args.workers, chunk_size=args.chunk_size)
+    print(results[['Total Return [%]', 'Max Drawdown [%]', 'Sharpe Ratio', 'Total Trades']]
+          .sort_values('Total Return [%]', ascending=False).head(20))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,220 @@
+import json
+import math
+import os
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+from src.indicators import price_arrays
+from src.streaming_indicators import (AverageTrueRange, CommodityChannelIndex, CrossedAbove, RollingMean,
+                                      StreamingState, TrailingStop)
+
+
+class StreamingStrategy(StreamingState, ABC):
+    """
+    Incremental version of a strategy in backtest_vectorbt: `update` takes one bar and returns its
+    (entry, exit) signals, with the same signals as the batch function replayed over the same history.
+    A bar costs O(1) for the MA/ATR strategies and O(window) for the CCI ones (see CommodityChannelIndex).
+    """
+
+    @abstractmethod
+    def update(self, high: float, low: float, close: float) -> Tuple[bool, bool]:
+        ...
+
+    def run(self, high: np.ndarray, low: np.ndarray, close: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Feeds a block of bars through the strategy and returns their (entry, exit) arrays.
+        """
+        entry_signal = np.zeros(len(close), dtype=np.bool_)
+        exit_signal = np.zeros(len(close), dtype=np.bool_)
+        for i, (high_i, low_i, close_i) in enumerate(zip(high.tolist(), low.tolist(), close.tolist())):
+            entry_signal[i], exit_signal[i] = self.update(high_i, low_i, close_i)
+        return entry_signal, exit_signal
+
+
+class MovingAvgBreakoutStream(StreamingStrategy):
+    """
+    Streaming backtest_vectorbt.moving_avg_breakout.
+    """
+
+    def __init__(self, ma_period: int = 20, lookback: int = 10, atr_mult: float = None, atr_window: int = 14):
+        self.lookback = lookback
+        self.atr_mult = atr_mult
+        self.ma = RollingMean(ma_period)
+        self.atr = AverageTrueRange(atr_window) if atr_mult is not None else None
+        # closes of the last `lookback` bars, for the ATR drop filter
+        self.closes = deque(maxlen=lookback)
+        self.below_run = 0
+        self.prev_close = np.nan
+        self.prev_ma = np.nan
+        self.prev_was_downtrend = False
+        self.entered = False
+
+    def update(self, high: float, low: float, close: float) -> Tuple[bool, bool]:
+        ma = self.ma.update(close)
+        below_ma = close < ma
+        self.below_run = self.below_run + 1 if below_ma else 0
+        was_downtrend = self.below_run >= self.lookback
+        if self.atr is not None:
+            atr = self.atr.update(high, low, close)
+            past_close = self.closes[0] if len(self.closes) == self.lookback else np.nan
+            self.closes.append(close)
+            was_downtrend = was_downtrend and ((past_close - close) > atr * self.atr_mult or math.isnan(self.atr_mult))
+
+        entry_signal = close > ma and self.prev_close <= self.prev_ma and self.prev_was_downtrend
+        self.entered = self.entered or entry_signal
+        exit_signal = self.entered and below_ma and self.prev_close >= self.prev_ma
+
+        self.prev_close, self.prev_ma, self.prev_was_downtrend = close, ma, was_downtrend
+        return entry_signal, exit_signal
+
+
+class MA150CrossedStream(StreamingStrategy):
+    """
+    Streaming backtest_vectorbt.ma_150_crossed.
+    """
+
+    def __init__(self, ma_window: int = 150, stop_multiple: float = 3, atr_window: int = 14):
+        self.ma = RollingMean(ma_window)
+        self.atr = AverageTrueRange(atr_window)
+        self.crossed = CrossedAbove()
+        self.trailing_stop = TrailingStop(stop_multiple)
+
+    def update(self, high: float, low: float, close: float) -> Tuple[bool, bool]:
+        ma = self.ma.update(close)
+        entry_signal = self.crossed.update(ma, close)
+        stop = self.trailing_stop.update(low, self.atr.update(high, low, close), entry_signal)
+        return entry_signal, close <= stop
+
+
+class CciCrossZero2Stream(StreamingStrategy):
+    """
+    Streaming backtest_vectorbt.cci_cross_zero2. The batch rule never fires an entry on the very last bar of its
+    input when the rising run started on the bar before; the stream reports it as soon as it happens, which is
+    what the batch function returns once one more bar is available.
+    """
+
+    def __init__(self, window: int = 14):
+        self.cci = CommodityChannelIndex(window)
+        self.prev_cci = np.nan
+        self.run_start_cci = np.nan
+        self.prev_entry = False
+
+    def update(self, high: float, low: float, close: float) -> Tuple[bool, bool]:
+        cci = self.cci.update(high, low, close)
+        rising = cci > self.prev_cci
+        if not rising:
+            self.run_start_cci = cci
+        entry_signal = rising and cci >= 0 and self.prev_cci < 0 and self.run_start_cci < -100
+        exit_signal = self.prev_entry
+        self.prev_cci, self.prev_entry = cci, entry_signal
+        return entry_signal, exit_signal
+
+
+class CciCrossZeroStream(StreamingStrategy):
+    """
+    Streaming backtest_vectorbt.cci_cross_zero.
+    """
+
+    def __init__(self, window: int = 14, window_size: int = 5):
+        self.cci = CommodityChannelIndex(window)
+        self.past_ccis = deque(maxlen=window_size)
+
+    def update(self, high: float, low: float, close: float) -> Tuple[bool, bool]:
+        cci = self.cci.update(high, low, close)
+        past_cci = self.past_ccis[0] if len(self.past_ccis) == self.past_ccis.maxlen else np.nan
+        self.past_ccis.append(cci)
+        window_change = cci - past_cci
+        entry_signal = past_cci < -100 and window_change > 0 and cci >= 0
+        exit_signal = past_cci > 100 and window_change < 0 and cci <= 0
+        return entry_signal, exit_signal
+
+
+# streaming versions of backtest_vectorbt.STRATEGIES, by the same names
+STREAMING_STRATEGIES: Dict[str, Type[StreamingStrategy]] = {
+    'moving_avg_breakout': MovingAvgBreakoutStream,
+    'ma_150_crossed': MA150CrossedStream,
+    'cci_cross_zero': CciCrossZeroStream,
+    'cci_cross_zero2': CciCrossZero2Stream,
+}
+
+
+class SignalStreams:
+    """
+    Per-symbol streaming state of one strategy over a universe. Bars at or before a symbol's last processed bar
+    are skipped, so overlapping fetch windows can be fed as they come. The whole state is saved to and restored
+    from a JSON file, so live evaluation resumes where it stopped instead of replaying the history.
+    """
+
+    def __init__(self, strategy: str, **strategy_kwargs):
+        if strategy not in STREAMING_STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        self.strategy = strategy
+        self.strategy_kwargs = strategy_kwargs
+        self.states: Dict[str, StreamingStrategy] = {}
+        self.last_bars: Dict[str, pd.Timestamp] = {}
+
+    def update(self, symbol: str, time: pd.Timestamp, high: float, low: float,
+               close: float) -> Optional[Tuple[bool, bool]]:
+        """
+        Processes one bar of the symbol and returns its (entry, exit) signals, or None for an already processed bar.
+        """
+        last_bar = self.last_bars.get(symbol)
+        if last_bar is not None and time <= last_bar:
+            return None
+        state = self.states.get(symbol)
+        if state is None:
+            state = self.states[symbol] = STREAMING_STRATEGIES[self.strategy](**self.strategy_kwargs)
+        self.last_bars[symbol] = time
+        return state.update(float(high), float(low), float(close))
+
+    def update_frame(self, symbol: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Processes the new bars of an OHLC frame (e.g. just fetched) and returns their entry/exit signals.
+        """
+        last_bar = self.last_bars.get(symbol)
+        if last_bar is not None:
+            df = df[df.index > last_bar]
+        if len(df) == 0:
+            return pd.DataFrame({'entry': np.zeros(0, dtype=np.bool_), 'exit': np.zeros(0, dtype=np.bool_)},
+                                index=df.index)
+        state = self.states.get(symbol)
+        if state is None:
+            state = self.states[symbol] = STREAMING_STRATEGIES[self.strategy](**self.strategy_kwargs)
+        entry_signal, exit_signal = state.run(**price_arrays(df))
+        self.last_bars[symbol] = df.index[-1]
+        return pd.DataFrame({'entry': entry_signal, 'exit': exit_signal}, index=df.index)
+
+    def to_dict(self) -> dict:
+        return {
+            'strategy': self.strategy,
+            'strategy_kwargs': self.strategy_kwargs,
+            'symbols': {symbol: {'last_bar': self.last_bars[symbol].isoformat(), 'state': state.to_dict()}
+                        for symbol, state in self.states.items()},
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'SignalStreams':
+        streams = SignalStreams(data['strategy'], **data['strategy_kwargs'])
+        strategy_type = STREAMING_STRATEGIES[data['strategy']]
+        for symbol, symbol_state in data['symbols'].items():
+            streams.states[symbol] = strategy_type.from_dict(symbol_state['state'])
+            streams.last_bars[symbol] = pd.Timestamp(symbol_state['last_bar'])
+        return streams
+
+    def save(self, state_path: str):
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, state_path)
+
+    @staticmethod
+    def load(state_path: str) -> Optional['SignalStreams']:
+        try:
+            with open(state_path, 'r') as f:
+                return SignalStreams.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,113 @@
+import argparse
+from itertools import product
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from tqdm import tqdm
+
+from src.backtest.backtest_vectorbt import moving_avg_breakout_signals
+from src.config import Config
+from src.price_store import open_price_store
+
+PARAM_NAMES = ['ma_period', 'lookback', 'atr_mult']
+
+
+def portfolio_metrics(portfolio: vbt.Portfolio) -> pd.DataFrame:
+    """
+    Returns the metrics compared across parameter combinations, one row per column of a multi-column portfolio.
+    """
+    return pd.DataFrame({
+        'total_return': portfolio.total_return(),
+        'sharpe_ratio': portfolio.sharpe_ratio(),
+        'max_drawdown': portfolio.max_drawdown(),
+        'total_trades': portfolio.trades.count(),
+        'win_rate': portfolio.trades.win_rate(),
+    })
+
+
+def moving_avg_breakout_sweep(df: pd.DataFrame, ma_periods: Sequence[int], lookbacks: Sequence[int],
+                              atr_mults: Sequence[Optional[float]] = (None,), atr_window: int = 14,
+                              freq: str = '1d', chunk_size: int = 500, **portfolio_kwargs) -> pd.DataFrame:
+    """
+    Backtests every (ma_period, lookback, atr_mult) combination of moving_avg_breakout on one symbol.
+
+    Each distinct MA period (and the ATR) is computed once; the entry/exit rules are broadcast over all
+    combinations as column stacks and every chunk of `chunk_size` combinations is simulated in a single
+    `Portfolio.from_signals` call, so memory stays bounded by (bars x chunk_size).
+    An `atr_mult` of None disables the ATR drop filter, as in moving_avg_breakout today.
+
+    Returns:
+        DataFrame: Metrics (total return, sharpe, max drawdown, trades, win rate) indexed by the parameters.
+    """
+    close = df['close']
+    ma_periods = sorted(set(ma_periods))
+    mas = vbt.MA.run(close.to_numpy(), window=ma_periods).ma.to_numpy().reshape(len(close), len(ma_periods))
+    atr_mults = [np.nan if atr_mult is None else float(atr_mult) for atr_mult in atr_mults]
+    atr = None
+    if not np.all(np.isnan(atr_mults)):
+        atr = vbt.ATR.run(df['high'], df['low'], close, window=atr_window).atr.to_numpy()
+
+    combinations = list(product(range(len(ma_periods)), lookbacks, atr_mults))
+    metrics = []
+    for chunk_start in tqdm(range(0, len(combinations), chunk_size), desc="Simulating parameter chunks"):
+        chunk = combinations[chunk_start:chunk_start + chunk_size]
+        ma_columns = np.array([ma_index for ma_index, _, _ in chunk])
+        chunk_lookbacks = np.array([lookback for _, lookback, _ in chunk])
+        chunk_atr_mults = np.array([atr_mult for _, _, atr_mult in chunk])
+        entry_signal, exit_signal = moving_avg_breakout_signals(
+            close.to_numpy(), mas[:, ma_columns], chunk_lookbacks,
+            atr=atr, atr_mult=chunk_atr_mults if atr is not None else None)
+
+        columns = pd.MultiIndex.from_arrays(
+            [[ma_periods[i] for i in ma_columns], chunk_lookbacks, chunk_atr_mults], names=PARAM_NAMES)
+        entries = pd.DataFrame(entry_signal, index=df.index, columns=columns)
+        exits = pd.DataFrame(exit_signal, index=df.index, columns=columns)
+        portfolio = vbt.Portfolio.from_signals(close, entries=entries, exits=exits, freq=freq, **portfolio_kwargs)
+        metrics.append(portfolio_metrics(portfolio))
+
+    return pd.concat(metrics)
+
+
+def plot_sweep_heatmap(metrics: pd.DataFrame, metric: str = 'total_return',
+                       x_level: str = 'ma_period', y_level: str = 'lookback'):
+    """
+    Returns a heatmap figure of one metric over two parameters, with a slider over the ATR multiple
+    when more than one was swept.
+    """
+    series = metrics[metric]
+    slider_level = 'atr_mult' if series.index.get_level_values('atr_mult').nunique() > 1 else None
+    if slider_level is None:
+        series = series.droplevel('atr_mult')
+    return series.vbt.heatmap(x_level=x_level, y_level=y_level, slider_level=slider_level,
+                              trace_kwargs=dict(colorbar=dict(title=metric)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweep of moving_avg_breakout on one symbol")
+    parser.add_argument('symbol')
+    parser.add_argument('--store', default=Config.eod_price_data_stooq_path)
+    parser.add_argument('--ma', type=int, nargs='+', default=list(range(10, 101, 5)))
+    parser.add_argument('--lookback', type=int, nargs='+', default=list(range(3, 31)))
+    parser.add_argument('--atr-mult', type=float, nargs='*', default=None)
+    parser.add_argument('--years', type=int, default=15)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--output', default=None, help="metrics CSV path")
+    args = parser.parse_args()
+
+    with open_price_store(str(Path(args.store).resolve()), 'r') as store:
+        df = store.read(args.symbol, start=pd.Timestamp.now() - pd.DateOffset(years=args.years))
+    df.columns = map(str.lower, df.columns)
+
+    metrics = moving_avg_breakout_sweep(df, args.ma, args.lookback, args.atr_mult or (None,),
+                                        chunk_size=args.chunk_size)
+    if args.output:
+        metrics.to_csv(args.output)
+    print(metrics.sort_values('total_return', ascending=False).head(20))
+    plot_sweep_heatmap(metrics).show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import inspect
+import logging
+import math
+import os
+from dataclasses import dataclass
+from itertools import product
+from multiprocessing import Pool
+from os import path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from tqdm import tqdm
+
+from src.backtest import runner
+from src.backtest.backtest_vectorbt import STRATEGIES, price_arrays
+from src.backtest.sweep import portfolio_metrics
+from src.config import Config
+from src.indicators import INDICATORS, IndicatorLookup
+
+ParamGrid = Dict[str, Sequence]
+
+# parameters counting the bars a strategy's rule looks back over its indicators (see warmup_bars)
+SIGNAL_LOOKBACK_PARAMS = ('lookback', 'window_size')
+# relative error at which an exponential average counts as converged from its start (see warmup_bars)
+CONVERGENCE_TOLERANCE = 1e-3
+# bars the indicators are probed on to find their warm-up
+WARMUP_PROBE_BARS = 1000
+
+# parameter grids optimised in every train window by default
+PARAM_GRIDS: Dict[str, ParamGrid] = {
+    'moving_avg_breakout': {'ma_period': [10, 20, 30, 50], 'lookback': [5, 10, 15, 20]},
+    'ma_150_crossed': {'ma_window': [50, 100, 150, 200], 'stop_multiple': [2, 3, 4]},
+}
+
+
+@dataclass(frozen=True)
+class Window:
+    train_start: pd.Timestamp  # train bars are [train_start, test_start)
+    test_start: pd.Timestamp  # test bars are [test_start, test_end)
+    test_end: pd.Timestamp
+
+
+@dataclass
+class WalkForwardResult:
+    windows: pd.DataFrame  # one row per (symbol, window): the chosen parameters, train metric and test metrics
+    returns: pd.DataFrame  # out-of-sample bar returns (dates x symbols), NaN outside the evaluated test windows
+
+    def equity(self) -> pd.DataFrame:
+        """
+        Returns the stitched out-of-sample equity curve of every symbol, starting at 1.
+        """
+        return (1 + self.returns.fillna(0)).cumprod()
+
+    def combined_equity(self) -> pd.Series:
+        """
+        Returns the out-of-sample equity curve of an equal-weight basket of the symbols, starting at 1.
+        """
+        return (1 + self.returns.mean(axis=1).fillna(0)).cumprod()
+
+
+def walk_forward_windows(start, end, train: pd.DateOffset, test: pd.DateOffset,
+                         anchored: bool = False) -> List[Window]:
+    """
+    Splits [start, end) into consecutive test windows of length `test`, each preceded by its train window:
+    the `train` period right before it (rolling) or everything from `start` (anchored).
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    windows = []
+    test_start = start + train
+    while test_start < end:
+        test_end = min(test_start + test, end)
+        windows.append(Window(start if anchored else test_start - train, test_start, test_end))
+        test_start = test_end
+    return windows
+
+
+def _grid_signals(df: pd.DataFrame, strategy: str, grid: ParamGrid,
+                  indicators: Optional[IndicatorLookup]) -> Tuple[pd.MultiIndex, np.ndarray, np.ndarray]:
+    # (bars x combinations) entry/exit signals over the whole history; the strategies only look back,
+    # so any window sliced from them has no look-ahead and starts with warmed-up indicators
+    names = list(grid)
+    combinations = list(product(*(grid[name] for name in names)))
+    prices = price_arrays(df)
+    entries = np.zeros((len(df), len(combinations)), dtype=np.bool_)
+    exits = np.zeros((len(df), len(combinations)), dtype=np.bool_)
+    for i, values in enumerate(combinations):
+        entries[:, i], exits[:, i] = STRATEGIES[strategy](**prices, indicators=indicators, **dict(zip(names, values)))
+    return pd.MultiIndex.from_tuples(combinations, names=names), entries, exits
+
+
+def _position(index: pd.DatetimeIndex, time: pd.Timestamp) -> int:
+    if index.tz is not None and time.tz is None:
+        time = time.tz_localize(index.tz)
+    return int(index.searchsorted(time, side='left'))
+
+
+def _probe_prices(n_bars: int) -> Dict[str, np.ndarray]:
+    # a random walk the strategies and indicators are probed on
+    close = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.02, n_bars)))
+    return dict(high=close * 1.01, low=close * 0.99, close=close)
+
+
+def _indicator_warmup(name: str, params: Tuple[Tuple[str, object], ...]) -> int:
+    # bars an indicator needs before its values are usable: its NaN head for rolling windows; for history-dependent
+    # ones (exponential averages never forget their start), the bars until the values computed from a later start
+    # are within CONVERGENCE_TOLERANCE of the full-history ones, measured on a random walk
+    indicator = INDICATORS[name]
+    if indicator.warmup is not None:
+        return indicator.warmup(**dict(params))
+    prices = _probe_prices(2 * WARMUP_PROBE_BARS)
+    full = indicator.compute(prices, **dict(params))[WARMUP_PROBE_BARS:]
+    later = indicator.compute({key: a[WARMUP_PROBE_BARS:] for key, a in prices.items()}, **dict(params))
+    with np.errstate(invalid='ignore'):
+        off = ~(np.abs(later - full) <= CONVERGENCE_TOLERANCE * np.abs(full))
+    return int(np.flatnonzero(off)[-1]) + 1 if off.any() else 0
+
+
+def warmup_bars(strategy: str, grid: ParamGrid) -> int:
+    """
+    Returns the number of bars the strategy needs before the first train bar, derived from what it uses for every
+    combination of the grid: the largest warm-up of the indicators it requests (their NaN head, or the bars an
+    exponential average takes to converge within CONVERGENCE_TOLERANCE), plus the bars its rule looks back over
+    those indicators (SIGNAL_LOOKBACK_PARAMS).
+    """
+    parameters = inspect.signature(STRATEGIES[strategy]).parameters
+    defaults = {name: parameter.default for name, parameter in parameters.items()
+                if parameter.default is not inspect.Parameter.empty}
+    prices = _probe_prices(WARMUP_PROBE_BARS)
+    names = list(grid)
+    warmup = 0
+    for values in product(*(grid[name] for name in names)):
+        params = {**defaults, **dict(zip(names, values))}
+        params.pop('indicators', None)
+        requested = []
+
+        def record(name: str, **indicator_params) -> np.ndarray:
+            requested.append((name, tuple(sorted(indicator_params.items()))))
+            return INDICATORS[name].compute(prices, **indicator_params)
+
+        STRATEGIES[strategy](**prices, indicators=record, **params)
+        indicator_warmup = max((_indicator_warmup(*request) for request in requested), default=0)
+        lookback = sum(int(params[name]) for name in SIGNAL_LOOKBACK_PARAMS if name in params)
+        warmup = max(warmup, indicator_warmup + lookback)
+    return warmup
+
+
+def _read_with_warmup(store, symbol: str, start, end, warmup: int) -> pd.DataFrame:
+    # the bars in [start, end] preceded by up to `warmup` earlier bars. The range before `start` is estimated from
+    # the symbol's average time per bar in the catalog (doubled for gaps), and the whole history read when short
+    start = pd.Timestamp(start)
+    entry = store.catalog.get(symbol) if store.catalog else None
+    df = None
+    if entry is not None and entry.rows > 1:
+        bar_span = (pd.Timestamp(entry.last_bar) - pd.Timestamp(entry.first_bar)) / (entry.rows - 1)
+        df = store.read(symbol, start=str(start - 2 * warmup * bar_span), end=end)
+        if _position(df.index, start) < warmup and len(df) and df.index[0] > pd.Timestamp(entry.first_bar):
+            df = None
+    if df is None:
+        df = store.read(symbol, end=end)
+    return df.iloc[max(0, _position(df.index, start) - warmup):]
+
+
+def walk_forward_symbol(df: pd.DataFrame, strategy: str, grid: ParamGrid, windows: Sequence[Window],
+                        metric: str = 'sharpe_ratio', freq: str = '1d',
+                        indicators: Optional[IndicatorLookup] = None) -> Tuple[List[dict], List[pd.Series]]:
+    """
+    Walks one symbol's bars forward: in every window, the grid combination with the best train `metric`
+    is backtested on the test bars that follow. `df` should start `warmup_bars` before the first train bar,
+    or the first train windows see the indicators' NaN warm-up.
+
+    The signals of every combination are computed once over all the bars (with their indicators from
+    `indicators`, IndicatorCache.for_symbol of the same bars) and sliced per window, so overlapping
+    train windows share them; each window then simulates all combinations in one `Portfolio.from_signals` call.
+
+    Returns:
+        (rows, returns): One stats dict and one Series of test bar returns per evaluated window.
+    """
+    columns, entries, exits = _grid_signals(df, strategy, grid, indicators)
+    close = pd.Series(price_arrays(df)['close'], index=df.index)
+    rows, returns = [], []
+    for window in windows:
+        train_start, test_start, test_end = (_position(df.index, time) for time in
+                                             (window.train_start, window.test_start, window.test_end))
+        if test_start - train_start < 2 or test_end == test_start:
+            continue
+        train = slice(train_start, test_start)
+        train_portfolio = vbt.Portfolio.from_signals(
+            close.iloc[train], entries=pd.DataFrame(entries[train], index=close.index[train], columns=columns),
+            exits=pd.DataFrame(exits[train], index=close.index[train], columns=columns), freq=freq)
+        train_metrics = portfolio_metrics(train_portfolio)[metric].to_numpy(dtype=np.float64)
+        if np.all(np.isnan(train_metrics)):
+            logging.debug(f"No trades in the train window from {window.train_start}")
+            continue
+        best = int(np.nanargmax(train_metrics))
+
+        test, column = slice(test_start, test_end), slice(best, best + 1)
+        test_index, test_columns = close.index[test], columns[column]
+        test_portfolio = vbt.Portfolio.from_signals(
+            close.iloc[test], entries=pd.DataFrame(entries[test, column], index=test_index, columns=test_columns),
+            exits=pd.DataFrame(exits[test, column], index=test_index, columns=test_columns), freq=freq)
+        test_metrics = portfolio_metrics(test_portfolio).iloc[0]
+        rows.append({
+            'train_start': window.train_start, 'test_start': window.test_start, 'test_end': window.test_end,
+            **dict(zip(columns.names, columns[best])),
+            f'train_{metric}': train_metrics[best],
+            **{f'test_{name}': value for name, value in test_metrics.items()},
+        })
+        returns.append(test_portfolio.returns().iloc[:, 0])
+    return rows, returns
+
+
+def _walk_forward_job(job: Tuple[str, str, ParamGrid, List[Window], Tuple[str, str], int, str, str]
+                      ) -> Tuple[str, List[dict], List[pd.Series], Optional[str]]:
+    # process pool worker (see runner.init_worker): every job of a symbol reads the same bars (`bounds`, from the
+    # warm-up before the first train bar of all windows), so its indicators are computed once and then served by
+    # the indicator cache
+    symbol, strategy, grid, windows, bounds, warmup, metric, freq = job
+    try:
+        df = _read_with_warmup(runner.worker_store(), symbol, bounds[0], bounds[1], warmup)
+        if len(df) == 0:
+            return symbol, [], [], f"{symbol}: no bars"
+        indicators = runner.worker_indicators().for_symbol(symbol, df)
+        rows, returns = walk_forward_symbol(df, strategy, grid, windows, metric, freq, indicators=indicators)
+        return symbol, rows, returns, None
+    except Exception as e:
+        return symbol, [], [], f"{symbol}: {e}"
+
+
+def walk_forward(strategy: str, symbols: List[str], store_path: str, windows: Sequence[Window],
+                 grid: Optional[ParamGrid] = None, metric: str = 'sharpe_ratio', freq: str = '1d',
+                 workers: Optional[int] = None) -> WalkForwardResult:
+    """
+    Walk-forward optimisation of a strategy over many symbols on a process pool.
+
+    Symbols are split into jobs of consecutive windows, as many per symbol as it takes to keep every worker busy
+    (a single symbol still runs its windows in parallel). All jobs of a symbol read the same bars, from
+    `warmup_bars` before the first train bar to the last test bar, so its indicators are shared across windows
+    and jobs through the indicator cache.
+
+    Parameters:
+        strategy (str): Name of a strategy in backtest_vectorbt.STRATEGIES.
+        symbols (list): Symbols to walk forward.
+        store_path (str): Path of the price store.
+        windows (list): Train/test windows (see walk_forward_windows).
+        grid (dict): Values of each strategy parameter to optimise (defaults to PARAM_GRIDS[strategy]).
+        metric (str): Train metric maximised: total_return, sharpe_ratio, max_drawdown or win_rate.
+        freq (str): Bar frequency passed to vectorbt.
+        workers (int): Number of worker processes (defaults to the number of cores).
+
+    Returns:
+        WalkForwardResult: Per-window stats and the out-of-sample returns of every symbol.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    if grid is None:
+        if strategy not in PARAM_GRIDS:
+            raise ValueError(f"No parameter grid for strategy: {strategy}")
+        grid = PARAM_GRIDS[strategy]
+    if metric not in ('total_return', 'sharpe_ratio', 'max_drawdown', 'win_rate'):
+        raise ValueError(f"Unknown metric: {metric}")
+    windows = list(windows)
+    if not windows or not symbols:
+        return WalkForwardResult(pd.DataFrame(), pd.DataFrame())
+
+    workers = workers or os.cpu_count()
+    batches = min(len(windows), math.ceil(workers / len(symbols)))
+    bounds = (str(min(window.train_start for window in windows)), str(windows[-1].test_end))
+    warmup = warmup_bars(strategy, grid)
+    jobs = [(symbol, strategy, grid, [windows[i] for i in batch], bounds, warmup, metric, freq)
+            for symbol in symbols for batch in np.array_split(np.arange(len(windows)), batches)]
+
+    rows: List[dict] = []
+    returns: Dict[str, List[pd.Series]] = {}
+    with Pool(processes=workers, initializer=runner.init_worker, initargs=(store_path,)) as pool:
+        for symbol, symbol_rows, symbol_returns, error in tqdm(
+                pool.imap_unordered(_walk_forward_job, jobs), total=len(jobs), desc=f"Walking forward {strategy}"):
+            if error is not None:
+                logging.warning(error)
+                continue
+            rows.extend({'symbol': symbol, **row} for row in symbol_rows)
+            returns.setdefault(symbol, []).extend(symbol_returns)
+
+    windows_df = pd.DataFrame(rows)
+    if len(windows_df):
+        windows_df = windows_df.sort_values(['symbol', 'test_start']).set_index(['symbol', 'test_start'])
+    returns_df = pd.DataFrame({symbol: pd.concat(series).sort_index()
+                               for symbol, series in sorted(returns.items()) if series})
+    return WalkForwardResult(windows_df, returns_df)
+
+
+def _parse_param(text: str) -> Tuple[str, list]:
+    # NAME=V1,V2,... with integer or float values
+    name, _, values = text.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError(f"Expected NAME=V1,V2,...: {text}")
+    parsed = [float(value) for value in values.split(',')]
+    return name, [int(value) if value.is_integer() else value for value in parsed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward optimisation of a strategy over a universe of symbols")
+    parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    parser.add_argument('--store', default=Config.eod_price_data_stooq_path, help="price store path")
+    parser.add_argument('--symbols', nargs='*', help="symbols to walk forward (default: catalog filter)")
+    parser.add_argument('--min-rows', type=int, default=0)
+    parser.add_argument('--min-dollar-volume', type=float, default=None)
+    parser.add_argument('--min-close', type=float, default=None)
+    parser.add_argument('--start', default=None, help="first train bar date (default: 15 years ago)")
+    parser.add_argument('--end', default=None, help="last test bar date (default: today)")
+    parser.add_argument('--train-months', type=int, default=36)
+    parser.add_argument('--test-months', type=int, default=12)
+    parser.add_argument('--anchored', action='store_true', help="train from the start instead of a rolling window")
+    parser.add_argument('--param', type=_parse_param, action='append', default=None,
+                        help="parameter values to optimise, e.g. ma_period=10,20,30 (default: PARAM_GRIDS)")
+    parser.add_argument('--metric', default='sharpe_ratio')
+    parser.add_argument('--freq', default='1d')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help="prefix of the windows and equity CSV files")
+    args = parser.parse_args()
+
+    start = pd.Timestamp(args.start) if args.start else pd.Timestamp.now().normalize() - pd.DateOffset(years=15)
+    end = pd.Timestamp(args.end) if args.end else pd.Timestamp.now().normalize()
+    windows = walk_forward_windows(start, end, pd.DateOffset(months=args.train_months),
+                                   pd.DateOffset(months=args.test_months), anchored=args.anchored)
+    symbols = runner.select_symbols(args.store, args.symbols, min_rows=args.min_rows,
+                                    min_avg_dollar_volume=args.min_dollar_volume, min_last_close=args.min_close)
+    logging.info(f"Walking {args.strategy} forward over {len(windows)} windows on {len(symbols)} symbols")
+    result = walk_forward(args.strategy, symbols, args.store, windows, grid=dict(args.param) if args.param else None,
+                          metric=args.metric, freq=args.freq, workers=args.workers)
+
+    output = args.output or path.join(Config.data_dir, f'walkforward_{args.strategy}')
+    result.windows.to_csv(f'{output}_windows.csv')
+    result.equity().to_csv(f'{output}_equity.csv')
+    print(result.windows.head(20))
+    combined = result.combined_equity()
+    if len(combined):
+        print(f"Out-of-sample return of the equal-weight basket: {combined.iloc[-1] - 1:.2%}")
+        combined.vbt.plot().show()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,140 @@
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+# number of most recent bars the average dollar volume is computed over
+DOLLAR_VOLUME_WINDOW = 20
+
+
+def find_column(df: pd.DataFrame, *names: str) -> Optional[str]:
+    """
+    Returns the first column of the dataframe matching one of the names, ignoring case
+    (stores use 'Close', 'CLOSE' or 'close' depending on the source).
+    """
+    columns = {column.lower(): column for column in df.columns}
+    for name in names:
+        if name in columns:
+            return columns[name]
+    return None
+
+
+@dataclass
+class CatalogEntry:
+    first_bar: str
+    last_bar: str
+    rows: int
+    last_close: float
+    avg_dollar_volume: float
+    version: int
+    recent_dollar_volumes: List[float] = field(default_factory=list)
+
+
+class SymbolCatalog:
+    """
+    JSON sidecar of a price store holding per-symbol summary data (first/last bar, row count, last close,
+    average dollar volume and a data version that changes on every append), so listing, searching and
+    filtering the universe never touches the price tables.
+    """
+
+    def __init__(self, catalog_path: str, entries: Optional[Dict[str, CatalogEntry]] = None):
+        self.catalog_path = catalog_path
+        self.entries: Dict[str, CatalogEntry] = entries if entries is not None else {}
+        self._dirty = False
+
+    @staticmethod
+    def load(catalog_path: str) -> Optional['SymbolCatalog']:
+        try:
+            with open(catalog_path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return SymbolCatalog(catalog_path, {symbol: CatalogEntry(**entry) for symbol, entry in data.items()})
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.catalog_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({symbol: asdict(entry) for symbol, entry in self.entries.items()}, f)
+        os.replace(tmp_path, self.catalog_path)
+        self._dirty = False
+
+    def symbols(self) -> Set[str]:
+        return set(self.entries)
+
+    def get(self, symbol: str) -> Optional[CatalogEntry]:
+        return self.entries.get(symbol)
+
+    def version(self, symbol: str) -> int:
+        entry = self.entries.get(symbol)
+        return entry.version if entry is not None else 0
+
+    def update(self, symbol: str, appended: pd.DataFrame, removed: int = 0):
+        """
+        Updates the symbol's entry with bars that were just appended to the store, after `removed` bars were
+        dropped from its end (see PriceStore.replace_tail).
+        """
+        if len(appended) == 0 and not removed:
+            return
+        close_column = find_column(appended, 'close', 'adj close')
+        volume_column = find_column(appended, 'volume', 'vol')
+        close = appended[close_column].to_numpy(dtype=float) if close_column else np.full(len(appended), np.nan)
+        volume = appended[volume_column].to_numpy(dtype=float) if volume_column else np.full(len(appended), np.nan)
+
+        entry = self.entries.get(symbol)
+        if entry is None:
+            entry = CatalogEntry(first_bar=appended.index[0].isoformat(), last_bar='', rows=0,
+                                 last_close=np.nan, avg_dollar_volume=np.nan, version=0)
+        # dollar volumes of removed bars are dropped (the average then covers fewer bars until new ones arrive)
+        kept = entry.recent_dollar_volumes[:max(0, len(entry.recent_dollar_volumes) - removed)]
+        recent = (kept + (close * volume).tolist())[-DOLLAR_VOLUME_WINDOW:]
+        entry.rows += len(appended) - removed
+        if len(appended):
+            entry.last_bar = appended.index[-1].isoformat()
+            entry.last_close = float(close[-1])
+        entry.avg_dollar_volume = float(np.nanmean(recent)) if not np.all(np.isnan(recent)) else np.nan
+        entry.recent_dollar_volumes = recent
+        entry.version += 1
+        self.entries[symbol] = entry
+        self._dirty = True
+
+    def remove(self, symbol: str):
+        if self.entries.pop(symbol, None) is not None:
+            self._dirty = True
+
+    def search(self, text: str, limit: int = 20) -> List[str]:
+        """
+        Returns the symbols starting with the given text (case-insensitive), exact match first.
+        """
+        text = text.upper()
+        matches = sorted(symbol for symbol in self.entries if symbol.upper().startswith(text))
+        matches.sort(key=lambda symbol: symbol.upper() != text)
+        return matches[:limit]
+
+    def filter(self, min_rows: int = 0, min_last_close: float = None, min_avg_dollar_volume: float = None,
+               last_bar_after=None) -> List[str]:
+        """
+        Returns the symbols matching all given universe conditions, sorted by average dollar volume (highest first).
+        """
+        last_bar_after = pd.Timestamp(last_bar_after) if last_bar_after is not None else None
+        selected = []
+        for symbol, entry in self.entries.items():
+            if entry.rows < min_rows:
+                continue
+            if min_last_close is not None and not entry.last_close >= min_last_close:
+                continue
+            if min_avg_dollar_volume is not None and not entry.avg_dollar_volume >= min_avg_dollar_volume:
+                continue
+            if last_bar_after is not None and pd.Timestamp(entry.last_bar) <= last_bar_after:
+                continue
+            selected.append(symbol)
+        selected.sort(key=lambda symbol: -np.nan_to_num(self.entries[symbol].avg_dollar_volume, nan=-1))
+        return selected
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame.from_dict({symbol: asdict(entry) for symbol, entry in self.entries.items()}, orient='index')
+        return df.drop(columns=['recent_dollar_volumes'], errors='ignore')
@@ -8,8 +8,14 @@ class Config:
     data_dir = 'data/'
     eod_file_path = path.join(data_dir, "eod_price_data.h5")
     five_m_file_path = path.join(data_dir, "5m_price_data.h5")
+    # 5m bars partitioned by day, with resampled 15m/1h/1d stores (see intraday_store.IntradayStore)
+    five_m_intraday_path = path.join(data_dir, "5m_price_data.intraday")
+    eod_last_updated_datetime_path = path.join(data_dir, "eod_last_updated.json")
+    five_m_last_updated_datetime_path = path.join(data_dir, "5m_last_updated.json")
     eod_price_data_stooq_path = path.join(data_dir, 'eod_price_data_stooq.h5')
+    eod_price_data_stooq_manifest_path = path.join(data_dir, 'eod_price_data_stooq_manifest.json')
     five_m_price_data_stooq_path = path.join(data_dir, 'five_m_price_data_stooq.h5')
+    equities_metadata_path = path.join(data_dir, 'equities_metadata.parquet')
     tickers_filepath = "tickers_list.yaml"
 
     @staticmethod
@@ -1,9 +1,13 @@
-from typing import List, Literal, Dict, Set
+from typing import Callable, List, Literal, Dict, Set
 from pathlib import Path
 from os.path import join
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 import json
 import logging
+import threading
+import time
 
 import pandas
 # import matplotlib.pyplot as plt
@@ -13,7 +17,8 @@ import pandas as pd
 
 import yfinance as yf
 
-from config import Config
+from src.config import Config
+from src.price_store import open_price_store
 
 pd.set_option('io.hdf.default_format','table')
 
@@ -39,8 +44,8 @@ def get_existing_symbols_in_db(h5_file_path) -> set:
         return set()
 
     try:
-        with pd.HDFStore(str(h5_file_path), 'r') as store:
-            existing_symbols = {key[1:] for key in store.keys()}
+        with open_price_store(str(h5_file_path), 'r') as store:
+            existing_symbols = store.symbols()
 
         return existing_symbols
 
@@ -60,21 +65,95 @@ def fetch_data_from_yahoo_finance(tickers: List[str]|Set[str],
         tickers_found = df.columns.get_level_values(level=1).unique().tolist()
         dfs = {}
         for ticker in tickers_found:
-            dfs[ticker] = df.xs(key=ticker, level=1, axis='columns')
+            # a batch shares one index, so drop the rows that belong only to the other tickers
+            dfs[ticker] = df.xs(key=ticker, level=1, axis='columns').dropna(how='all')
         return dfs
     else:
-        return df
+        return {next(iter(tickers)): df}
 
 
-def get_earlier_date(dic: Dict[str, str]) -> datetime:
-    if dic is None or len(dic) == 0:
-        return datetime.min
-    dates = [datetime.fromisoformat(str_date) for str_date in dic.values()]
-    return min(dates)
+FetchFunction = Callable[[List[str], datetime, datetime, Interval], Dict[str, pd.DataFrame]]
 
 
-def fetch_price_data(existing_symbols: set, all_stocks_symbols: set, hdf5_file_path: str, data_dir, 
-                    log_file, interval: Interval = '1D', hours_to_skip=24):
+@dataclass
+class FetchBatch:
+    symbols: List[str]
+    start_date: datetime
+    end_date: datetime
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter allowing at most `max_calls_per_second` calls to pass `wait()`.
+    """
+    def __init__(self, max_calls_per_second: float):
+        self.min_interval = 1.0 / max_calls_per_second if max_calls_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_call_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            sleep_time = self._next_call_time - now
+            self._next_call_time = max(now, self._next_call_time) + self.min_interval
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+
+def get_last_stored_bars(h5_file_path, symbols: Set[str]) -> Dict[str, datetime]:
+    """
+    Returns the timestamp of the last stored bar of every symbol found in the HDF5 file,
+    reading only the last row of each table.
+    """
+    last_bars = {}
+    if not Path(h5_file_path).exists():
+        return last_bars
+    with open_price_store(str(h5_file_path), 'r') as store:
+        for symbol in symbols:
+            last_bar = store.last_bar(symbol)
+            if last_bar is not None:
+                last_bars[symbol] = last_bar.to_pydatetime().replace(tzinfo=None)
+    return last_bars
+
+
+def plan_fetch_batches(symbol_start_dates: Dict[str, datetime], end_date: datetime,
+                       batch_size: int = 50, bucket: timedelta = timedelta(days=1)) -> List[FetchBatch]:
+    """
+    Groups symbols whose fetch windows start in the same `bucket` into batches of at most `batch_size`
+    symbols, so every symbol is only fetched from (about) its own last stored bar.
+    """
+    buckets: Dict[datetime, List[str]] = {}
+    for symbol, start_date in symbol_start_dates.items():
+        bucket_start = datetime.min + ((start_date - datetime.min) // bucket) * bucket
+        buckets.setdefault(bucket_start, []).append(symbol)
+
+    batches = []
+    for bucket_start in sorted(buckets):
+        symbols = sorted(buckets[bucket_start])
+        for i in range(0, len(symbols), batch_size):
+            batches.append(FetchBatch(symbols[i:i + batch_size], bucket_start, end_date))
+    return batches
+
+
+def fetch_batch_with_retry(fetch_fn: FetchFunction, batch: FetchBatch, interval: Interval,
+                           rate_limiter: RateLimiter, retries: int = 3,
+                           backoff_seconds: float = 2.0) -> Dict[str, pd.DataFrame]:
+    for attempt in range(retries + 1):
+        rate_limiter.wait()
+        try:
+            return fetch_fn(batch.symbols, batch.start_date, batch.end_date, interval)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff_seconds * 2 ** attempt
+            logging.warning(f"Fetching {len(batch.symbols)} symbols failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def fetch_price_data(existing_symbols: set, all_stocks_symbols: set, hdf5_file_path: str, data_dir,
+                    log_file, interval: Interval = '1D', hours_to_skip=24,
+                    fetch_fn: FetchFunction = fetch_data_from_yahoo_finance, batch_size: int = 50,
+                    max_workers: int = 4, max_requests_per_second: float = 2.0, retries: int = 3):
     match interval:
         case '5m': start_time = datetime.now() - timedelta(days=59)
         case '1d' | '1D': start_time = datetime.now() - timedelta(days=5 * 365)
@@ -85,28 +164,40 @@ def fetch_price_data(existing_symbols: set, all_stocks_symbols: set, hdf5_file_p
             symbol_time_dict = json.load(f)
     except FileNotFoundError:
         symbol_time_dict = {}
-    existing_symbols_start_time = max(start_time, get_earlier_date(symbol_time_dict))
 
     # Create the directory if it doesn't exist
     Path(data_dir).mkdir(parents=True, exist_ok=True)
 
-    new_symbols = all_stocks_symbols.difference(existing_symbols)
-    existing_symbols_dfs = fetch_data_from_yahoo_finance(existing_symbols, existing_symbols_start_time, datetime.now(), interval=interval)
-    new_symbols_dfs = fetch_data_from_yahoo_finance(new_symbols, start_time, datetime.now(), interval=interval)
+    # every symbol is fetched from its own last stored bar, new symbols from the full lookback
+    last_bars = get_last_stored_bars(hdf5_file_path, existing_symbols & all_stocks_symbols)
+    end_time = datetime.now()
+    symbol_start_dates = {symbol: max(start_time, last_bars.get(symbol, start_time))
+                          for symbol in all_stocks_symbols}
+    batches = plan_fetch_batches(symbol_start_dates, end_time, batch_size=batch_size)
+    logging.info(f"Fetching {len(symbol_start_dates)} symbols in {len(batches)} batches")
+
+    rate_limiter = RateLimiter(max_requests_per_second)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open_price_store(hdf5_file_path, mode='a') as store:
+        futures = {executor.submit(fetch_batch_with_retry, fetch_fn, batch, interval, rate_limiter, retries): batch
+                   for batch in batches}
+        # results are written from this thread only, as soon as each batch arrives
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                batch_dfs = future.result()
+            except Exception as e:
+                logging.error(f"Failed fetching batch starting {batch.start_date}: {e}")
+                continue
+            for symbol, data in batch_dfs.items():
+                store.append(symbol, data)
+            for symbol in batch.symbols:
+                symbol_time_dict[symbol] = datetime.now().isoformat()
 
     # Update log
-    for symbol in all_stocks_symbols:
-        symbol_time_dict[symbol] = datetime.now().isoformat()
     with open(log_file, 'w+') as f:
         json.dump(symbol_time_dict, f)
 
-    all_symbols_dfs = existing_symbols_dfs.copy()
-    all_symbols_dfs.update(new_symbols_dfs)
-
-    with pd.HDFStore(hdf5_file_path, mode='a') as store:
-        for symbol, data in all_symbols_dfs.items():
-            store.put(symbol, data, format='table', append=True, data_columns=True)
-
     logging.info("Finished updating HDF5 file.")
 
 
@@ -156,7 +247,7 @@ if __name__ == '__main__':
     interval: Interval = '5m'
     if interval == '5m':
         log_file_path = Config.five_m_last_updated_datetime_path
-        h5_filename = Config.five_m_file_path
+        h5_filename = Config.five_m_intraday_path
     elif interval == '1d':
         log_file_path = Config.eod_last_updated_datetime_path
         h5_filename = Config.eod_file_path
@@ -1,16 +1,163 @@
-import financedatabase as fd
+import argparse
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
 
+import numpy as np
+import pandas as pd
+import yaml
 
-def main():
-    # Load all equity data
-    equities = fd.Equities()
+from src.config import Config
+
+# columns of the financedatabase equities table kept in the snapshot (the long text columns are dropped)
+SNAPSHOT_COLUMNS = ('name', 'currency', 'sector', 'industry_group', 'industry', 'exchange', 'market', 'country',
+                    'market_cap', 'isin')
+# columns with an index, looked up without scanning the table
+INDEXED_COLUMNS = ('country', 'sector', 'market_cap', 'currency')
+
+Selection = Union[str, Iterable[str]]
+
+
+def snapshot_equities(snapshot_path: str = Config.equities_metadata_path,
+                      equities: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Saves the financedatabase equities table to a local parquet snapshot, with the repeated text columns
+    as categoricals, so queries no longer need financedatabase or its download.
+
+    Parameters:
+        snapshot_path (str): Path of the parquet file.
+        equities (DataFrame): Equities table indexed by symbol (defaults to `fd.Equities().select()`).
+
+    Returns:
+        DataFrame: The saved table.
+    """
+    if equities is None:
+        import financedatabase as fd
+        equities = fd.Equities().select()
+
+    columns = [column for column in SNAPSHOT_COLUMNS if column in equities.columns]
+    equities = equities.loc[equities.index.notna(), columns].copy()
+    equities.index = equities.index.astype(str)
+    equities.index.name = 'symbol'
+    for column in columns:
+        # a categorical stores each distinct value once, the rows only keep small integer codes
+        if column in INDEXED_COLUMNS or equities[column].nunique() < len(equities) // 2:
+            equities[column] = equities[column].astype('category')
+
+    Path(snapshot_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = snapshot_path + '.tmp'
+    equities.to_parquet(tmp_path, engine='pyarrow', compression='zstd')
+    os.replace(tmp_path, snapshot_path)
+    logging.info(f"Saved {len(equities)} equities to {snapshot_path}")
+    return equities
+
+
+class EquityMetadata:
+    """
+    Equities snapshot (see snapshot_equities) with an index on each of INDEXED_COLUMNS: the row positions of every
+    value are kept sorted, so a query intersects a few position arrays instead of comparing strings over the
+    whole table, and runs in about a millisecond.
+    """
 
-    # Filter for U.S. stocks with market capitalization over $2 billion
-    large_cap_stocks = equities.search(country='United States', market_cap='Large Cap', currency='USD')
+    def __init__(self, equities: pd.DataFrame):
+        self.equities = equities
+        self.indexes: Dict[str, Dict[str, np.ndarray]] = {}
+        for column in INDEXED_COLUMNS:
+            if column in equities.columns:
+                self.indexes[column] = self._build_index(equities[column])
+
+    @staticmethod
+    def _build_index(values: pd.Series) -> Dict[str, np.ndarray]:
+        values = values.astype('category')
+        codes = values.cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable')  # positions of each value stay in ascending order
+        bounds = np.searchsorted(codes[order], np.arange(len(values.cat.categories) + 1))
+        return {category: order[bounds[i]:bounds[i + 1]] for i, category in enumerate(values.cat.categories)}
+
+    @staticmethod
+    def load(snapshot_path: str = Config.equities_metadata_path) -> 'EquityMetadata':
+        """
+        Loads the snapshot at `snapshot_path`, taking it first when there is none yet.
+        """
+        if not os.path.exists(snapshot_path):
+            logging.info(f"No equities snapshot at {snapshot_path}, taking one")
+            return EquityMetadata(snapshot_equities(snapshot_path))
+        return EquityMetadata(pd.read_parquet(snapshot_path, engine='pyarrow'))
+
+    def _positions(self, column: str, selection: Selection) -> np.ndarray:
+        values = [selection] if isinstance(selection, str) else list(selection)
+        if column in self.indexes:
+            index = self.indexes[column]
+            positions = [index[value] for value in values if value in index]
+            return np.sort(np.concatenate(positions)) if len(positions) > 1 else (
+                positions[0] if positions else np.zeros(0, dtype=np.int64))
+        if column not in self.equities.columns:
+            raise ValueError(f"Unknown equities column: {column}")
+        return np.flatnonzero(self.equities[column].isin(values).to_numpy())
+
+    def select(self, **criteria: Selection) -> pd.DataFrame:
+        """
+        Returns the equities matching every criterion, e.g. `select(country='United States',
+        market_cap=['Large Cap', 'Mega Cap'], currency='USD')`. A criterion is a value or a list of accepted values
+        of a column; indexed columns are looked up, other columns are scanned over the rows left.
+        """
+        positions = None
+        # indexed criteria first, so scans only see the rows left
+        for column in sorted(criteria, key=lambda column: column not in self.indexes):
+            selection = criteria[column]
+            if selection is None:
+                continue
+            if positions is not None and column not in self.indexes:
+                values = [selection] if isinstance(selection, str) else list(selection)
+                positions = positions[np.isin(self.equities[column].to_numpy()[positions], values)]
+                continue
+            column_positions = self._positions(column, selection)
+            positions = column_positions if positions is None else np.intersect1d(positions, column_positions,
+                                                                                  assume_unique=True)
+        return self.equities if positions is None else self.equities.iloc[positions]
+
+    def symbols(self, **criteria: Selection) -> List[str]:
+        """
+        Returns the symbols of the equities matching the criteria (see select), sorted.
+        """
+        return sorted(self.select(**criteria).index)
+
+
+def write_tickers_list(symbols: Sequence[str], tickers_path: str = Config.tickers_filepath):
+    """
+    Writes the symbols as the tickers list the fetch pipeline and the chart read (see Config.get_tickers_list).
+    """
+    tmp_path = tickers_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        # quoted where YAML would read them as something else (ON, YES, TRUE are booleans)
+        yaml.safe_dump({'tickers': list(symbols)}, f, default_flow_style=False, sort_keys=False)
+    os.replace(tmp_path, tickers_path)
+    logging.info(f"Wrote {len(symbols)} tickers to {tickers_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the local equities metadata snapshot")
+    parser.add_argument('--snapshot', action='store_true', help="take a fresh snapshot from financedatabase first")
+    parser.add_argument('--country', nargs='*', default=['United States'])
+    parser.add_argument('--sector', nargs='*')
+    parser.add_argument('--market-cap', nargs='*', default=['Large Cap'])
+    parser.add_argument('--currency', nargs='*', default=['USD'])
+    parser.add_argument('--write-tickers', action='store_true', help=f"write the result to {Config.tickers_filepath}")
+    args = parser.parse_args()
 
-    # Display the first few entries
-    print(large_cap_stocks.head())
+    if args.snapshot:
+        metadata = EquityMetadata(snapshot_equities())
+    else:
+        metadata = EquityMetadata.load()
+    stocks = metadata.select(country=args.country, sector=args.sector, market_cap=args.market_cap,
+                             currency=args.currency)
+    print(f"{len(stocks)} equities")
+    print(stocks.head())
+    if args.write_tickers:
+        write_tickers_list(sorted(stocks.index))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.indicators import INDICATORS, IndicatorLookup, price_arrays
+
+# (symbol, indicator, params): one result per key, windows of the bars are served from it
+CacheKey = Tuple[str, str, Tuple[Tuple[str, object], ...]]
+
+
+@dataclass
+class CachedIndicator:
+    version: int  # data version of the symbol in the store catalog (-1 when unknown)
+    bar_times: np.ndarray  # int64 bar times the values are aligned with
+    row_digests: np.ndarray  # uint64 hash of the indicator's input prices on every bar
+    values: np.ndarray
+
+
+def _row_digests(inputs) -> np.ndarray:
+    # one hash per bar rather than one per result, so any range of the cached bars can be checked
+    digests = np.zeros(len(inputs[0]), dtype=np.uint64)
+    for values in inputs:
+        digests ^= np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+        digests *= np.uint64(0x9E3779B97F4A7C15)
+    return digests
+
+
+def _file_name(text: str) -> str:
+    return re.sub(r'[^\w.=,-]', '_', text)
+
+
+class IndicatorCache:
+    """
+    Indicator results of a price store keyed by (symbol, indicator, params), kept in an in-process LRU and in one
+    npz file per key next to the store (`<store path>.indicators/<SYMBOL>/<indicator>-<params>.npz`).
+
+    Requested bars are located inside the cached ones, so a window of the cached bars (a chart window, a
+    backtest period) is served from the same result, and bars appended after the cached ones only compute the
+    new tail (see indicators.Indicator.compute_tail). A window starting after the cached bars gets the NaN warm-up
+    head a computation over its bars has; history-dependent indicators (no `warmup`, e.g. atr) are recomputed over
+    such a window. The cached result is replaced when the requested bars can't be served from it.
+
+    Cached bars are trusted as long as the symbol's catalog version, which changes on every append, is the one they
+    were computed at, and otherwise only where the prices of the bars are unchanged.
+    """
+
+    def __init__(self, store, cache_dir: Optional[str] = None, max_entries: int = 256, persist: bool = True):
+        self.store = store
+        self.cache_dir = Path(cache_dir or store.indicator_cache_dir)
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries: 'OrderedDict[CacheKey, CachedIndicator]' = OrderedDict()
+
+    def _version(self, symbol: str) -> int:
+        catalog = self.store.catalog
+        return catalog.version(symbol) if catalog is not None and symbol in catalog.entries else -1
+
+    def _path(self, key: CacheKey) -> Path:
+        symbol, name, params = key
+        params_text = ','.join(f'{param}={value}' for param, value in params)
+        return self.cache_dir / _file_name(symbol) / _file_name(f'{name}-{params_text}.npz')
+
+    def _load(self, key: CacheKey) -> Optional[CachedIndicator]:
+        if not self.persist:
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                return CachedIndicator(int(data['version']), data['bar_times'], data['row_digests'],
+                                       data['values'])
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+    def _save(self, key: CacheKey, entry: CachedIndicator):
+        if not self.persist:
+            return
+        cache_path = self._path(key)
+        tmp_path = cache_path.with_suffix('.tmp')
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, version=entry.version, bar_times=entry.bar_times, row_digests=entry.row_digests,
+                         values=entry.values)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.warning(f"Could not write indicator cache {cache_path}: {e}")
+
+    def _remember(self, key: CacheKey, entry: CachedIndicator):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, symbol: str, name: str, prices: Dict[str, np.ndarray], index: pd.Index, **params) -> np.ndarray:
+        """
+        Returns a registered indicator (see indicators.INDICATORS) of the symbol's bars.
+
+        Parameters:
+            symbol (str): Symbol the bars were read from.
+            name (str): Indicator name.
+            prices (dict): high/low/close arrays of the bars (see price_arrays).
+            index (Index): Bar times of the arrays.
+            **params: Indicator parameters.
+
+        Returns:
+            ndarray: The indicator, aligned with the bars. Treat it as read-only, it is shared by the cache.
+        """
+        indicator = INDICATORS[name]
+        version = self._version(symbol)
+        bar_times = np.asarray(index.asi8 if isinstance(index, pd.DatetimeIndex) else index, dtype=np.int64)
+        inputs = [prices[input_name] for input_name in indicator.inputs]
+        key = (symbol, name, tuple(sorted(params.items())))
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+        overlap = self._overlap(entry, version, bar_times, inputs)
+        if overlap is None:
+            values = indicator.compute(prices, **params)
+            values.setflags(write=False)
+            entry = CachedIndicator(version, bar_times, _row_digests(inputs), values)
+            self._remember(key, entry)
+            self._save(key, entry)
+            return values
+
+        start, rows = overlap
+        if start > 0 and indicator.warmup is None:
+            # depends on the whole history: the cached values don't start over at the window
+            values = indicator.compute(prices, **params)
+            values.setflags(write=False)
+            return values
+        cached = entry.values[start:start + rows]
+        if start > 0:
+            cached = cached.copy()
+            cached[:indicator.warmup(**params)] = np.nan
+            cached.setflags(write=False)
+        self._remember(key, entry)
+        if rows == len(bar_times):
+            return cached
+
+        values = indicator.compute_tail(cached, prices, **params)
+        values.setflags(write=False)
+        tail_values = values[rows:]
+        entry = CachedIndicator(version, np.concatenate([entry.bar_times, bar_times[rows:]]),
+                                np.concatenate([entry.row_digests, _row_digests([a[rows:] for a in inputs])]),
+                                np.concatenate([entry.values, tail_values]))
+        entry.values.setflags(write=False)
+        self._remember(key, entry)
+        self._save(key, entry)
+        return values
+
+    @staticmethod
+    def _overlap(entry: Optional[CachedIndicator], version: int, bar_times: np.ndarray,
+                 inputs) -> Optional[Tuple[int, int]]:
+        """
+        Locates the requested bars inside the cached ones: returns (position of the first requested bar in the
+        cached bars, number of leading requested bars that are cached with the same prices), or None when the
+        requested bars don't start inside the cached ones or continue after a gap in them.
+        """
+        if entry is None or len(bar_times) == 0:
+            return None
+        start, end = np.searchsorted(entry.bar_times, [bar_times[0], bar_times[-1]], side='right')
+        start -= 1
+        rows = end - start
+        if (start < 0 or (end < len(entry.bar_times) and rows < len(bar_times))
+                or not np.array_equal(entry.bar_times[start:end], bar_times[:rows])):
+            return None
+        if version == -1 or entry.version != version:
+            if not np.array_equal(entry.row_digests[start:end], _row_digests([a[:rows] for a in inputs])):
+                return None
+        return int(start), int(rows)
+
+    def for_symbol(self, symbol: str, df: pd.DataFrame) -> IndicatorLookup:
+        """
+        Returns an indicator lookup `(name, **params) -> values` over the symbol's bars in the dataframe,
+        to pass to the strategies and chart drawing.
+        """
+        return partial(self.get, symbol, prices=price_arrays(df), index=df.index)
+
+    def clear(self, symbol: Optional[str] = None):
+        """
+        Drops the in-process entries (of one symbol, or all); files on disk are revalidated on the next read.
+        """
+        for key in [key for key in self._entries if symbol is None or key[0] == symbol]:
+            del self._entries[key]
@@ -0,0 +1,145 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from numba import njit
+
+# looks up an indicator over the bars it was bound to: (name, **params) -> values
+IndicatorLookup = Callable[..., np.ndarray]
+
+
+def price_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Returns the high/low/close columns of an OHLCV frame (any column case) as float arrays,
+    the inputs every strategy function takes.
+    """
+    columns = {column.lower(): column for column in df.columns}
+    return {name: df[columns[name]].to_numpy(dtype=np.float64) for name in ('high', 'low', 'close')}
+
+
+def sma(close: np.ndarray, window: int = 20) -> np.ndarray:
+    """
+    Simple moving average (NaN until `window` bars are available), same as vbt.MA.
+    Like the other indicators, takes 1-D arrays or (bars x symbols) arrays with one column per symbol.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    return vbt.MA.run(close, window=window).ma.to_numpy().reshape(close.shape)
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = 14) -> np.ndarray:
+    """
+    Average true range, same as vbt.ATR (exponential average of the true range, adjust=False).
+    """
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    return vbt.ATR.run(high=high, low=low, close=close, window=window).atr.to_numpy().reshape(close.shape)
+
+
+def cci(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = 14, c: float = 0.015) -> np.ndarray:
+    """
+    Commodity Channel Index, same definition as pandas_ta.cci: (tp - sma(tp)) / (c * mad(tp)) on the typical price.
+    """
+    typical_price = (np.asarray(high, dtype=np.float64) + np.asarray(low, dtype=np.float64)
+                     + np.asarray(close, dtype=np.float64)) / 3.0
+    out = np.full(typical_price.shape, np.nan)
+    if len(typical_price) < window:
+        return out
+    # one row per symbol, so each window is contiguous and reduces the same way for 1-D and 2-D inputs
+    rows = typical_price.reshape(len(typical_price), -1).T
+    out_rows = out.reshape(len(out), -1).T
+    for start in range(0, len(rows), 256):  # symbol blocks bound the (symbols x bars x window) deviations
+        block = np.ascontiguousarray(rows[start:start + 256])
+        windows = np.lib.stride_tricks.sliding_window_view(block, window, axis=1)
+        mean = windows.mean(axis=2)
+        mean_abs_deviation = np.abs(windows - mean[..., None]).mean(axis=2)
+        out_rows[start:start + 256, window - 1:] = (block[:, window - 1:] - mean) / (c * mean_abs_deviation)
+    return out
+
+
+@njit(cache=True)
+def _ewm_mean_extend_nb(a: np.ndarray, weighted_avg: float, span: int) -> np.ndarray:
+    # continues vbt's ewm_mean_1d_nb (adjust=False) from the last average, the previous value being an observation
+    com = (span - 1) / 2.0
+    alpha = 1.0 / (1.0 + com)
+    old_wt_factor = 1.0 - alpha
+    out = np.empty(len(a), dtype=np.float64)
+    old_wt = 1.0
+    for i in range(len(a)):
+        cur = a[i]
+        old_wt *= old_wt_factor
+        if cur == cur:
+            if weighted_avg != cur:
+                weighted_avg = ((old_wt * weighted_avg) + (alpha * cur)) / (old_wt + alpha)
+            old_wt = 1.0
+        out[i] = weighted_avg
+    return out
+
+
+def _atr_extend(cached: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                window: int = 14) -> Optional[np.ndarray]:
+    start = len(cached)
+    if start < 2 or np.isnan(cached[-1]) or not np.isfinite(high[start - 1] - low[start - 1]):
+        return None
+    high, low, prev_close = high[start:], low[start:], close[start - 1:-1]
+    true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+    return _ewm_mean_extend_nb(true_range, cached[-1], window)
+
+
+@dataclass(frozen=True)
+class Indicator:
+    """
+    An indicator function together with what is needed to recompute only the tail of a cached result.
+
+    Attributes:
+        fn: Computes the indicator over full input arrays.
+        inputs: Names of the price arrays `fn` takes (high, low, close).
+        warmup: Number of bars before the tail needed to recompute it (rolling windows), or None
+            when the result depends on the whole history.
+        extend: For history-dependent indicators, continues the cached values over the new bars
+            (returns None when it cannot, and the indicator is recomputed in full).
+    """
+    fn: Callable[..., np.ndarray]
+    inputs: Tuple[str, ...]
+    warmup: Optional[Callable[..., int]] = None
+    extend: Optional[Callable[..., Optional[np.ndarray]]] = None
+
+    def compute(self, prices: Dict[str, np.ndarray], **params) -> np.ndarray:
+        return self.fn(*(prices[name] for name in self.inputs), **params)
+
+    def compute_tail(self, cached: np.ndarray, prices: Dict[str, np.ndarray], **params) -> np.ndarray:
+        """
+        Returns the indicator over the full inputs given its values over the first `len(cached)` bars,
+        only computing the new bars when possible.
+        """
+        start = len(cached)
+        inputs = [prices[name] for name in self.inputs]
+        if self.extend is not None:
+            tail = self.extend(cached, *inputs, **params)
+        elif self.warmup is not None:
+            offset = max(0, start - self.warmup(**params))
+            tail = self.fn(*(a[offset:] for a in inputs), **params)[start - offset:]
+        else:
+            tail = None
+        if tail is None:
+            return self.fn(*inputs, **params)
+        return np.concatenate([cached, tail])
+
+
+# indicators shared by the chart, the strategies and the indicator cache
+INDICATORS: Dict[str, Indicator] = {
+    'sma': Indicator(sma, ('close',), warmup=lambda window=20: window - 1),
+    'atr': Indicator(atr, ('high', 'low', 'close'), extend=_atr_extend),
+    'cci': Indicator(cci, ('high', 'low', 'close'), warmup=lambda window=14, c=0.015: window - 1),
+}
+
+
+def compute_indicator(name: str, prices: Dict[str, np.ndarray], indicators: Optional[IndicatorLookup] = None,
+                      **params) -> np.ndarray:
+    """
+    Computes a registered indicator over full price arrays, or looks it up through `indicators`
+    (e.g. IndicatorCache.for_symbol) when given, which must be bound to the same bars.
+    """
+    if indicators is not None:
+        return indicators(name, **params)
+    return INDICATORS[name].compute(prices, **params)
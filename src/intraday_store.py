@@ -0,0 +1,201 @@
+import argparse
+import logging
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from src.catalog import find_column
+from src.price_store import ArrowPriceStore, Partition, PriceStore, StoreMode, open_price_store
+
+BASE_TIMEFRAME = '5m'
+
+
+@dataclass(frozen=True)
+class Timeframe:
+    rule: str  # pandas resample rule
+    partition: Partition  # partition of the timeframe's Arrow store
+    offset: Optional[str] = None  # shifts the buckets from midnight, e.g. '30min' for hours starting at :30
+
+
+# timeframes derived from the 5m bars by default
+TIMEFRAMES: Dict[str, Timeframe] = {
+    '15m': Timeframe('15min', 'month'),
+    '1h': Timeframe('1h', 'year'),
+    '1d': Timeframe('1D', 'year'),
+}
+
+
+def bucket_start(time, timeframe: Timeframe):
+    """
+    Returns the start of the timeframe bucket a bar time (or each time of an index) falls in, in local time
+    for tz-aware times.
+    """
+    if timeframe.offset is None:
+        return time.floor(timeframe.rule)
+    offset = pd.Timedelta(timeframe.offset)
+    return (time - offset).floor(timeframe.rule) + offset
+
+
+def resample_bars(bars: pd.DataFrame, timeframe: Timeframe) -> pd.DataFrame:
+    """
+    Aggregates sorted OHLCV bars (any column case) into the timeframe's buckets, labeled by their start: first open,
+    highest high, lowest low, last close and summed volume; other columns take the bucket's last value.
+    Bars without a close (empty bars of the source) are skipped and buckets without bars are left out.
+
+    The bars are aggregated positionally with numpy (a bucket is a run of consecutive bars), which is what keeps
+    re-aggregating the last bucket on every append cheap.
+    """
+    close_column = find_column(bars, 'close')
+    if close_column is not None:
+        bars = bars[bars[close_column].notna()]
+    labels = bucket_start(bars.index, timeframe)
+    label_values = labels.asi8
+    starts = np.flatnonzero(np.r_[True, label_values[1:] != label_values[:-1]]) if len(bars) else np.zeros(0, int)
+    ends = np.r_[starts[1:], len(bars)] - 1
+    columns = {}
+    for column in bars.columns:
+        values = bars[column].to_numpy()
+        name = column.lower()
+        if not len(bars):
+            columns[column] = values
+        elif name == 'open':
+            columns[column] = values[starts]
+        elif name == 'high':
+            columns[column] = np.fmax.reduceat(values, starts)
+        elif name == 'low':
+            columns[column] = np.fmin.reduceat(values, starts)
+        elif name == 'volume':
+            columns[column] = np.add.reduceat(np.nan_to_num(values), starts)
+        else:
+            columns[column] = values[ends]
+    return pd.DataFrame(columns, index=labels[starts])
+
+
+class IntradayStore(PriceStore):
+    """
+    Intraday price store: the 5m bars in an Arrow store partitioned by symbol and day
+    (`<root>/5m/<SYMBOL>/<DAY>.arrow`), with every timeframe of `timeframes` kept as an Arrow store
+    of resampled bars next to it (`<root>/15m`, ...).
+
+    Appending 5m bars only re-aggregates the buckets they touch: each timeframe re-reads the 5m bars from the start
+    of its last stored bucket (the only one that can still be partial) and replaces its tail with the resampled
+    bars. Reading, charting or backtesting a coarser timeframe then reads its own store (`timeframe(name)`, or
+    open_price_store('<root>/1h') directly) without touching the 5m history.
+
+    Reads, the catalog and the indicator cache of this store are those of the 5m bars.
+    """
+
+    def __init__(self, root: str, mode: StoreMode = 'a', timeframes: Optional[Dict[str, Timeframe]] = None):
+        """
+        Parameters:
+            root (str): Root directory of the store (opened by open_price_store when it ends with `.intraday`).
+            mode (str): 'r', 'a' or 'w'.
+            timeframes (dict): Derived timeframes by name (defaults to TIMEFRAMES).
+        """
+        super().__init__(root, mode)
+        self.root = Path(root)
+        if mode == 'w' and self.root.exists():
+            shutil.rmtree(self.root)
+        self.timeframes = TIMEFRAMES if timeframes is None else timeframes
+        self.base = ArrowPriceStore(str(self.root / BASE_TIMEFRAME), mode, partition='day')
+        self.stores: Dict[str, ArrowPriceStore] = {
+            name: ArrowPriceStore(str(self.root / name), mode, partition=timeframe.partition)
+            for name, timeframe in self.timeframes.items()
+        }
+        self.catalog = self.base.catalog
+
+    def timeframe(self, name: str) -> PriceStore:
+        """
+        Returns the store of a timeframe ('5m' or one of `timeframes`), to read, chart or backtest it.
+        """
+        if name == BASE_TIMEFRAME:
+            return self.base
+        if name not in self.stores:
+            raise ValueError(f"Unknown timeframe: {name}")
+        return self.stores[name]
+
+    def _list_symbols(self) -> Set[str]:
+        return self.base._list_symbols()
+
+    def read(self, symbol: str, start=None, end=None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self.base.read(symbol, start, end, columns)
+
+    def last_bar(self, symbol: str) -> Optional[pd.Timestamp]:
+        return self.base.last_bar(symbol)
+
+    def _append(self, symbol: str, data: pd.DataFrame) -> pd.DataFrame:
+        appended = self.base._append(symbol, data)
+        if len(appended):
+            self._resample(symbol, appended.index[0])
+        return appended
+
+    def _replace_tail(self, symbol: str, data: pd.DataFrame) -> int:
+        removed = self.base._replace_tail(symbol, data)
+        self._resample(symbol, data.index[0])
+        return removed
+
+    def _resample(self, symbol: str, first_changed: pd.Timestamp):
+        # the 5m bars from `first_changed` on were written: rewrite every timeframe from the bucket they start in
+        # (or from its last stored bucket when it lags behind, e.g. after an interrupted update)
+        starts = {}
+        for name, timeframe in self.timeframes.items():
+            start = bucket_start(first_changed, timeframe)
+            last_bucket = self.stores[name].last_bar(symbol)
+            starts[name] = min(start, last_bucket) if last_bucket is not None else None
+        read_start = None if None in starts.values() else min(starts.values())
+        bars = self.base.read(symbol, start=read_start)
+        for name, timeframe in self.timeframes.items():
+            start = starts[name]
+            timeframe_bars = bars if start is None else bars[bars.index >= start]
+            self.stores[name].replace_tail(symbol, resample_bars(timeframe_bars, timeframe))
+
+    def rebuild(self, symbols: Optional[List[str]] = None):
+        """
+        Recomputes the timeframes of the symbols (default: all) from their full 5m history.
+        """
+        for symbol in tqdm(sorted(symbols or self.symbols()), desc="Resampling intraday bars"):
+            bars = self.base.read(symbol)
+            for name, timeframe in self.timeframes.items():
+                self.stores[name].replace_tail(symbol, resample_bars(bars, timeframe))
+
+    def close(self):
+        super().close()
+        for store in [self.base] + list(self.stores.values()):
+            store.close()
+
+
+def import_bars(source_path: str, root: str):
+    """
+    Copies every symbol of a 5m price store (e.g. the HDF5 `five_m_file_path`) into an intraday store.
+    """
+    with open_price_store(source_path, mode='r') as source, IntradayStore(root, mode='a') as intraday:
+        for symbol in tqdm(sorted(source.symbols()), desc=f"Importing {source_path}"):
+            intraday.append(symbol, source.read(symbol))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intraday store maintenance")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="copy the 5m bars of another price store")
+    import_parser.add_argument('source_path')
+    import_parser.add_argument('root')
+    rebuild_parser = subparsers.add_parser('rebuild', help="recompute the timeframes from the 5m bars")
+    rebuild_parser.add_argument('root')
+    rebuild_parser.add_argument('--symbols', nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        import_bars(args.source_path, args.root)
+    elif args.command == 'rebuild':
+        with IntradayStore(args.root, mode='a') as store:
+            store.rebuild(args.symbols)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
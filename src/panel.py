@@ -0,0 +1,298 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from src.catalog import find_column
+from src.price_store import PriceStore, open_price_store
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class Panel:
+    """
+    Aligned (dates x symbols) arrays of a price store, one memory-mapped file per field on a shared calendar
+    (the union of all the symbols' bar times). A symbol without a bar at a date has NaN there.
+    Opening a panel only maps the files, so a 5,000-symbol close matrix is available in milliseconds.
+    """
+
+    def __init__(self, panel_dir: str, meta: dict):
+        self.panel_dir = Path(panel_dir)
+        self.meta = meta
+        self.symbols: List[str] = meta['symbols']
+        self.fields: List[str] = meta['fields']
+        self.dtype = np.dtype(meta['dtype'])
+        rows = meta['rows']
+        self.dates = pd.DatetimeIndex(np.memmap(self.panel_dir / 'dates.bin', dtype=np.int64, mode='r', shape=(rows,))
+                                      if rows else np.zeros(0, dtype=np.int64), name=meta.get('index_name'))
+        if meta.get('tz'):
+            # bar times are stored as UTC nanoseconds
+            self.dates = self.dates.tz_localize('UTC').tz_convert(meta['tz'])
+        self._columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    @property
+    def shape(self):
+        return len(self.dates), len(self.symbols)
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        Returns the read-only memory-mapped (dates x symbols) array of a field.
+        """
+        if name not in self._arrays:
+            if name not in self.fields:
+                raise KeyError(f"No field named {name} in the panel")
+            if not len(self.dates):
+                self._arrays[name] = np.zeros(self.shape, dtype=self.dtype)
+            else:
+                self._arrays[name] = np.memmap(self.panel_dir / f'{name}.bin', dtype=self.dtype, mode='r',
+                                               shape=self.shape)
+        return self._arrays[name]
+
+    def frame(self, name: str, symbols: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Returns a field as a (dates x symbols) dataframe; without `symbols` the frame wraps the mapped array.
+        """
+        values = self.field(name)
+        if symbols is None:
+            return pd.DataFrame(values, index=self.dates, columns=self.symbols, copy=False)
+        return pd.DataFrame(values[:, self.columns(symbols)], index=self.dates, columns=list(symbols))
+
+    def columns(self, symbols: Sequence[str]) -> np.ndarray:
+        return np.array([self._columns[symbol] for symbol in symbols], dtype=np.int64)
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        return self.frame(name)
+
+
+def _panel_dir(store: PriceStore, panel_dir: Optional[str]) -> Path:
+    return Path(panel_dir or store.panel_dir)
+
+
+def _load_meta(panel_dir: Path) -> Optional[dict]:
+    try:
+        with open(panel_dir / 'meta.json', 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_meta(panel_dir: Path, meta: dict):
+    tmp_path = panel_dir / 'meta.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, panel_dir / 'meta.json')
+
+
+def open_panel(store_path: str, panel_dir: Optional[str] = None) -> Panel:
+    """
+    Opens the panel built for the store at `store_path` (only the files are mapped, nothing is read).
+    """
+    panel_dir = Path(panel_dir or str(store_path).rstrip('/\\') + '.panel')
+    meta = _load_meta(panel_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No panel in {panel_dir}, build it with build_panel")
+    return Panel(str(panel_dir), meta)
+
+
+def _field_values(df: pd.DataFrame, fields: Sequence[str]) -> Dict[str, np.ndarray]:
+    values = {}
+    for name in fields:
+        column = find_column(df, name)
+        values[name] = df[column].to_numpy(dtype=np.float64) if column else np.full(len(df), np.nan)
+    return values
+
+
+def build_panel(store: PriceStore, symbols: Optional[Sequence[str]] = None, panel_dir: Optional[str] = None,
+                fields: Sequence[str] = FIELDS, dtype='float64', group_size: int = 256) -> Panel:
+    """
+    Builds the panel of the store from scratch.
+
+    The calendar is collected first from the bar times of every symbol; the fields are then written in groups of
+    `group_size` symbols, so each row of a group is one contiguous write and memory stays bounded by
+    (dates x group_size) per field.
+
+    Parameters:
+        store (PriceStore): Open price store.
+        symbols (Sequence[str]): Symbols of the panel (defaults to every symbol of the store, and later
+            refreshes then also pick up new symbols).
+        panel_dir (str): Directory of the panel files (defaults to `<store path>.panel`).
+        fields (Sequence[str]): Fields to build, matched case-insensitively to the store columns.
+        dtype: Element type of the arrays.
+        group_size (int): Number of symbols read and written at a time.
+
+    Returns:
+        Panel: The built panel.
+    """
+    panel_dir = _panel_dir(store, panel_dir)
+    catalog = store.catalog or store.rebuild_catalog()
+    universe = symbols is None
+    existing_symbols = store.symbols()
+    symbols = sorted(existing_symbols) if universe else [symbol for symbol in symbols if symbol in existing_symbols]
+    dtype = np.dtype(dtype)
+
+    if panel_dir.exists():
+        shutil.rmtree(panel_dir)
+    panel_dir.mkdir(parents=True)
+
+    index_name = tz = None
+    calendar = np.zeros(0, dtype=np.int64)
+    last_bars = {}
+    for symbol in tqdm(symbols, desc="Collecting panel calendar"):
+        index = store.read(symbol, columns=[]).index
+        index_name = index_name or index.name
+        tz = tz or getattr(index, 'tz', None)
+        calendar = np.union1d(calendar, index.asi8)
+        last_bars[symbol] = int(index.asi8[-1]) if len(index) else None
+    calendar.tofile(panel_dir / 'dates.bin')
+
+    shape = (len(calendar), len(symbols))
+    arrays = {name: np.memmap(panel_dir / f'{name}.bin', dtype=dtype, mode='w+', shape=shape)
+              for name in fields} if len(calendar) else {}
+    for group_start in tqdm(range(0, len(symbols) if len(calendar) else 0, group_size), desc="Writing panel"):
+        group = symbols[group_start:group_start + group_size]
+        blocks = {name: np.full((len(calendar), len(group)), np.nan, dtype=dtype) for name in fields}
+        for column, symbol in enumerate(group):
+            df = store.read(symbol)
+            rows = np.searchsorted(calendar, df.index.asi8)
+            for name, values in _field_values(df, fields).items():
+                blocks[name][rows, column] = values
+        for name in fields:
+            arrays[name][:, group_start:group_start + len(group)] = blocks[name]
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    meta = {
+        'symbols': symbols,
+        'universe': universe,
+        'fields': list(fields),
+        'dtype': dtype.str,
+        'rows': len(calendar),
+        'index_name': index_name,
+        'tz': str(tz) if tz is not None else None,
+        'versions': {symbol: catalog.version(symbol) for symbol in symbols},
+        'symbol_rows': {symbol: catalog.get(symbol).rows for symbol in symbols},
+        'last_bars': last_bars,
+    }
+    _save_meta(panel_dir, meta)
+    logging.info(f"Built panel {panel_dir}: {shape[0]} dates x {shape[1]} symbols")
+    return Panel(str(panel_dir), meta)
+
+
+def refresh_panel(store: PriceStore, panel_dir: Optional[str] = None, **build_kwargs) -> Panel:
+    """
+    Brings the panel up to date with the store, only writing what was appended since it was built: new dates are
+    appended as rows at the end of every field file, and bars of lagging symbols at dates already on the calendar
+    are written in place. Symbols whose catalog version did not change are not read.
+    The panel is rebuilt instead when it can't be extended (new or removed symbols in a universe panel,
+    history rewritten by a compaction, bars at dates missing from the calendar).
+
+    Returns:
+        Panel: The refreshed panel.
+    """
+    panel_dir = _panel_dir(store, panel_dir)
+    meta = _load_meta(panel_dir)
+    catalog = store.catalog or store.rebuild_catalog()
+    if meta is None:
+        return build_panel(store, panel_dir=str(panel_dir), **build_kwargs)
+    symbols, fields, dtype = meta['symbols'], meta['fields'], np.dtype(meta['dtype'])
+    rebuild_kwargs = dict(panel_dir=str(panel_dir), fields=fields, dtype=dtype,
+                          symbols=None if meta['universe'] else symbols)
+    existing_symbols = store.symbols()
+    if (meta['universe'] and set(symbols) != existing_symbols) or not existing_symbols.issuperset(symbols):
+        logging.info(f"Symbols of {panel_dir} changed, rebuilding")
+        return build_panel(store, **rebuild_kwargs)
+
+    # bars appended to each changed symbol since the panel was built, from its last bar on
+    # (rewritten in place: resampled stores replace their last, partial bar, see PriceStore.replace_tail)
+    appended: Dict[str, pd.DataFrame] = {}
+    for symbol in symbols:
+        entry = catalog.get(symbol)
+        if entry.version == meta['versions'][symbol]:
+            continue
+        last_bar = meta['last_bars'][symbol]
+        # bar times are stored as UTC nanoseconds
+        start = pd.Timestamp(last_bar, tz='UTC' if meta.get('tz') else None) if last_bar is not None else None
+        df = store.read(symbol, start=start)
+        if last_bar is not None:
+            df = df[df.index.asi8 >= last_bar]
+        new_rows = len(df) - int(last_bar is not None and len(df) > 0 and df.index.asi8[0] == last_bar)
+        if entry.rows - meta['symbol_rows'][symbol] != new_rows:
+            logging.info(f"History of {symbol} was rewritten, rebuilding {panel_dir}")
+            return build_panel(store, **rebuild_kwargs)
+        appended[symbol] = df
+
+    rows = meta['rows']
+    calendar = np.fromfile(panel_dir / 'dates.bin', dtype=np.int64, count=rows)
+    panel_end = calendar[-1] if rows else np.iinfo(np.int64).min
+    bar_times = [df.index.asi8 for df in appended.values()]
+    new_dates = np.unique(np.concatenate(bar_times)) if bar_times else np.zeros(0, dtype=np.int64)
+    late_dates = new_dates[new_dates <= panel_end]
+    new_dates = new_dates[new_dates > panel_end]
+    if not np.isin(late_dates, calendar).all():
+        logging.info(f"Bars before the end of {panel_dir} at new dates, rebuilding")
+        return build_panel(store, **rebuild_kwargs)
+
+    columns = {symbol: i for i, symbol in enumerate(symbols)}
+    row_bytes = len(symbols) * dtype.itemsize
+    for name in fields:
+        field_path = panel_dir / f'{name}.bin'
+        # drop rows left by an interrupted refresh (the meta is only saved once all fields are written)
+        if field_path.exists():
+            os.truncate(field_path, rows * row_bytes)
+        block = np.full((len(new_dates), len(symbols)), np.nan, dtype=dtype)
+        existing = np.memmap(field_path, dtype=dtype, mode='r+', shape=(rows, len(symbols))) if rows else None
+        for symbol, df in appended.items():
+            values = _field_values(df, [name])[name]
+            times = df.index.asi8
+            is_new = times > panel_end
+            block[np.searchsorted(new_dates, times[is_new]), columns[symbol]] = values[is_new]
+            if not is_new.all():
+                existing[np.searchsorted(calendar, times[~is_new]), columns[symbol]] = values[~is_new]
+        if existing is not None:
+            existing.flush()
+            del existing
+        with open(field_path, 'ab') as f:
+            f.write(block.tobytes())
+    os.truncate(panel_dir / 'dates.bin', rows * 8)
+    with open(panel_dir / 'dates.bin', 'ab') as f:
+        f.write(new_dates.tobytes())
+
+    meta['rows'] = rows + len(new_dates)
+    for symbol, df in appended.items():
+        meta['versions'][symbol] = catalog.version(symbol)
+        meta['symbol_rows'][symbol] = catalog.get(symbol).rows
+        if len(df):
+            meta['last_bars'][symbol] = int(df.index.asi8[-1])
+    _save_meta(panel_dir, meta)
+    logging.info(f"Refreshed panel {panel_dir}: {len(appended)} symbols updated, {len(new_dates)} dates appended")
+    return Panel(str(panel_dir), meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the (dates x symbols) panel of a price store")
+    parser.add_argument('command', choices=['build', 'refresh'])
+    parser.add_argument('store_path')
+    parser.add_argument('--symbols', nargs='*', help="symbols of the panel (default: every symbol of the store)")
+    parser.add_argument('--dtype', default='float64')
+    args = parser.parse_args()
+
+    with open_price_store(args.store_path, mode='r') as store:
+        if args.command == 'build':
+            panel = build_panel(store, symbols=args.symbols, dtype=args.dtype)
+        else:
+            panel = refresh_panel(store, symbols=args.symbols, dtype=args.dtype)
+    print(f"{panel.shape[0]} dates x {panel.shape[1]} symbols")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
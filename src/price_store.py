@@ -0,0 +1,488 @@
+import argparse
+import logging
+import os
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, List, Literal, Optional, Set
+
+import numpy as np
+import pandas as pd
+from pandas import HDFStore
+from tqdm import tqdm
+
+from src.catalog import SymbolCatalog
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+StoreMode = Literal['r', 'a', 'w']
+Partition = Literal['year', 'month', 'day']
+
+# file name formats of the Arrow store partitions, by partition
+PARTITION_FORMATS = {'year': '%Y', 'month': '%Y-%m', 'day': '%Y-%m-%d'}
+
+
+def _key(symbol: str) -> str:
+    return symbol if symbol.startswith('/') else f'/{symbol}'
+
+
+def last_stored_bar(store: HDFStore, symbol: str) -> Optional[pd.Timestamp]:
+    """
+    Returns the index of the last bar stored for the symbol, reading a single value of the index column.
+
+    Parameters:
+        store (HDFStore): Open store.
+        symbol (str): Symbol key.
+
+    Returns:
+        Timestamp: The last stored bar, or None if the symbol has no table yet.
+    """
+    key = _key(symbol)
+    if key not in store:
+        return None
+    nrows = store.get_storer(key).nrows
+    if not nrows:
+        return None
+    return store.select_column(key, 'index', start=nrows - 1, stop=nrows).iloc[-1]
+
+
+def upsert_bars(store: HDFStore, symbol: str, data: pd.DataFrame) -> int:
+    """
+    Appends only the bars newer than the last bar already stored for the symbol,
+    so overlapping fetch windows never duplicate rows in the table.
+
+    Parameters:
+        store (HDFStore): Store opened in append mode.
+        symbol (str): Symbol key.
+        data (DataFrame): Bars indexed by time; may overlap the stored table.
+
+    Returns:
+        int: The number of appended rows.
+    """
+    return len(_upsert_bars(store, symbol, data))
+
+
+def _new_bars(data: pd.DataFrame, last_bar: Optional[pd.Timestamp]) -> pd.DataFrame:
+    if last_bar is not None:
+        data = data[data.index > last_bar]
+    return data[~data.index.duplicated(keep='last')].sort_index()
+
+
+def _upsert_bars(store: HDFStore, symbol: str, data: pd.DataFrame) -> pd.DataFrame:
+    data = _new_bars(data, last_stored_bar(store, symbol))
+    if len(data) > 0:
+        store.append(symbol, data, format='table', data_columns=True)
+    return data
+
+
+def _tail_bars(data: pd.DataFrame) -> pd.DataFrame:
+    return data[~data.index.duplicated(keep='last')].sort_index()
+
+
+class PriceStore(ABC):
+    """
+    Per-symbol OHLCV storage indexed by bar time. All readers and writers go through this interface,
+    so the backing format (HDF5 or Arrow) can be switched by path.
+    Every store keeps a symbol catalog sidecar (`<store path>.catalog.json`) up to date on append,
+    so listing symbols and filtering the universe never walk the price tables. Indicator results are cached
+    next to it in `<store path>.indicators` (see indicator_cache.IndicatorCache) and the aligned
+    (dates x symbols) arrays in `<store path>.panel` (see panel.build_panel).
+    """
+
+    def __init__(self, store_path: str, mode: StoreMode):
+        self.mode = mode
+        self.store_path = str(store_path).rstrip('/\\')
+        self.catalog_path = self.store_path + '.catalog.json'
+        self.indicator_cache_dir = self.store_path + '.indicators'
+        self.panel_dir = self.store_path + '.panel'
+        if mode == 'w' and os.path.exists(self.catalog_path):
+            os.remove(self.catalog_path)
+        if mode == 'w':
+            # data versions restart with the rewritten store, so cached indicators and panels can't be validated anymore
+            shutil.rmtree(self.indicator_cache_dir, ignore_errors=True)
+            shutil.rmtree(self.panel_dir, ignore_errors=True)
+        self.catalog: Optional[SymbolCatalog] = SymbolCatalog.load(self.catalog_path)
+
+    def _init_catalog(self):
+        # called by the backends once the storage is open
+        if self.catalog is not None:
+            return
+        if self.mode == 'w':
+            self.catalog = SymbolCatalog(self.catalog_path)
+        elif self.mode == 'a':
+            self.rebuild_catalog()
+
+    def rebuild_catalog(self) -> SymbolCatalog:
+        """
+        Rebuilds the catalog by reading every symbol once (needed for stores written before the catalog existed).
+        """
+        catalog = SymbolCatalog(self.catalog_path)
+        symbols = self._list_symbols()
+        if symbols:
+            logging.info(f"Building symbol catalog {self.catalog_path}")
+        for symbol in tqdm(sorted(symbols), desc="Building symbol catalog", disable=not symbols):
+            catalog.update(symbol, self.read(symbol))
+        self.catalog = catalog
+        if self.mode != 'r':
+            catalog.save()
+        return catalog
+
+    def symbols(self) -> Set[str]:
+        if self.catalog is not None:
+            return self.catalog.symbols()
+        return self._list_symbols()
+
+    @abstractmethod
+    def _list_symbols(self) -> Set[str]:
+        ...
+
+    @abstractmethod
+    def read(self, symbol: str, start=None, end=None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Returns the bars of the symbol in [start, end] (both optional), only reading the requested range.
+        """
+        ...
+
+    @abstractmethod
+    def last_bar(self, symbol: str) -> Optional[pd.Timestamp]:
+        ...
+
+    def append(self, symbol: str, data: pd.DataFrame) -> int:
+        """
+        Appends the bars newer than the last stored bar of the symbol and returns the number of appended rows.
+        """
+        if self.mode == 'r':
+            raise ValueError("store is opened read-only")
+        appended = self._append(symbol, data)
+        if self.catalog is not None:
+            self.catalog.update(symbol, appended)
+        return len(appended)
+
+    @abstractmethod
+    def _append(self, symbol: str, data: pd.DataFrame) -> pd.DataFrame:
+        # returns the rows that were actually appended
+        ...
+
+    def replace_tail(self, symbol: str, data: pd.DataFrame) -> int:
+        """
+        Replaces the stored bars of the symbol from the first bar of `data` on with `data`, for tables whose last
+        bars are rewritten as they change (e.g. the partial bucket of a resampled timeframe).
+
+        Returns:
+            int: The number of replaced (removed) rows.
+        """
+        if self.mode == 'r':
+            raise ValueError("store is opened read-only")
+        data = _tail_bars(data)
+        if len(data) == 0:
+            return 0
+        removed = self._replace_tail(symbol, data)
+        if self.catalog is not None:
+            self.catalog.update(symbol, data, removed=removed)
+        return removed
+
+    @abstractmethod
+    def _replace_tail(self, symbol: str, data: pd.DataFrame) -> int:
+        # returns the number of removed rows
+        ...
+
+    def read_column(self, symbols: Iterable[str], column: str, start=None, end=None) -> pd.DataFrame:
+        """
+        Returns one column of many symbols as a (bars x symbols) dataframe.
+        """
+        return pd.DataFrame({symbol: self.read(symbol, start, end, columns=[column])[column] for symbol in symbols})
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.symbols()
+
+    def close(self):
+        if self.catalog is not None and self.mode != 'r':
+            self.catalog.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class HDFPriceStore(PriceStore):
+    """
+    Price store backed by a single HDF5 file with one table per symbol.
+    """
+
+    def __init__(self, h5_file_path: str, mode: StoreMode = 'a'):
+        super().__init__(h5_file_path, mode)
+        self.path = str(h5_file_path)
+        self.store = pd.HDFStore(self.path, mode=mode)
+        self._init_catalog()
+
+    def _list_symbols(self) -> Set[str]:
+        return {key[1:] for key in self.store.keys()}
+
+    def read(self, symbol: str, start=None, end=None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        conditions = []
+        if start is not None:
+            conditions.append('index >= start')
+        if end is not None:
+            conditions.append('index <= end')
+        where = ' & '.join(conditions) if conditions else None
+        return self.store.select(_key(symbol), where=where, columns=columns)
+
+    def last_bar(self, symbol: str) -> Optional[pd.Timestamp]:
+        return last_stored_bar(self.store, symbol)
+
+    def _append(self, symbol: str, data: pd.DataFrame) -> pd.DataFrame:
+        return _upsert_bars(self.store, symbol, data)
+
+    def _replace_tail(self, symbol: str, data: pd.DataFrame) -> int:
+        removed = 0
+        if _key(symbol) in self.store:
+            start = data.index[0]
+            removed = self.store.remove(_key(symbol), where='index >= start') or 0
+        self.store.append(symbol, data, format='table', data_columns=True)
+        return removed
+
+    def close(self):
+        super().close()
+        self.store.close()
+
+
+class ArrowPriceStore(PriceStore):
+    """
+    Columnar price store: one uncompressed Arrow IPC file per symbol and year, month or day
+    (`<root>/<SYMBOL>/<YEAR>.arrow`, `<YEAR-MM>.arrow`, `<YEAR-MM-DD>.arrow`). Files are memory-mapped on read,
+    so loading a symbol's history or a single column of many symbols maps the stored buffers instead of copying
+    a table. Appends only rewrite the latest partition, so intraday stores use day partitions
+    (bar times are partitioned by their local date).
+
+    Frames returned by read() may keep their partitions mapped. On Windows a mapped file can't be replaced, so
+    drop them before appending to the same symbol's latest partitions; the store's own writes never map the
+    partitions they rewrite.
+    """
+    index_column = '__index__'
+
+    def __init__(self, root: str, mode: StoreMode = 'a', partition: Optional[Partition] = None):
+        """
+        Parameters:
+            root (str): Root directory of the store.
+            mode (str): 'r', 'a' or 'w'.
+            partition (str): Partition of new stores ('year' by default); existing stores keep theirs.
+        """
+        if pa is None:
+            raise ImportError("ArrowPriceStore requires pyarrow (pip install pyarrow)")
+        super().__init__(root, mode)
+        self.root = Path(root)
+        if mode == 'w' and self.root.exists():
+            shutil.rmtree(self.root)
+        if mode != 'r':
+            self.root.mkdir(parents=True, exist_ok=True)
+        self.partition: Partition = self._stored_partition() or partition or 'year'
+        self._init_catalog()
+
+    def _stored_partition(self) -> Optional[Partition]:
+        # the partition of an existing store, from the length of any of its file names
+        stored_file = next(self.root.glob('*/*.arrow'), None) if self.root.is_dir() else None
+        if stored_file is None:
+            return None
+        return {4: 'year', 7: 'month', 10: 'day'}[len(stored_file.stem)]
+
+    def _symbol_files(self, symbol: str) -> List[Path]:
+        # partition files of the symbol in time order (names of the same format sort as their dates)
+        symbol_dir = self.root / symbol
+        if not symbol_dir.is_dir():
+            return []
+        return sorted(symbol_dir.glob('*.arrow'), key=lambda partition_file: partition_file.stem)
+
+    def _partition_files(self, symbol: str, start=None, end=None) -> List[Path]:
+        # partitions overlapping [start, end], compared by name (the names of the partitions a time falls in sort as
+        # the time); wall times with a day of margin, bars of tz-aware stores being partitioned by local date
+        partition_format = PARTITION_FORMATS[self.partition]
+        partition_files = self._symbol_files(symbol)
+        if start is not None:
+            first = (pd.Timestamp(start).tz_localize(None) - pd.Timedelta(days=1)).strftime(partition_format)
+            partition_files = [f for f in partition_files if f.stem >= first]
+        if end is not None:
+            last = (pd.Timestamp(end).tz_localize(None) + pd.Timedelta(days=1)).strftime(partition_format)
+            partition_files = [f for f in partition_files if f.stem <= last]
+        return partition_files
+
+    def _partition_keys(self, index: pd.DatetimeIndex) -> np.ndarray:
+        if self.partition == 'year':
+            return np.asarray(index.year)
+        if self.partition == 'month':
+            return np.asarray(index.year * 100 + index.month)
+        return np.asarray(index.year * 10000 + index.month * 100 + index.day)
+
+    @staticmethod
+    def _read_table(partition_file: Path, columns: Optional[List[str]] = None) -> 'pa.Table':
+        table = pa.ipc.open_file(pa.memory_map(str(partition_file), 'r')).read_all()
+        return table if columns is None else table.select(columns)
+
+    @staticmethod
+    def _load_table(partition_file: Path) -> 'pa.Table':
+        # reads a partition that is about to be rewritten into memory and closes it: frames of mapped tables keep
+        # the file mapped, and Windows can't replace a mapped file
+        with pa.OSFile(str(partition_file), 'rb') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def _to_frame(self, table: 'pa.Table', index_name: Optional[str]) -> pd.DataFrame:
+        df = table.to_pandas(split_blocks=True)
+        df = df.set_index(self.index_column)
+        df.index.name = index_name
+        return df
+
+    def _list_symbols(self) -> Set[str]:
+        if not self.root.is_dir():
+            return set()
+        return {symbol_dir.name for symbol_dir in self.root.iterdir() if symbol_dir.is_dir()}
+
+    def read(self, symbol: str, start=None, end=None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        all_symbol_files = self._symbol_files(symbol)
+        if not all_symbol_files:
+            raise KeyError(f"No object named {symbol} in the store")
+        partition_files = all_symbol_files
+        if start is not None or end is not None:
+            partition_files = self._partition_files(symbol, start, end)
+        read_columns = None if columns is None else [self.index_column] + list(columns)
+        tables = [self._read_table(partition_file, read_columns) for partition_file in partition_files]
+        if not tables:
+            tables = [self._read_table(all_symbol_files[0], read_columns).slice(0, 0)]
+        table = pa.concat_tables(tables)
+        index_name = (table.schema.metadata or {}).get(b'index_name', b'').decode() or None
+        df = self._to_frame(table, index_name)
+        if start is not None or end is not None:
+            df = df.loc[start:end]
+        return df
+
+    def last_bar(self, symbol: str) -> Optional[pd.Timestamp]:
+        partition_files = self._symbol_files(symbol)
+        if not partition_files:
+            return None
+        index = self._read_table(partition_files[-1], [self.index_column]).column(0)
+        return pd.Timestamp(index[len(index) - 1].as_py()) if len(index) else None
+
+    def _write_partition(self, partition_file: Path, df: pd.DataFrame):
+        index_name = df.index.name
+        table = pa.Table.from_pandas(df.rename_axis(self.index_column).reset_index(), preserve_index=False)
+        table = table.replace_schema_metadata({b'index_name': (index_name or '').encode()})
+        tmp_file = partition_file.with_suffix('.tmp')
+        with pa.OSFile(str(tmp_file), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_file, partition_file)
+
+    def _write_partitions(self, symbol: str, data: pd.DataFrame, merge: bool = True) -> List[Path]:
+        # writes the bars to their partitions, after the stored bars of each partition when merging
+        symbol_dir = self.root / symbol
+        symbol_dir.mkdir(parents=True, exist_ok=True)
+        partition_format = PARTITION_FORMATS[self.partition]
+        partition_files = []
+        keys = self._partition_keys(data.index)
+        bounds = np.flatnonzero(np.diff(keys)) + 1  # the bars are sorted, each partition is a slice
+        for partition_data in (data.iloc[i:j] for i, j in zip(np.r_[0, bounds], np.r_[bounds, len(data)])):
+            partition_file = symbol_dir / f'{partition_data.index[0].strftime(partition_format)}.arrow'
+            if merge and partition_file.exists():
+                stored = self._to_frame(self._load_table(partition_file), partition_data.index.name)
+                partition_data = pd.concat([stored, partition_data])
+            self._write_partition(partition_file, partition_data)
+            partition_files.append(partition_file)
+        return partition_files
+
+    def _append(self, symbol: str, data: pd.DataFrame) -> pd.DataFrame:
+        data = _new_bars(data, self.last_bar(symbol))
+        if len(data) == 0:
+            return data
+        # only the touched (latest) partition is rewritten
+        self._write_partitions(symbol, data)
+        return data
+
+    def _replace_tail(self, symbol: str, data: pd.DataFrame) -> int:
+        start = data.index[0]
+        replaced_files = []
+        removed = 0
+        kept = []
+        for partition_file in self._partition_files(symbol, start=start):
+            stored = self._to_frame(self._load_table(partition_file), data.index.name)
+            is_replaced = stored.index >= start
+            if not is_replaced.any():
+                continue
+            replaced_files.append(partition_file)
+            removed += int(is_replaced.sum())
+            kept.append(stored[~is_replaced])
+        # each partition is replaced at once; partitions left without bars are removed after
+        written_files = self._write_partitions(symbol, pd.concat(kept + [data]), merge=False)
+        for partition_file in set(replaced_files) - set(written_files):
+            partition_file.unlink()
+        return removed
+
+def open_price_store(store_path: str, mode: StoreMode = 'a') -> PriceStore:
+    """
+    Opens the price store at the given path: `.h5` files use the HDF5 backend, `.intraday` directories hold
+    5m bars with their resampled timeframes (see intraday_store.IntradayStore), any other path is treated as
+    the root directory of an Arrow store.
+    """
+    if str(store_path).endswith('.h5'):
+        return HDFPriceStore(store_path, mode)
+    if str(store_path).rstrip('/\\').endswith('.intraday'):
+        # imported here, the intraday store builds on this module
+        from src.intraday_store import IntradayStore
+        return IntradayStore(store_path, mode)
+    return ArrowPriceStore(store_path, mode)
+
+
+def compact_store(h5_file_path: str, complevel: int = 9, complib: str = 'blosc:zstd'):
+    """
+    Rewrites every table of the store sorted by index, without duplicated bars, recompressed and with a
+    full (completely sorted) index on the index column, similar to `ptrepack --sortby --propindexes`.
+    The compacted file replaces the original only once it has been fully written.
+    Writers must not append to the store while it is being compacted.
+
+    Parameters:
+        h5_file_path (str): Path to the HDF5 store.
+        complevel (int): Compression level of the rewritten tables.
+        complib (str): Compression library of the rewritten tables.
+    """
+    tmp_file_path = h5_file_path + '.compact.tmp'
+    catalog_path = h5_file_path + '.catalog.json'
+    old_catalog = SymbolCatalog.load(catalog_path) or SymbolCatalog(catalog_path)
+    catalog = SymbolCatalog(catalog_path)
+    with pd.HDFStore(h5_file_path, mode='r') as store, \
+            pd.HDFStore(tmp_file_path, mode='w', complevel=complevel, complib=complib) as compacted:
+        for key in tqdm(store.keys(), desc=f"Compacting {h5_file_path}"):
+            df = store.get(key)
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+            compacted.put(key, df, format='table', data_columns=True, index=False)
+            compacted.create_table_index(key, columns=['index'], optlevel=9, kind='full')
+            # rows may have changed, so the data version moves past the old one
+            symbol = key[1:]
+            catalog.update(symbol, df)
+            catalog.entries[symbol].version = old_catalog.version(symbol) + 1
+    os.replace(tmp_file_path, h5_file_path)
+    catalog.save()
+    logging.info(f"Compacted {h5_file_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price store maintenance")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help="sort, deduplicate and recompress every table")
+    compact_parser.add_argument('h5_file_path')
+    compact_parser.add_argument('--complevel', type=int, default=9)
+    compact_parser.add_argument('--complib', default='blosc:zstd')
+    catalog_parser = subparsers.add_parser('catalog', help="rebuild the symbol catalog sidecar")
+    catalog_parser.add_argument('store_path')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        compact_store(args.h5_file_path, complevel=args.complevel, complib=args.complib)
+    elif args.command == 'catalog':
+        with open_price_store(args.store_path, mode='a') as store:
+            store.rebuild_catalog()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,181 @@
+import math
+from collections import deque
+from typing import Any, Dict, Type
+
+import numpy as np
+
+# streaming classes by name, for restoring nested state (see StreamingState.from_dict)
+STATE_TYPES: Dict[str, Type['StreamingState']] = {}
+
+
+def _dump(value: Any) -> Any:
+    if isinstance(value, StreamingState):
+        return {'__type__': type(value).__name__, 'state': value.to_dict()}
+    if isinstance(value, deque):
+        return {'__deque__': list(value), 'maxlen': value.maxlen}
+    return value
+
+
+def _load(value: Any) -> Any:
+    if isinstance(value, dict) and '__type__' in value:
+        return STATE_TYPES[value['__type__']].from_dict(value['state'])
+    if isinstance(value, dict) and '__deque__' in value:
+        return deque(value['__deque__'], maxlen=value['maxlen'])
+    return value
+
+
+class StreamingState:
+    """
+    Base of the streaming indicators and strategies: state is a flat set of attributes
+    (floats, ints, deques and nested streaming objects) that round-trips through JSON via to_dict/from_dict.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        STATE_TYPES[cls.__name__] = cls
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: _dump(value) for name, value in vars(self).items()}
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]):
+        obj = cls.__new__(cls)
+        for name, value in state.items():
+            setattr(obj, name, _load(value))
+        return obj
+
+
+class RollingMean(StreamingState):
+    """
+    Simple moving average updated one value at a time, bit-for-bit equal to vbt.MA / indicators.sma
+    (same running-sum arithmetic as vbt's rolling_mean_1d_nb).
+    """
+
+    def __init__(self, window: int = 20):
+        self.window = window
+        self.bars = 0
+        self.cumsum = 0.0
+        self.nancnt = 0
+        # (cumsum, nancnt) of the last `window` bars
+        self.history = deque(maxlen=window)
+
+    def update(self, value: float) -> float:
+        if math.isnan(value):
+            self.nancnt += 1
+        else:
+            self.cumsum = self.cumsum + value
+        if self.bars < self.window:
+            window_len = self.bars + 1 - self.nancnt
+            window_cumsum = self.cumsum
+        else:
+            old_cumsum, old_nancnt = self.history[0]
+            window_len = self.window - (self.nancnt - old_nancnt)
+            window_cumsum = self.cumsum - old_cumsum
+        self.history.append((self.cumsum, self.nancnt))
+        self.bars += 1
+        return np.nan if window_len < self.window else window_cumsum / window_len
+
+
+class AverageTrueRange(StreamingState):
+    """
+    ATR updated one bar at a time, bit-for-bit equal to vbt.ATR / indicators.atr
+    (exponential average of the true range with span `window`, adjust=False, NaN for the first window - 1 bars).
+    """
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.bars = 0
+        self.prev_close = np.nan
+        self.weighted_avg = np.nan
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, high: float, low: float, close: float) -> float:
+        true_range = high - low
+        if self.bars > 0:
+            true_range = max(true_range, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        is_observation = true_range == true_range
+        self.nobs += int(is_observation)
+
+        if self.bars == 0:
+            self.weighted_avg = true_range
+        elif self.weighted_avg == self.weighted_avg:
+            alpha = 1.0 / (1.0 + (self.window - 1) / 2.0)
+            self.old_wt *= 1.0 - alpha
+            if is_observation:
+                if self.weighted_avg != true_range:
+                    self.weighted_avg = ((self.old_wt * self.weighted_avg) + (alpha * true_range)) / (self.old_wt + alpha)
+                self.old_wt = 1.0
+        elif is_observation:
+            self.weighted_avg = true_range
+        self.bars += 1
+        return self.weighted_avg if self.nobs >= self.window else np.nan
+
+
+class CommodityChannelIndex(StreamingState):
+    """
+    CCI updated one bar at a time, equal to indicators.cci. A bar costs O(window): the mean absolute deviation
+    from the window's mean has to revisit every typical price of the window whenever the mean moves, and the
+    mean is summed the same way as the batch function so the values stay bit-for-bit equal.
+    """
+
+    def __init__(self, window: int = 14, c: float = 0.015):
+        self.window = window
+        self.c = c
+        self.typical_prices = deque(maxlen=window)
+
+    def update(self, high: float, low: float, close: float) -> float:
+        typical_price = (high + low + close) / 3.0
+        self.typical_prices.append(typical_price)
+        if len(self.typical_prices) < self.window:
+            return np.nan
+        window = np.array(self.typical_prices)
+        mean = window.mean()
+        mean_abs_deviation = np.abs(window - mean).mean()
+        return float((typical_price - mean) / (self.c * mean_abs_deviation))
+
+
+class TrailingStop(StreamingState):
+    """
+    ATR trailing stop updated one bar at a time, equal to backtest_vectorbt.atr_trailing_stop:
+    reset to `low - stop_multiple * atr` on entry bars and only ratcheting up afterwards.
+    """
+
+    def __init__(self, stop_multiple: float = 3):
+        self.stop_multiple = float(stop_multiple)
+        self.bars = 0
+        self.stop = np.nan
+
+    def update(self, low: float, atr: float, enter: bool) -> float:
+        if self.bars > 0:
+            stop = low - self.stop_multiple * atr
+            if enter or stop > self.stop:
+                self.stop = stop
+        self.bars += 1
+        return self.stop
+
+
+class CrossedAbove(StreamingState):
+    """
+    True on the bar `a` crosses above `b`, same state machine as vbt's crossed_above_1d_nb.
+    """
+
+    def __init__(self):
+        self.was_below = False
+        self.crossed_ago = -1
+
+    def update(self, a: float, b: float) -> bool:
+        if math.isnan(a) or math.isnan(b):
+            self.crossed_ago = -1
+            self.was_below = False
+            return False
+        if a > b:
+            if self.was_below:
+                self.crossed_ago += 1
+                return self.crossed_ago == 0
+            return False
+        self.crossed_ago = -1
+        if a < b:
+            self.was_below = True
+        return False
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+import vectorbt as vbt
+
+from src.backtest.backtest_vectorbt import cci_cross_zero2_signals, moving_avg_breakout, moving_avg_breakout_signals
+from src.backtest.reference import legacy_moving_avg_breakout, synthetic_bars
+from src.indicators import price_arrays
+
+
+def _loop_cci_cross_zero2(cci_values: np.ndarray):
+    # the state machine cci_cross_zero2 ran before it was vectorized, kept as written. Its exit array has one
+    # spare bar, because the loop writes exit_signal[i+1] past the end when the entry is on the last bar
+    entry_signal = np.zeros(len(cci_values), dtype=bool)
+    exit_signal = np.zeros(len(cci_values) + 1, dtype=bool)
+    below_neg100 = cci_values < -100
+    above_zero = cci_values >= 0
+
+    i = 1
+    while i < len(cci_values)-1:
+        # Entry condition
+        if below_neg100[i - 1]:
+            while (i < len(cci_values)) and (cci_values[i] > cci_values[i - 1]):
+                if above_zero[i]:
+                    entry_signal[i] = True
+                    exit_signal[i+1] = True
+                    break
+                else:
+                    i+=1
+        i+=1
+    return entry_signal, exit_signal[:len(cci_values)]
+
+
+def _assert_same_as_loop(cci_values: np.ndarray):
+    expected_entry, expected_exit = _loop_cci_cross_zero2(cci_values)
+    entry_signal, exit_signal = cci_cross_zero2_signals(cci_values)
+    np.testing.assert_array_equal(entry_signal, expected_entry)
+    np.testing.assert_array_equal(exit_signal, expected_exit)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_cci_cross_zero2_signals_match_loop_on_random_cci(seed):
+    rng = np.random.default_rng(seed)
+    n_bars = int(rng.integers(3, 300))
+    # a random walk around zero crosses -100 and 0 often, rounding creates ties (not rising)
+    cci_values = np.round(np.cumsum(rng.normal(0, 60, n_bars)) % 400 - 200, int(rng.integers(0, 2)))
+    _assert_same_as_loop(cci_values)
+
+
+def test_cci_cross_zero2_signals_match_loop_with_nan_warm_up():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        cci_values = rng.uniform(-250, 150, 120)
+        cci_values[:13] = np.nan
+        _assert_same_as_loop(cci_values)
+
+
+@pytest.mark.parametrize('cci_values', [
+    # run ending on the last bar: the entry is on the final bar, the loop's exit falls off the end
+    [50, -150, -50, 10],
+    # run ending on the bar before the last
+    [50, -150, -50, 10, 20],
+    # run starting on the second to last bar, never scanned by the loop
+    [50, 0, -150, 10],
+    # run starting on the last bar
+    [50, 0, 0, -150],
+    # back-to-back runs starting below -100
+    [-150, -50, 10, -150, -20, 5, -120, -130, -10, 30, 40],
+    # a run that stalls below zero, then a new run from above -100
+    [-150, -120, -120, -50, 10, 0],
+])
+def test_cci_cross_zero2_signals_match_loop_on_edge_cases(cci_values):
+    _assert_same_as_loop(np.asarray(cci_values, dtype=np.float64))
+
+
+def test_cci_cross_zero2_signals_columns_match_loop():
+    rng = np.random.default_rng(1)
+    cci_values = rng.uniform(-250, 150, (200, 20))
+    entry_signal, exit_signal = cci_cross_zero2_signals(cci_values)
+    for column in range(cci_values.shape[1]):
+        expected_entry, expected_exit = _loop_cci_cross_zero2(cci_values[:, column])
+        np.testing.assert_array_equal(entry_signal[:, column], expected_entry)
+        np.testing.assert_array_equal(exit_signal[:, column], expected_exit)
+
+
+def _frame_moving_avg_breakout(df: pd.DataFrame, ma_period: int = 20, lookback: int = 10):
+    entry_signal, exit_signal = legacy_moving_avg_breakout(df.copy(), ma_period, lookback)
+    return entry_signal.astype(bool).to_numpy(), exit_signal.to_numpy()
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_moving_avg_breakout_matches_frame_version(seed):
+    df = synthetic_bars(1500, seed)
+    columns = list(df.columns)
+    entry_signal, exit_signal = moving_avg_breakout(**price_arrays(df))
+    expected_entry, expected_exit = _frame_moving_avg_breakout(df)
+    np.testing.assert_array_equal(entry_signal, expected_entry)
+    np.testing.assert_array_equal(exit_signal, expected_exit)
+    assert list(df.columns) == columns
+
+
+def test_moving_avg_breakout_signals_columns_match_frame_version():
+    df = synthetic_bars(2000, 42)
+    combinations = [(ma_period, lookback) for ma_period in (10, 20, 50) for lookback in (3, 10, 25)]
+    ma_periods = sorted({ma_period for ma_period, _ in combinations})
+    mas = vbt.MA.run(df['close'].to_numpy(), window=ma_periods).ma.to_numpy()
+    ma = mas[:, [ma_periods.index(ma_period) for ma_period, _ in combinations]]
+    entry_signal, exit_signal = moving_avg_breakout_signals(
+        df['close'].to_numpy(), ma, np.array([lookback for _, lookback in combinations]))
+    for column, (ma_period, lookback) in enumerate(combinations):
+        expected_entry, expected_exit = _frame_moving_avg_breakout(df, ma_period, lookback)
+        np.testing.assert_array_equal(entry_signal[:, column], expected_entry)
+        np.testing.assert_array_equal(exit_signal[:, column], expected_exit)
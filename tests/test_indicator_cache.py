@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.backtest.reference import synthetic_bars
+from src.indicator_cache import IndicatorCache
+from src.indicators import INDICATORS, price_arrays
+from src.price_store import open_price_store
+
+PARAMS = {'sma': {'window': 20}, 'atr': {'window': 14}, 'cci': {'window': 14}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    with open_price_store(str(tmp_path / 'prices.h5'), 'w') as store:
+        store.append('A', synthetic_bars(500, column_case='title'))
+        yield store
+
+
+def _assert_computed(cache: IndicatorCache, name: str, df: pd.DataFrame):
+    values = cache.for_symbol('A', df)(name, **PARAMS[name])
+    np.testing.assert_allclose(values, INDICATORS[name].compute(price_arrays(df), **PARAMS[name]), rtol=1e-9)
+
+
+@pytest.mark.parametrize('name', sorted(PARAMS))
+def test_windows_are_served_from_one_file(store, name):
+    cache = IndicatorCache(store)
+    df = store.read('A')
+    _assert_computed(cache, name, df)
+    for start, stop in ((0, 300), (100, 500), (250, 260), (499, 500)):
+        _assert_computed(cache, name, df.iloc[start:stop])
+        # a fresh cache reads the file
+        _assert_computed(IndicatorCache(store), name, df.iloc[start:stop])
+    assert len(list((cache.cache_dir / 'A').iterdir())) == 1
+
+
+@pytest.mark.parametrize('name', ['sma', 'cci'])
+def test_sliding_window_extends_the_cached_bars(store, name):
+    cache = IndicatorCache(store)
+    _assert_computed(cache, name, store.read('A').iloc[-200:])
+    more = synthetic_bars(520, column_case='title').iloc[500:]
+    store.append('A', more)
+    df = store.read('A')
+    _assert_computed(cache, name, df.iloc[-200:])
+    key = ('A', name, tuple(sorted(PARAMS[name].items())))
+    np.testing.assert_array_equal(cache._entries[key].bar_times[-20:], more.index.asi8)
+    assert len(list((cache.cache_dir / 'A').iterdir())) == 1
+
+
+def test_sliding_window_of_history_dependent_indicator(store):
+    # atr over a window starting after the cached bars is not a slice of the cached values
+    cache = IndicatorCache(store)
+    _assert_computed(cache, 'atr', store.read('A').iloc[-200:])
+    store.append('A', synthetic_bars(520, column_case='title').iloc[500:])
+    _assert_computed(cache, 'atr', store.read('A').iloc[-200:])
+
+
+def test_replaced_prices_are_recomputed(store):
+    cache = IndicatorCache(store)
+    df = store.read('A')
+    _assert_computed(cache, 'sma', df)
+    changed = df.copy()
+    changed.iloc[-5:, :4] *= 1.1
+    store.replace_tail('A', changed.iloc[-5:])
+    _assert_computed(cache, 'sma', store.read('A'))
+    _assert_computed(cache, 'sma', store.read('A').iloc[-100:])
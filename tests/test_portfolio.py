@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+import vectorbt as vbt
+
+from src.backtest.backtest_vectorbt import STRATEGIES
+from src.backtest.portfolio import simulate_portfolio
+from src.panel import build_panel
+from src.price_store import open_price_store
+
+
+@pytest.fixture(scope='module')
+def panel(tmp_path_factory):
+    store_path = str(tmp_path_factory.mktemp('portfolio') / 'prices.h5')
+    rng = np.random.default_rng(3)
+    dates = pd.bdate_range('2015-01-01', periods=1200)
+    with open_price_store(store_path, 'w') as store:
+        for i in range(20):
+            # staggered listings, so the panel has NaN heads
+            index = dates[i * 20:]
+            close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(index))))
+            store.append(f'S{i:02d}', pd.DataFrame({
+                'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                'Volume': rng.integers(100_000, 1_000_000, len(index)).astype(float)}, index=index))
+        return build_panel(store)
+
+
+def test_matches_vectorbt_cash_sharing(panel):
+    # fixed-value positions and ample cash: the same orders as vectorbt's grouped cash-sharing simulation
+    result = simulate_portfolio(panel, 'moving_avg_breakout', init_cash=1e9, max_positions=1000, position_size=1.0,
+                                max_position_value=1000.0, fees=0.001)
+    close = panel.frame('close')
+    entries, exits = STRATEGIES['moving_avg_breakout'](high=np.array(panel.field('high')),
+                                                       low=np.array(panel.field('low')), close=close.to_numpy())
+    size = np.where(entries, 1000 / (close.to_numpy() * 1.001), np.inf)
+    portfolio = vbt.Portfolio.from_signals(close, entries, exits, size=size, fees=0.001, init_cash=1e9,
+                                           cash_sharing=True, group_by=True, call_seq='auto', freq='1d')
+    assert len(result.orders) == portfolio.orders.count() > 0
+    np.testing.assert_allclose(result.equity.to_numpy(), portfolio.value().to_numpy(), rtol=1e-12)
+
+
+def test_chunks_and_blocks_do_not_change_the_result(panel):
+    whole = simulate_portfolio(panel, 'ma_150_crossed', max_positions=5, fees=0.001, chunk_bars=10_000)
+    chunked = simulate_portfolio(panel, 'ma_150_crossed', max_positions=5, fees=0.001, chunk_bars=37, block_size=7)
+    np.testing.assert_array_equal(whole.equity.to_numpy(), chunked.equity.to_numpy())
+    pd.testing.assert_frame_equal(whole.orders, chunked.orders)
+
+
+def test_limits(panel):
+    result = simulate_portfolio(panel, 'ma_150_crossed', max_positions=3, max_position_value=20_000)
+    assert result.positions.max() == 3
+    assert (result.cash >= -1e-6).all()
+    buys = result.orders[result.orders['size'] > 0]
+    assert (buys['size'] * buys['price'] <= 20_000 + 1e-6).all()
+
+
+def test_start_and_end(panel):
+    result = simulate_portfolio(panel, 'ma_150_crossed', start='2017-01-01', end='2018-12-31')
+    assert result.equity.index[0] == pd.Timestamp('2017-01-02')
+    assert result.equity.index[-1] == pd.Timestamp('2018-12-31')
+
+
+def test_positions_of_delisted_symbols_are_sold(tmp_path):
+    dates = pd.bdate_range('2020-01-01', periods=300)
+    close = np.where(np.arange(300) % 40 < 20, 100.0, 110.0)
+    with open_price_store(str(tmp_path / 'prices.h5'), 'w') as store:
+        for symbol, bars in (('LISTED', 300), ('DELISTED', 150)):
+            store.append(symbol, pd.DataFrame({
+                'Open': close[:bars], 'High': close[:bars], 'Low': close[:bars], 'Close': close[:bars],
+                'Volume': 1e6}, index=dates[:bars]))
+        panel = build_panel(store)
+    # an MA of 10 bars: entries when the price steps up, never an exit while it stays up at the delisting
+    result = simulate_portfolio(panel, 'ma_150_crossed', max_positions=2, ma_window=10, stop_multiple=1000)
+    delisted = result.orders[result.orders['symbol'] == 'DELISTED']
+    assert delisted['size'].sum() == pytest.approx(0)
+    assert delisted['date'].iloc[-1] == dates[149]
+    assert result.positions.iloc[-1] == 1
+
+
+def test_start_and_end_on_intraday_panel(tmp_path):
+    index = pd.date_range('2024-02-01 09:30', periods=400, freq='5min', tz='America/New_York')
+    close = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.002, len(index))))
+    with open_price_store(str(tmp_path / 'prices.h5'), 'w') as store:
+        store.append('A', pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1e6},
+                                       index=index))
+        panel = build_panel(store)
+    result = simulate_portfolio(panel, 'ma_150_crossed', start='2024-02-01 12:00', end='2024-02-02 09:00',
+                                freq='5min')
+    assert result.equity.index[0] == pd.Timestamp('2024-02-01 12:00', tz='America/New_York')
+    assert result.equity.index[-1] == pd.Timestamp('2024-02-02 09:00', tz='America/New_York')
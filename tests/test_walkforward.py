@@ -0,0 +1,54 @@
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.backtest.backtest_vectorbt import STRATEGIES
+from src.backtest.reference import synthetic_bars
+from src.backtest.walkforward import (CONVERGENCE_TOLERANCE, PARAM_GRIDS, _read_with_warmup, walk_forward_windows,
+                                      warmup_bars)
+from src.indicators import INDICATORS, price_arrays
+from src.price_store import open_price_store
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    with open_price_store(str(tmp_path_factory.mktemp('walkforward') / 'prices.h5'), 'w') as store:
+        store.append('A', synthetic_bars(2000, column_case='title'))
+        yield store
+
+
+def test_warmup_only_counts_requested_indicators():
+    # no ATR is computed without atr_mult: the largest MA's NaN head plus the longest lookback
+    assert warmup_bars('moving_avg_breakout', {'ma_period': [10, 50], 'lookback': [5, 20]}) == 49 + 20
+    assert warmup_bars('moving_avg_breakout', {'ma_period': [10], 'lookback': [5], 'atr_mult': [1.0]}) > 9 + 5
+
+
+@pytest.mark.parametrize('strategy', sorted(PARAM_GRIDS))
+def test_first_train_window_has_warmed_up_indicators(store, strategy):
+    grid = PARAM_GRIDS[strategy]
+    windows = walk_forward_windows('2011-01-01', '2016-12-31', pd.DateOffset(years=1), pd.DateOffset(months=6))
+    df = _read_with_warmup(store, 'A', windows[0].train_start, windows[-1].test_end, warmup_bars(strategy, grid))
+    full = store.read('A', end=windows[-1].test_end)
+    first = int(df.index.searchsorted(windows[0].train_start))
+    assert first > 0
+    prices, full_prices = price_arrays(df), price_arrays(full)
+    offset = len(full) - len(df)
+
+    names = list(grid)
+    for values in product(*(grid[name] for name in names)):
+        requested = []
+
+        def record(name, **params):
+            requested.append((name, params))
+            return INDICATORS[name].compute(prices, **params)
+
+        STRATEGIES[strategy](**prices, indicators=record, **dict(zip(names, values)))
+        for name, params in requested:
+            values_from_first = INDICATORS[name].compute(prices, **params)[first:]
+            assert not np.isnan(values_from_first).any()
+            # history-dependent indicators are as good as computed over the whole history
+            np.testing.assert_allclose(values_from_first,
+                                       INDICATORS[name].compute(full_prices, **params)[offset + first:],
+                                       rtol=CONVERGENCE_TOLERANCE)